@@ -281,8 +281,9 @@ if __name__ == '__main__':
                     'argument -d: invalid {} date: \'{}\''
                     .format(DATE_FORMAT, args.date))
 
+    baton = OpenBachBaton(args.agent, args.port)
     try:
-        baton = OpenBachBaton(args.agent, args.port)
+        baton.check_connection()
     except errors.ConductorError:
         parser.error(
                 'unable to communicate with agent on {}:{}'
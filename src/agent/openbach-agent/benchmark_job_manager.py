@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Micro-benchmark of the per-job locks of the agent JobManager.
+
+Threads repeatedly enter `JobManager.locked` and hold the lock for
+a while, either all on the same job or each on a job of its own,
+and the achieved throughput is printed. Run it from this folder:
+
+    python3 benchmark_job_manager.py --threads 8 --hold 100
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import time
+import argparse
+import threading
+
+import openbach_agent
+
+
+def register_jobs(manager, count):
+    """Register fake jobs directly in the registry, bypassing
+    the reading of their configuration files.
+    """
+    names = ['benchmark_job_{}'.format(i) for i in range(count)]
+    with manager._mutex:
+        for name in names:
+            manager.jobs[name] = {'instances': {}}
+            manager._locks[name] = threading.RLock()
+    return names
+
+
+def unregister_jobs(manager, names):
+    with manager._mutex:
+        for name in names:
+            manager.jobs.pop(name, None)
+            manager._locks.pop(name, None)
+
+
+def contend(manager, names, threads, iterations, hold):
+    """Have `threads` threads enter `locked` `iterations` times
+    each, spread over the given jobs, holding the lock `hold`
+    seconds every time. Return the number of locks per second.
+    """
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(name):
+        barrier.wait()
+        for _ in range(iterations):
+            with manager.locked(name):
+                if hold:
+                    time.sleep(hold)
+
+    workers = [
+            threading.Thread(target=worker, args=(names[i % len(names)],))
+            for i in range(threads)
+    ]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    return threads * iterations / (time.perf_counter() - started)
+
+
+def main(threads, iterations, hold):
+    manager = openbach_agent.JobManager()
+    names = register_jobs(manager, threads)
+    try:
+        for held in sorted({0, hold}):
+            single = contend(manager, names[:1], threads, iterations, held)
+            spread = contend(manager, names, threads, iterations, held)
+            print(
+                    'lock held {:.0f} µs: {:.0f} locks/s on a single job, '
+                    '{:.0f} locks/s with a job per thread'
+                    .format(held * 1e6, single, spread))
+    finally:
+        unregister_jobs(manager, names)
+        manager.scheduler.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__.splitlines()[0],
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-t', '--threads', type=int, default=8,
+            help='number of threads contending for the locks')
+    parser.add_argument(
+            '-i', '--iterations', type=int, default=2000,
+            help='number of times each thread takes a lock')
+    parser.add_argument(
+            '-H', '--hold', type=float, default=100,
+            help='time the lock is held, in microseconds')
+    args = parser.parse_args()
+    main(args.threads, args.iterations, args.hold / 1e6)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Micro-benchmark of the decoding of the messages of the conductor.
+
+Typical start, status and list messages, as sent by the conductor,
+are decoded repeatedly by `parse_message` and by the YAML parser the
+agent used before, and the time taken per message is printed. Run
+it from this folder:
+
+    python3 benchmark_parse_message.py --iterations 2000
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import timeit
+import argparse
+
+import yaml
+
+import openbach_agent
+
+
+MESSAGES = {
+        'start': {
+            'command_name': 'start_job_instance_agent',
+            'command_arguments': {
+                'name': 'fping',
+                'instance_id': 1234,
+                'scenario_id': 56,
+                'owner_id': 56,
+                'arguments': ['-c', '10', '-i', '500', '192.168.1.12'],
+                'date': 1600000000000,
+                'interval': None,
+                'isolation': None,
+                'precise': False,
+            },
+        },
+        'status': {
+            'command_name': 'status_job_instances_agent',
+            'command_arguments': {
+                'instances': [['fping', instance_id] for instance_id in range(1200, 1250)],
+            },
+        },
+        'list': {
+            'command_name': 'status_jobs_agent',
+            'command_arguments': {},
+        },
+}
+
+
+def main(iterations):
+    for name, message in MESSAGES.items():
+        message = json.dumps(dict(message, keep_alive=True, request_id=42))
+        assert openbach_agent.parse_message(message) == yaml.safe_load(message)
+        durations = [
+                timeit.timeit(lambda: parse(message), number=iterations) / iterations
+                for parse in (openbach_agent.parse_message, yaml.safe_load)
+        ]
+        print(
+                '{:<7} ({} bytes): parse_message {:.1f} µs, '
+                'yaml.safe_load {:.1f} µs'
+                .format(name, len(message), *(d * 1e6 for d in durations)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__.splitlines()[0],
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-i', '--iterations', type=int, default=2000,
+            help='number of times each message is decoded')
+    args = parser.parse_args()
+    main(args.iterations)
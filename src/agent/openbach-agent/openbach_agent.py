@@ -39,20 +39,33 @@ __credits__ = '''Contributors:
 import os
 import sys
 import time
-import json
+import uuid
+import queue
 import shlex
+import runpy
 import struct
 import signal
+import socket
 import random
+import atexit
 import platform
+import selectors
+import functools
 import threading
 import traceback
+import subprocess
 import socketserver
+import multiprocessing.connection
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+from collections import deque
 from subprocess import DEVNULL
 from contextlib import suppress, contextmanager
 from distutils.version import StrictVersion
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 import yaml
 import psutil
@@ -60,6 +73,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError, ConflictingIdError
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import (
+        EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+        EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES)
 
 import collect_agent
 
@@ -68,35 +84,60 @@ try:
     import syslog
     OS_TYPE = 'linux'
     JOBS_FOLDER = Path('/opt/openbach/agent/jobs/')
+    JOBS_CACHE_FOLDER = Path('/opt/openbach/agent/jobs_cache/')
+    STATS_FOLDER = Path('/var/openbach_stats/')
     INSTANCES_FOLDER = Path('/opt/openbach/agent/job_instances/')
+    INSTANCES_JOURNAL = INSTANCES_FOLDER / 'journal'
+    INSTANCES_SNAPSHOT = INSTANCES_FOLDER / 'snapshot'
     COLLECTOR_CONFIG_FILE = Path('/opt/openbach/agent/collector.yml')
     RSTATS_CONFIG_FILE = Path('/opt/openbach/agent/rstats/rstats.yml')
+    AGENT_NAME_FILES = (Path('/opt/openbach/agent/agent_name'), Path('/etc/hostname'))
+    CGROUP_ROOT = Path('/sys/fs/cgroup/')
+    ISOLATION_WRAPPER = ['/bin/sh', '-c', 'read ready && exec "$@" </dev/null', 'openbach-isolation']
 except ImportError:
     # If we failed assume we’re on windows
     import syslog_viveris as syslog
     OS_TYPE = 'windows'
     JOBS_FOLDER = Path(r'C:\openbach\jobs')
+    JOBS_CACHE_FOLDER = Path(r'C:\openbach\jobs_cache')
+    STATS_FOLDER = Path(r'C:\openbach\stats')
     INSTANCES_FOLDER = Path(r'C:\openbach\instances')
+    INSTANCES_JOURNAL = INSTANCES_FOLDER / 'journal'
+    INSTANCES_SNAPSHOT = INSTANCES_FOLDER / 'snapshot'
     COLLECTOR_CONFIG_FILE = Path(r'C:\openbach\collector.yml')
     RSTATS_CONFIG_FILE = Path(r'C:\openbach\rstats\rstats.yml')
+    AGENT_NAME_FILES = (Path(r'C:\openbach\agent_name'),)
+    CGROUP_ROOT = None
+    ISOLATION_WRAPPER = None
 
 
 def signal_term_handler(signal, frame):
     """Stop the Openbach Agent gracefully"""
     scheduler = JobManager().scheduler
     scheduler.remove_all_jobs()
+    JobEvents().close()
     RestartAgent(reload=False).action()
     while scheduler.get_jobs():
         time.sleep(0.5)
     scheduler.shutdown()
+    ResourcesMonitor().stop()
+    with suppress(OSError):
+        InstancesJournal().sync()
     exit(0)
 
 
 class JobManager:
-    """Context manager around job scheduling"""
+    """Registry of the installed jobs and their instances, along
+    with the scheduler launching them.
+
+    The registry of jobs is protected by its own lock while each
+    job and its instances are protected by a lock of their own, so
+    operations on a job never wait on operations on another one.
+    """
     __shared_state = {
             'scheduler': None,
             'jobs': {},
+            '_locks': {},
             '_last_instance_id': random.randint(500000, 1000000),
             '_mutex': threading.RLock(),
     }
@@ -106,14 +147,25 @@ class JobManager:
         self.__dict__ = self.__class__.__shared_state
         if self.scheduler is None:
             self.scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(50)})
+            self.scheduler.add_listener(
+                    AgentMetrics().scheduler_event,
+                    EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR |
+                    EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
             self.scheduler.start()
 
-    def __enter__(self):
-        self._mutex.acquire()
-        return self
+    def _job(self, name):
+        with self._mutex:
+            try:
+                return self.jobs[name], self._locks[name]
+            except KeyError:
+                raise BadRequest('No job {} is installed'.format(name))
 
-    def __exit__(self, t, v, tr):
-        self._mutex.release()
+    @contextmanager
+    def locked(self, name):
+        """Exclusive access to a single job and its instances"""
+        _, lock = self._job(name)
+        with lock:
+            yield self
 
     @property
     def job_names(self):
@@ -121,84 +173,116 @@ class JobManager:
             return list(self.jobs)
 
     def has_instance(self, name, instance_id):
-        with self._mutex:
-            try:
-                job = self.jobs[name]
-            except KeyError:
-                return False
-            else:
-                return instance_id in job['instances']
+        try:
+            job, lock = self._job(name)
+        except BadRequest:
+            return False
+        with lock:
+            return instance_id in job['instances']
 
     def add_job(self, name):
+        # Parse the configuration before locking anything
+        new_configuration = read_job_configuration(name)
         with self._mutex:
-            new_configuration = read_job_configuration(name)
             try:
                 installed_job = self.jobs[name]
             except KeyError:
                 conf = {'instances': {}}
                 conf.update(new_configuration)
+                self._locks[name] = threading.RLock()
                 self.jobs[name] = conf
-            else:
-                installed_version = StrictVersion(installed_job['job_version'])
-                new_version = StrictVersion(new_configuration['job_version'])
-                self.jobs[name].update(new_configuration)
-                if installed_version >= new_version:
-                    raise RequestWarning(
-                            'Job {} is already installed with a newer '
-                            'version (installed:\'{}\', current:{}). '
-                            'Configuration updated.'.format(
-                                name, installed_version, new_version))
+                return
+            lock = self._locks[name]
+
+        with lock:
+            installed_version = StrictVersion(installed_job['job_version'])
+            new_version = StrictVersion(new_configuration['job_version'])
+            installed_job.update(new_configuration)
+        if installed_version >= new_version:
+            raise RequestWarning(
+                    'Job {} is already installed with a newer '
+                    'version (installed:\'{}\', current:{}). '
+                    'Configuration updated.'.format(
+                        name, installed_version, new_version))
 
     def pop_job(self, name):
         with self._mutex:
             try:
-                return self.jobs.pop(name)
+                job = self.jobs.pop(name)
             except KeyError:
                 raise RequestWarning('No job {} is installed'.format(name))
+            lock = self._locks.pop(name)
+        with lock:
+            return job
 
     def get_job(self, name):
-        with self._mutex:
-            try:
-                job = self.jobs[name]
-            except KeyError:
-                raise BadRequest('No job {} is installed'.format(name))
+        job, lock = self._job(name)
+        with lock:
             return {key: value for key, value in job.items() if key != 'instances'}
 
     def get_instances(self, name):
-        with self._mutex:
-            try:
-                job = self.jobs[name]
-            except KeyError:
-                raise BadRequest('No job {} is installed'.format(name))
-            yield from job['instances'].items()
-
-    def add_instance(self, name, instance_id, arguments, date, interval):
-        with self._mutex:
-            self.jobs[name]['instances'][instance_id] = {
+        job, lock = self._job(name)
+        with lock:
+            return [
+                    (instance_id, dict(instance))
+                    for instance_id, instance in job['instances'].items()
+            ]
+
+    def add_instance(self, name, instance_id, arguments, date, interval, isolation=None):
+        job, lock = self._job(name)
+        with lock:
+            job['instances'][instance_id] = {
                     'args': arguments,
                     'date': date,
                     'interval': interval,
+                    'isolation': isolation,
             }
 
     def pop_instance(self, name, instance_id):
-        with self._mutex:
+        job, lock = self._job(name)
+        with lock:
             instance_infos = self.get_instance(name, instance_id)
-            instance = self.jobs[name]['instances'][instance_id]
+            instance = job['instances'][instance_id]
             del instance['pid']
             del instance['return_code']
             return instance_infos
 
     def get_instance(self, name, instance_id):
-        with self._mutex:
-            infos = self.get_job(name)
-            infos.update(self.jobs[name]['instances'][instance_id])
+        job, lock = self._job(name)
+        with lock:
+            infos = {key: value for key, value in job.items() if key != 'instances'}
+            infos.update(job['instances'][instance_id])
             return infos
 
-    def set_instance_started(self, name, instance_id, pid):
-        with self._mutex:
-            self.jobs[name]['instances'][instance_id].update(pid=pid, return_code=None)
+    def _instance(self, name, instance_id):
+        job, lock = self._job(name)
+        return job['instances'][instance_id], lock
+
+    def set_instance_started(self, name, instance_id, pid, start_offset=None):
+        instance, lock = self._instance(name, instance_id)
+        with lock:
+            instance.pop('start_error', None)
+            instance.update(pid=pid, return_code=None, start_offset=start_offset)
+
+    def set_instance_failed(self, name, instance_id, error):
+        """Mark an instance whose process could not be started"""
+        instance, lock = self._instance(name, instance_id)
+        with lock:
+            instance.update(pid=None, return_code=1, start_error=error)
+
+    def set_instance_resources(self, name, instance_id, pid, resources):
+        with suppress(KeyError, BadRequest):
+            instance, lock = self._instance(name, instance_id)
+            with lock:
+                if instance.get('pid') == pid:
+                    instance['resources'] = resources
 
     def set_instance_status(self, name, instance_id, pid, return_code):
+        """Store the return code of a terminated instance.
+
+        Return whether the instance was still considered running,
+        that is, whether the return code was actually stored.
+        """
         if return_code is None:
             # Somehow psutil returned None for a child process.
             # Since we have not much informations, assume success here.
@@ -206,10 +290,12 @@ class JobManager:
             # the nuttcp job. Try to investigate what is going on.
             return_code = 0
 
-        with self._mutex:
-            instance = self.jobs[name]['instances'][instance_id]
+        instance, lock = self._instance(name, instance_id)
+        with lock:
             if 'pid' in instance:
                 instance['return_code'] = return_code
+                return True
+        return False
 
     @property
     def new_instance_id(self):
@@ -219,6 +305,1038 @@ class JobManager:
         return instance_id
 
 
+class JobEvents:
+    """Publish job instances state transitions to subscribers"""
+    __shared_state = {
+            'epoch': uuid.uuid4().hex,
+            'sequence': 0,
+            'history': deque(maxlen=1024),
+            'subscribers': set(),
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def publish(self, event, job_name, instance_id, **details):
+        with self._mutex:
+            self.sequence += 1
+            message = {
+                    'sequence': self.sequence,
+                    'event': event,
+                    'job_name': job_name,
+                    'instance_id': instance_id,
+                    'timestamp': int(time.time() * 1000),
+                    **details,
+            }
+            self.history.append(message)
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Slow consumer: drop it so it resynchronizes
+                    self.subscribers.discard(subscriber)
+
+    def subscribe(self, epoch=None, last_sequence=None):
+        """Register a new subscriber and fill its queue with the
+        events it missed since `last_sequence`.
+
+        Return the queue of the subscriber and whether it should
+        resynchronize its whole state because some events are lost.
+        """
+        subscriber = queue.Queue(maxsize=4096)
+        with self._mutex:
+            resync = epoch != self.epoch or last_sequence is None
+            if not resync:
+                oldest = self.history[0]['sequence'] if self.history else self.sequence + 1
+                resync = not (oldest - 1 <= last_sequence <= self.sequence)
+            if not resync:
+                for message in self.history:
+                    if message['sequence'] > last_sequence:
+                        subscriber.put_nowait(message)
+            self.subscribers.add(subscriber)
+            return subscriber, {
+                    'epoch': self.epoch,
+                    'sequence': self.sequence,
+                    'resync': resync,
+            }
+
+    def is_subscribed(self, subscriber):
+        with self._mutex:
+            return subscriber in self.subscribers
+
+    def unsubscribe(self, subscriber):
+        with self._mutex:
+            self.subscribers.discard(subscriber)
+
+    def close(self):
+        """Stop feeding every subscriber"""
+        with self._mutex:
+            for subscriber in self.subscribers:
+                with suppress(queue.Full):
+                    subscriber.put_nowait(None)
+            self.subscribers.clear()
+
+
+class InstancesJournal:
+    """Append-only journal of the scheduled job instances orders,
+    used to recover them when the Agent restarts.
+
+    Each line of the journal either records the content of an
+    order or its removal. The journal is fsync'ed periodically
+    rather than on each write and is regularly compacted into
+    a snapshot of the orders still alive.
+    """
+    SYNC_INTERVAL = 1  # seconds
+    COMPACTION_THRESHOLD = 1000  # records
+
+    __shared_state = {
+            '_orders': None,
+            '_stream': None,
+            '_records': 0,
+            '_dirty': False,
+            '_syncer': None,
+            '_mutex': threading.RLock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def _load(self):
+        """Rebuild the orders from the snapshot, the journal and
+        the files written by older versions of the Agent.
+        """
+        if self._orders is not None:
+            return
+
+        orders = {}
+        with suppress(OSError, ValueError):
+            with INSTANCES_SNAPSHOT.open(encoding='utf-8') as stream:
+                for job_name, instance_id, kind, content in json.load(stream):
+                    orders[job_name, instance_id, kind] = content
+
+        records = 0
+        with suppress(OSError):
+            with INSTANCES_JOURNAL.open(encoding='utf-8') as stream:
+                for line in stream:
+                    try:
+                        job_name, instance_id, kind, content = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written before a crash
+                    records += 1
+                    if content is None:
+                        orders.pop((job_name, instance_id, kind), None)
+                    else:
+                        orders[job_name, instance_id, kind] = content
+
+        legacy_files = [
+                filepath for filepath in INSTANCES_FOLDER.glob('*.*')
+                if filepath.suffix in ('.start', '.stop')
+        ]
+        for filepath in legacy_files:
+            with suppress(Exception):
+                content = load_yaml(filepath)
+                orders[content['name'], content['instance_id'], filepath.suffix[1:]] = content
+
+        self._orders = orders
+        self._records = records
+
+        if legacy_files:
+            self.compact()
+            for filepath in legacy_files:
+                with suppress(OSError):
+                    os.remove(filepath)
+
+    def _open(self, mode='a'):
+        if self._stream is None:
+            INSTANCES_FOLDER.mkdir(parents=True, exist_ok=True)
+            self._stream = INSTANCES_JOURNAL.open(mode, encoding='utf-8')
+            if self._syncer is None:
+                self._syncer = threading.Thread(target=self._sync_periodically, daemon=True)
+                self._syncer.start()
+
+    def _write(self, job_name, instance_id, kind, content):
+        """Append a record to the journal, orders should
+        already be up-to-date with its content.
+        """
+        if self._records >= self.COMPACTION_THRESHOLD:
+            self.compact()
+            return
+
+        self._open()
+        self._stream.write(json.dumps([job_name, instance_id, kind, content]) + '\n')
+        self._stream.flush()
+        self._dirty = True
+        self._records += 1
+
+    def record(self, job_name, instance_id, kind, content):
+        with self._mutex:
+            self._load()
+            self._orders[job_name, instance_id, kind] = content
+            self._write(job_name, instance_id, kind, content)
+
+    def remove(self, job_name, instance_id, kind):
+        with self._mutex:
+            self._load()
+            if self._orders.pop((job_name, instance_id, kind), None) is not None:
+                self._write(job_name, instance_id, kind, None)
+
+    def orders(self):
+        """Return the recorded orders, starts first"""
+        with self._mutex:
+            self._load()
+            orders = sorted(self._orders.items(), key=lambda order: order[0][2])
+        return [(key, dict(content)) for key, content in orders]
+
+    def sync(self):
+        with self._mutex:
+            if self._dirty:
+                os.fsync(self._stream.fileno())
+                self._dirty = False
+
+    def _sync_periodically(self):
+        while True:
+            time.sleep(self.SYNC_INTERVAL)
+            with suppress(OSError):
+                self.sync()
+
+    def compact(self):
+        """Write the orders still alive into a snapshot and
+        start a new journal from it.
+        """
+        with self._mutex:
+            self._load()
+            INSTANCES_FOLDER.mkdir(parents=True, exist_ok=True)
+            temporary = INSTANCES_SNAPSHOT.with_suffix('.tmp')
+            with temporary.open('w', encoding='utf-8') as stream:
+                json.dump([
+                    [job_name, instance_id, kind, content]
+                    for (job_name, instance_id, kind), content in self._orders.items()
+                ], stream)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(str(temporary), str(INSTANCES_SNAPSHOT))
+
+            # Replaying the old journal over the new snapshot is
+            # harmless so a crash from here on does not lose anything
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+            self._open(mode='w')
+            os.fsync(self._stream.fileno())
+            self._dirty = False
+            self._records = 0
+
+
+class ProcessSupervisor:
+    """Watch the launched processes from a single thread and
+    notify their termination.
+
+    Processes are followed through pidfds when the platform
+    supports them so their termination is noticed right away;
+    they are polled regularly otherwise. Processes that exited but
+    whose return code is not known yet (forked from the zygote,
+    which reports it later) are polled until it is.
+    """
+    POLL_INTERVAL = 0.2  # seconds
+
+    __shared_state = {
+            '_processes': {},
+            '_pending': [],
+            '_parked': set(),
+            '_selector': None,
+            '_wakeup': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = socket.socketpair()
+                for endpoint in self._wakeup:
+                    endpoint.setblocking(False)
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+                threading.Thread(target=self._supervise, daemon=True).start()
+
+    def watch(self, process, callback):
+        """Call `callback(return_code)` once `process` terminates"""
+        pidfd = None
+        with suppress(AttributeError, OSError):
+            pidfd = os.pidfd_open(process.pid)
+
+        with self._mutex:
+            self._processes[process] = (callback, pidfd)
+            if pidfd is not None:
+                self._pending.append((pidfd, process))
+        self.wakeup()
+
+    def wakeup(self):
+        """Have the supervising thread check the processes again"""
+        with suppress(OSError):
+            self._wakeup[1].send(b'\0')
+
+    def _supervise(self):
+        while True:
+            with self._mutex:
+                for pidfd, process in self._pending:
+                    self._selector.register(pidfd, selectors.EVENT_READ, process)
+                self._pending.clear()
+                polled = [
+                        process for process, (_, pidfd)
+                        in self._processes.items()
+                        if pidfd is None
+                ]
+                polled.extend(self._parked)
+
+            timeout = self.POLL_INTERVAL if polled else None
+            terminated = []
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup[0]:
+                    with suppress(OSError):
+                        self._wakeup[0].recv(4096)
+                else:
+                    terminated.append(key)
+
+            for key in terminated:
+                return_code = key.data.poll()
+                if return_code is not None:
+                    self._terminated(key.data, return_code)
+                else:
+                    # Its pidfd stays readable: stop selecting
+                    # it until the return code is known
+                    self._selector.unregister(key.fileobj)
+                    with self._mutex:
+                        self._parked.add(key.data)
+
+            for process in polled:
+                return_code = process.poll()
+                if return_code is not None:
+                    self._terminated(process, return_code)
+
+    def _terminated(self, process, return_code):
+        with self._mutex:
+            callback, pidfd = self._processes.pop(process)
+            if pidfd is not None:
+                if process in self._parked:
+                    self._parked.remove(process)
+                else:
+                    self._selector.unregister(pidfd)
+                os.close(pidfd)
+
+        try:
+            callback(return_code)
+        except Exception:
+            syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+
+
+class RstatsConnection:
+    """Statistics connection to the local rstats service, mimicking
+    the messages sent by collect_agent on behalf of a job instance.
+
+    The connection is registered under its own `origin` so it does
+    not share the connection id of the job instance itself and can
+    be removed independently.
+    """
+    TIMEOUT = 1  # seconds
+
+    def __init__(self, port, job_name, job_instance_id, scenario_instance_id, owner_scenario_instance_id, origin='openbach_agent'):
+        self._address = ('localhost', port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.settimeout(self.TIMEOUT)
+        self._id = self._request(
+                1, confpath=str(JOBS_FOLDER / job_name / '{}_rstats_filter.conf'.format(job_name)),
+                job_name=job_name, agent_name=read_agent_name(),
+                job_instance_id=job_instance_id,
+                scenario_instance_id=scenario_instance_id,
+                owner_scenario_instance_id=owner_scenario_instance_id,
+                override=False, origin=origin)
+
+    def close(self):
+        """Unregister the connection from rstats"""
+        try:
+            self._request(4, connection_id=self._id)
+        except OSError as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Could not remove the statistics connection '
+                    '{} from rstats: {}'.format(self._id, e))
+        finally:
+            self._socket.close()
+
+    def send_stat(self, timestamp, suffix=None, **statistics):
+        self._request(
+                2, connection_id=self._id, timestamp=timestamp,
+                suffix=suffix, statistics=statistics)
+
+    def _request(self, command_id, **parameters):
+        message = {'command_id': command_id, 'command_parameters': parameters}
+        self._socket.sendto(json.dumps(message).encode(), self._address)
+        response, _ = self._socket.recvfrom(2048)
+        status, _, result = response.decode(errors='replace').rstrip('\0').partition(' ')
+        if status != 'OK':
+            raise OSError('rstats refused the request: {}'.format(result))
+        return result
+
+
+class ResourcesMonitor:
+    """Sample the resources used by the process tree of each
+    running job instance and send them as statistics.
+
+    The last sample is also kept alongside the instance in
+    the JobManager to be reported in its status.
+    """
+    __shared_state = {
+            'interval': None,
+            'rstats_port': 1111,
+            '_watched': {},
+            '_forgotten': [],
+            '_stopped': threading.Event(),
+            '_thread': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def configure(self, interval, rstats_port=1111):
+        """Start sampling resources every `interval` seconds"""
+        with self._mutex:
+            started = self.interval is not None
+            self.interval = interval
+            self.rstats_port = rstats_port
+        if not started:
+            self._thread = threading.Thread(target=self._sample_periodically, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=2):
+        """Stop sampling and unregister the statistics
+        connections of the watched instances.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def watch(self, job_name, instance_id, pid, scenario_instance_id, owner_scenario_instance_id):
+        if self.interval is None or self._stopped.is_set():
+            return
+
+        with self._mutex:
+            self._watched[(job_name, instance_id)] = {
+                    'pid': pid,
+                    'ids': (scenario_instance_id, owner_scenario_instance_id),
+                    'processes': {},
+                    'cpu_time': None,
+                    'timestamp': None,
+                    'rstats': None,
+            }
+
+    def forget(self, job_name, instance_id):
+        with self._mutex:
+            watched = self._watched.pop((job_name, instance_id), None)
+            if watched is not None:
+                # Leave the statistics connection to the sampling
+                # thread, it may be using or opening it right now
+                self._forgotten.append(watched)
+
+    def _sample_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self._close_forgotten()
+            with self._mutex:
+                watched = list(self._watched.items())
+            for (job_name, instance_id), infos in watched:
+                try:
+                    self._sample(job_name, instance_id, infos)
+                except Exception:
+                    syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+
+        with self._mutex:
+            self._forgotten.extend(self._watched.values())
+            self._watched.clear()
+        self._close_forgotten()
+
+    def _close_forgotten(self):
+        with self._mutex:
+            forgotten, self._forgotten = self._forgotten, []
+        for infos in forgotten:
+            if infos['rstats'] is not None:
+                infos['rstats'].close()
+
+    def _sample(self, job_name, instance_id, infos):
+        pid = infos['pid']
+        try:
+            root = infos['processes'].get(pid) or psutil.Process(pid)
+            tree = [root, *root.children(recursive=True)]
+        except psutil.Error:
+            # Process terminated, the ProcessSupervisor will forget it
+            return
+
+        # Reuse the Process objects of the previous sample
+        # so psutil can detect reused PIDs
+        processes = {process.pid: infos['processes'].get(process.pid, process) for process in tree}
+        infos['processes'] = processes
+
+        sample = {
+                'processes': 0,
+                'threads': 0,
+                'cpu_user': 0.0,
+                'cpu_system': 0.0,
+                'memory_rss': 0,
+                'io_read_bytes': 0,
+                'io_write_bytes': 0,
+                'ctx_switches_voluntary': 0,
+                'ctx_switches_involuntary': 0,
+        }
+        for process in processes.values():
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_times()
+                    memory = process.memory_info()
+                    switches = process.num_ctx_switches()
+                    threads = process.num_threads()
+                    try:
+                        io = process.io_counters()
+                    except (AttributeError, psutil.AccessDenied):
+                        io = None
+            except psutil.Error:
+                continue
+            sample['processes'] += 1
+            sample['threads'] += threads
+            sample['cpu_user'] += cpu.user
+            sample['cpu_system'] += cpu.system
+            sample['memory_rss'] += memory.rss
+            sample['ctx_switches_voluntary'] += switches.voluntary
+            sample['ctx_switches_involuntary'] += switches.involuntary
+            if io is not None:
+                sample['io_read_bytes'] += io.read_bytes
+                sample['io_write_bytes'] += io.write_bytes
+
+        now = time.monotonic()
+        cpu_time = sample['cpu_user'] + sample['cpu_system']
+        if infos['timestamp'] is None:
+            sample['cpu_percent'] = 0.0
+        else:
+            # Children terminated since the last sample take their CPU
+            # time away with them: never report a negative usage
+            elapsed = now - infos['timestamp']
+            used = max(cpu_time - infos['cpu_time'], 0.0)
+            sample['cpu_percent'] = round(100 * used / elapsed, 2) if elapsed > 0 else 0.0
+        infos['timestamp'] = now
+        infos['cpu_time'] = cpu_time
+
+        timestamp = int(time.time() * 1000)
+        sample['timestamp'] = timestamp
+        JobManager().set_instance_resources(job_name, instance_id, pid, sample)
+
+        try:
+            if infos['rstats'] is None:
+                infos['rstats'] = RstatsConnection(self.rstats_port, job_name, instance_id, *infos['ids'])
+            statistics = {
+                    'resources_{}'.format(key): value
+                    for key, value in sample.items()
+                    if key != 'timestamp'
+            }
+            infos['rstats'].send_stat(timestamp, suffix='resources', **statistics)
+        except OSError as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Could not send resources statistics of instance '
+                    '{} of job {}: {}'.format(instance_id, job_name, e))
+
+
+class Histogram:
+    """Distribution of durations, in seconds, as per-range counts:
+    each bucket counts the values above the previous bound and up
+    to its own, the last one counts the values above every bound.
+
+    The conductor keeps an identical copy in its lib/utils.py:
+    agents are installed without the controller code, so both
+    copies are kept on purpose and must be changed together.
+    """
+    BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        value = max(value, 0.0)
+        index = next((i for i, bound in enumerate(self.BOUNDS) if value <= bound), len(self.BOUNDS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        bounds = [str(bound) for bound in self.BOUNDS] + ['+Inf']
+        return {
+                'buckets': dict(zip(bounds, self.buckets)),
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'max': self.max,
+        }
+
+
+class AgentMetrics:
+    """Collect counters and latencies about the requests
+    handled by the agent and the scheduled jobs.
+    """
+    __shared_state = {
+            'actions': {},
+            'active_handlers': 0,
+            'queue_delay': None,
+            'accepted': {},
+            'scheduler': {
+                'submitted': 0,
+                'executed': 0,
+                'errors': 0,
+                'missed': 0,
+                'max_instances_reached': 0,
+            },
+            'scheduler_lateness': None,
+            'started': time.time(),
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.queue_delay is None:
+                self.queue_delay = Histogram()
+                self.scheduler_lateness = Histogram()
+
+    def request_accepted(self, request):
+        with self._mutex:
+            self.accepted[id(request)] = time.monotonic()
+
+    def request_started(self, request):
+        now = time.monotonic()
+        with self._mutex:
+            self.active_handlers += 1
+            accepted = self.accepted.pop(id(request), None)
+            if accepted is not None:
+                self.queue_delay.observe(now - accepted)
+
+    def request_finished(self):
+        with self._mutex:
+            self.active_handlers -= 1
+
+    def action_handled(self, name, duration, error=False, warning=False):
+        with self._mutex:
+            try:
+                action = self.actions[name]
+            except KeyError:
+                action = self.actions[name] = {
+                        'count': 0,
+                        'errors': 0,
+                        'warnings': 0,
+                        'latency': Histogram(),
+                }
+            action['count'] += 1
+            action['errors'] += bool(error)
+            action['warnings'] += bool(warning)
+            action['latency'].observe(duration)
+
+    def scheduler_event(self, event):
+        with self._mutex:
+            if event.code == EVENT_JOB_SUBMITTED:
+                self.scheduler['submitted'] += 1
+                now = datetime.now(timezone.utc)
+                for run_time in event.scheduled_run_times:
+                    self.scheduler_lateness.observe((now - run_time).total_seconds())
+            elif event.code == EVENT_JOB_EXECUTED:
+                self.scheduler['executed'] += 1
+            elif event.code == EVENT_JOB_ERROR:
+                self.scheduler['errors'] += 1
+            elif event.code == EVENT_JOB_MISSED:
+                self.scheduler['missed'] += 1
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                self.scheduler['max_instances_reached'] += 1
+
+    def snapshot(self):
+        with self._mutex:
+            scheduler = dict(self.scheduler)
+            scheduler['backlog'] = scheduler['submitted'] - scheduler['executed'] - scheduler['errors']
+            scheduler['lateness'] = self.scheduler_lateness.to_dict()
+            return {
+                    'uptime': time.time() - self.started,
+                    'active_handlers': self.active_handlers,
+                    'queue_delay': self.queue_delay.to_dict(),
+                    'actions': {
+                        name: {
+                            'count': action['count'],
+                            'errors': action['errors'],
+                            'warnings': action['warnings'],
+                            'latency': action['latency'].to_dict(),
+                        } for name, action in self.actions.items()
+                    },
+                    'scheduler': scheduler,
+            }
+
+    def statistics(self):
+        """Flatten the current metrics into statistics"""
+        snapshot = self.snapshot()
+        scheduler = snapshot['scheduler']
+        statistics = {
+                'active_handlers': snapshot['active_handlers'],
+                'queue_delay_mean': snapshot['queue_delay']['mean'],
+                'queue_delay_max': snapshot['queue_delay']['max'],
+                'scheduler_backlog': scheduler['backlog'],
+                'scheduler_missed': scheduler['missed'],
+                'scheduler_lateness_mean': scheduler['lateness']['mean'],
+                'scheduler_lateness_max': scheduler['lateness']['max'],
+        }
+        for name, action in snapshot['actions'].items():
+            statistics['{}_count'.format(name)] = action['count']
+            statistics['{}_errors'.format(name)] = action['errors']
+            statistics['{}_warnings'.format(name)] = action['warnings']
+            statistics['{}_latency_mean'.format(name)] = action['latency']['mean']
+            statistics['{}_latency_max'.format(name)] = action['latency']['max']
+        return statistics
+
+    def emit_periodically(self, interval, rstats_port=1111):
+        """Send the metrics as statistics every `interval` seconds.
+
+        They are stored as the statistics of a job named openbach_agent
+        with job and scenario instance ids of 0, which no actual job
+        instance uses; they reach the collector like the statistics
+        of any other job.
+        """
+        def emit():
+            connection = None
+            while True:
+                time.sleep(interval)
+                try:
+                    if connection is None:
+                        connection = RstatsConnection(rstats_port, 'openbach_agent', 0, 0, 0, origin='metrics')
+                    connection.send_stat(int(time.time() * 1000), **self.statistics())
+                except OSError as e:
+                    syslog.syslog(
+                            syslog.LOG_WARNING,
+                            'Could not send the agent metrics: {}'.format(e))
+
+        threading.Thread(target=emit, daemon=True).start()
+
+
+class StatisticsIndex:
+    """Incremental index over the statistics stored locally by rstats.
+
+    Each .stats file is split into chunks of consecutive lines; for
+    each chunk the index remembers its byte range, the time range it
+    covers and the job instances it contains. Only the bytes appended
+    since the last query are parsed when the index is refreshed.
+    """
+    CHUNK_SIZE = 256  # lines
+
+    __shared_state = {
+            '_files': {},
+            '_locks': {},
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def _lock(self, job_name):
+        with self._mutex:
+            return self._locks.setdefault(job_name, threading.Lock())
+
+    def refresh(self, job_name):
+        """Index the new content of the statistics files of a job
+        and return the paths of the indexed ones in chronological
+        order. Files removed since the last refresh are forgotten.
+        """
+        folder = STATS_FOLDER / job_name
+        try:
+            filenames = sorted(
+                    path for path in folder.iterdir()
+                    if path.suffix == '.stats')
+        except OSError:
+            filenames = []
+
+        indexed = []
+        with self._lock(job_name):
+            for filename in filenames:
+                try:
+                    size = filename.stat().st_size
+                    index = self._files.get(filename)
+                    if index is None or size < index['indexed']:
+                        # New or truncated file
+                        index = self._files[filename] = {'indexed': 0, 'chunks': []}
+                    if size > index['indexed']:
+                        self._index(filename, index)
+                except OSError:
+                    continue
+                indexed.append(filename)
+
+            # Other jobs may index their files concurrently: only
+            # iterate over a copy and remove the files of this job
+            remaining = set(indexed)
+            for filename in list(self._files):
+                if filename.parent == folder and filename not in remaining:
+                    del self._files[filename]
+        return indexed
+
+    def _index(self, filename, index):
+        chunks = index['chunks']
+        with filename.open('rb') as stream:
+            stream.seek(index['indexed'])
+            chunk = None
+            offset = index['indexed']
+            for line in stream:
+                if not line.endswith(b'\n'):
+                    # Line still being written
+                    break
+                start, offset = offset, offset + len(line)
+                try:
+                    metadata = json.loads(line)['_metadata']
+                    timestamp = int(metadata['time'])
+                    instance = (metadata.get('job_instance_id'), metadata.get('scenario_instance_id'))
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+                if chunk is None:
+                    if chunks and chunks[-1]['lines'] < self.CHUNK_SIZE:
+                        chunk = chunks[-1]
+                    else:
+                        chunk = {'start': start, 'lines': 0, 'min': timestamp, 'max': timestamp, 'instances': set()}
+                        chunks.append(chunk)
+                chunk['end'] = offset
+                chunk['lines'] += 1
+                chunk['min'] = min(chunk['min'], timestamp)
+                chunk['max'] = max(chunk['max'], timestamp)
+                chunk['instances'].add(instance)
+                if chunk['lines'] >= self.CHUNK_SIZE:
+                    chunk = None
+            index['indexed'] = offset
+
+    def query(self, job_name, job_instance_id, scenario_instance_id=None,
+              start=None, end=None, cursor=None, limit=1000):
+        """Return at most `limit` statistics of a job instance in the
+        given time range, along with a cursor to retrieve the next page
+        or None if there is nothing left.
+        """
+        filenames = self.refresh(job_name)
+        if cursor is not None:
+            cursor_file, _, cursor_offset = cursor.rpartition(':')
+            cursor_offset = int(cursor_offset)
+        else:
+            cursor_file, cursor_offset = '', 0
+
+        statistics = []
+        for filename in filenames:
+            if filename.name < cursor_file:
+                continue
+            skip_until = cursor_offset if filename.name == cursor_file else 0
+            with self._lock(job_name):
+                index = self._files.get(filename, {'chunks': []})
+                candidates = [
+                        dict(chunk) for chunk in index['chunks']
+                        if chunk['end'] > skip_until
+                        and (start is None or chunk['max'] >= start)
+                        and (end is None or chunk['min'] <= end)
+                        and any(
+                            instance_id == job_instance_id and
+                            (scenario_instance_id is None or scenario_id == scenario_instance_id)
+                            for instance_id, scenario_id in chunk['instances'])
+                ]
+            if not candidates:
+                continue
+
+            with filename.open('rb') as stream:
+                for chunk in candidates:
+                    offset = max(chunk['start'], skip_until)
+                    stream.seek(offset)
+                    while offset < chunk['end']:
+                        line = stream.readline()
+                        offset += len(line)
+                        try:
+                            statistic = json.loads(line)
+                            metadata = statistic['_metadata']
+                            timestamp = int(metadata['time'])
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                        if metadata.get('job_instance_id') != job_instance_id:
+                            continue
+                        if scenario_instance_id is not None and metadata.get('scenario_instance_id') != scenario_instance_id:
+                            continue
+                        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                            continue
+                        statistics.append(statistic)
+                        if len(statistics) >= limit:
+                            return statistics, '{}:{}'.format(filename.name, offset)
+        return statistics, None
+
+
+class PythonZygote:
+    """Pre-forked interpreter used to launch Python jobs.
+
+    A dedicated process imports a configurable set of modules once
+    and forks a new process for each job instance, sparing them the
+    cost of starting an interpreter and importing their dependencies.
+    The zygote reports the termination of the jobs it forked so they
+    can be supervised as any other process.
+    """
+    SPAWN_TIMEOUT = 5  # seconds
+
+    __shared_state = {
+            'process': None,
+            'connection': None,
+            'replies': queue.Queue(),
+            'return_codes': {},
+            '_mutex': threading.Lock(),
+            '_condition': threading.Condition(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def configure(self, preload=()):
+        """Start the zygote process and have it import
+        the given modules alongside the agent code.
+        """
+        if not hasattr(os, 'fork'):
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Python zygote unavailable on this platform')
+            return
+
+        context = multiprocessing.get_context('spawn')
+        connection, zygote_connection = context.Pipe()
+        process = context.Process(
+                target=run_zygote,
+                args=(zygote_connection, ['collect_agent', *preload]),
+                name='python_zygote')
+        process.start()
+        zygote_connection.close()
+        self.process = process
+        self.connection = connection
+        threading.Thread(target=self._read_events, daemon=True).start()
+        # Let the zygote exit before multiprocessing joins it; the
+        # jobs it forked outlive it and the agent
+        atexit.register(self.close)
+
+    def close(self):
+        with self._mutex:
+            if self.connection is not None:
+                with suppress(OSError):
+                    self.connection.send(None)
+
+    def script(self, command):
+        """Return the path of the Python script run by the
+        command if it can be launched from the zygote.
+        """
+        if self.connection is None:
+            return None
+
+        if command and os.path.basename(command[0]) == 'env':
+            command = command[1:]
+        if len(command) != 2:
+            # Interpreter options are not supported
+            return None
+
+        interpreter, script = command
+        if not os.path.basename(interpreter).startswith('python3'):
+            return None
+        if not script.endswith('.py'):
+            return None
+        return script
+
+    def spawn(self, script, args, env, isolation=None, cgroup=None):
+        """Fork a new process from the zygote running the
+        script with the provided arguments and environment.
+
+        Isolation settings are applied by the forked process
+        to itself before it runs the script.
+        """
+        if cgroup is not None:
+            cgroup = str(cgroup)
+        with self._mutex:
+            if self.connection is None:
+                raise OSError('the Python zygote is not running')
+            token = uuid.uuid4().hex
+            self.connection.send((token, script, args, env, os.getcwd(), isolation, cgroup))
+            deadline = time.monotonic() + self.SPAWN_TIMEOUT
+            while True:
+                try:
+                    reply, pid, error = self.replies.get(
+                            timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise OSError('the Python zygote did not answer in time')
+                # Skip replies to previous requests that timed out
+                if reply in (token, None):
+                    break
+        if error is not None:
+            raise OSError(error)
+        return ZygoteProcess(pid)
+
+    def return_code(self, pid, timeout=0):
+        """Wait at most `timeout` seconds for the termination of a
+        process forked from the zygote and return its return code.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                    lambda: pid in self.return_codes or self.connection is None,
+                    timeout)
+            if pid in self.return_codes:
+                return self.return_codes.pop(pid)
+        if self.connection is None and not psutil.pid_exists(pid):
+            # Termination reports are lost along with the zygote
+            return 1
+
+    def _read_events(self):
+        connection = self.connection
+        while True:
+            try:
+                event, *values = connection.recv()
+            except (EOFError, OSError):
+                break
+            if event == 'started':
+                self.replies.put(values)
+            else:
+                pid, return_code = values
+                with self._condition:
+                    self.return_codes[pid] = return_code
+                    self._condition.notify_all()
+                ProcessSupervisor().wakeup()
+
+        syslog.syslog(syslog.LOG_WARNING, 'The Python zygote exited')
+        self.replies.put((None, None, 'the Python zygote exited'))
+        with self._condition:
+            self.connection = None
+            self._condition.notify_all()
+        ProcessSupervisor().wakeup()
+
+
+class ZygoteProcess:
+    """Subset of the Popen interface around a process
+    forked from the zygote.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        return self.wait(0)
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            self.returncode = PythonZygote().return_code(self.pid, timeout)
+        return self.returncode
+
+
 class TruncatedMessageException(Exception):
     """Raised when a received message is not advertised length"""
     def __init__(self, expected_length, length):
@@ -229,6 +1347,7 @@ class TruncatedMessageException(Exception):
                 .format(expected_length, length)
         )
         super().__init__(message)
+        self.length = length
 
 
 class RequestWarning(ValueError):
@@ -258,6 +1377,10 @@ class AgentAction:
     def _action(self):
         raise NotImplementedError
 
+    def stream(self, connection):
+        """Keep using the connection once the response is sent"""
+        pass
+
     def _normalized_date(self):
         date = getattr(self, 'date', None)
         if date and time.time() < date.timestamp():
@@ -277,69 +1400,135 @@ class DelJobAgent(AgentAction):
         super().__init__(name=name)
 
     def _action(self):
-        with JobManager() as manager:
-            for job_instance_id, _ in manager.get_instances(self.name):
-                manager.scheduler.add_job(
-                        stop_job, 'date', args=(self.name, job_instance_id),
-                        id='{}_{}_stop'.format(self.name, job_instance_id))
+        manager = JobManager()
+        instances = [
+                (self.name, job_instance_id)
+                for job_instance_id, _ in manager.get_instances(self.name)
+        ]
+        if instances:
+            manager.scheduler.add_job(stop_jobs, 'date', args=(instances,))
 
 
 class StatusJobInstanceAgent(AgentAction):
-    def __init__(self, name, instance_id):
-        super().__init__(name=name, instance_id=instance_id)
+    def __init__(self, name, instance_id, resources=False):
+        super().__init__(name=name, instance_id=instance_id, resources=resources)
 
     def check_arguments(self):
-        with JobManager() as manager:
-            manager.get_job(self.name)
-            if self.instance_id < 0:
-                self.instance_id = manager._last_instance_id
+        manager = JobManager()
+        manager.get_job(self.name)
+        if self.instance_id < 0:
+            self.instance_id = manager._last_instance_id
 
     def _action(self):
-        with JobManager() as manager:
+        with JobManager().locked(self.name) as manager:
             job = manager.scheduler.get_job('{}_{}'.format(self.name, self.instance_id))
             try:
                 infos = manager.get_instance(self.name, self.instance_id)
             except KeyError:
                 assert job is None
-                return 'Not Scheduled'
+                status = 'Not Scheduled'
+                infos = {}
+            else:
+                status = instance_status(infos, job)
+
+        if self.resources:
+            return {
+                    'status': status,
+                    'resources': infos.get('resources'),
+                    'isolation': infos.get('isolation'),
+                    'start_offset': infos.get('start_offset'),
+                    'start_error': infos.get('start_error'),
+            }
+        return status
 
-            try:
-                pid = infos['pid']
-                return_code = infos['return_code']
-            except KeyError:
-                return 'Stopped' if job is None else 'Scheduled'
 
-            if return_code:
-                return 'Error'
+class StatusJobInstancesAgent(AgentAction):
+    def __init__(self, instances=None):
+        super().__init__(instances=instances)
 
-            if return_code is None:
-                assert psutil.pid_exists(pid)
-                return 'Running'
+    def check_arguments(self):
+        if self.instances is None:
+            return
 
-            assert return_code == 0
-            if job:
-                assert isinstance(job.trigger, IntervalTrigger)
-                return 'Running'
+        try:
+            self.instances = [
+                    (name, int(instance_id))
+                    for name, instance_id in self.instances
+            ]
+        except (TypeError, ValueError):
+            raise BadRequest(
+                    'The instances to check should be given as '
+                    'a list of (job name, instance id) pairs')
 
-            return 'Not Running'
+    def _action(self):
+        statuses = []
+        manager = JobManager()
+        if self.instances is None:
+            requested = {
+                    name: None
+                    for name in manager.job_names
+            }
+        else:
+            requested = {}
+            for name, instance_id in self.instances:
+                requested.setdefault(name, []).append(instance_id)
+
+        for name, instance_ids in requested.items():
+            try:
+                with manager.locked(name):
+                    statuses.extend(self._job_statuses(manager, name, instance_ids))
+            except BadRequest as e:
+                statuses.extend(
+                        {'job_name': name, 'instance_id': instance_id, 'error': e.reason}
+                        for instance_id in instance_ids or ())
+
+        return statuses
+
+    @staticmethod
+    def _job_statuses(manager, name, instance_ids):
+        instances = dict(manager.get_instances(name))
+        if instance_ids is None:
+            instance_ids = list(instances)
+
+        for instance_id in instance_ids:
+            job = manager.scheduler.get_job('{}_{}'.format(name, instance_id))
+            try:
+                infos = instances[instance_id]
+            except KeyError:
+                status = 'Not Scheduled'
+                infos = {}
+            else:
+                status = instance_status(infos, job)
+            yield {
+                'job_name': name,
+                'instance_id': instance_id,
+                'status': status,
+                'resources': infos.get('resources'),
+                'isolation': infos.get('isolation'),
+                'start_offset': infos.get('start_offset'),
+                'start_error': infos.get('start_error'),
+            }
 
 
 class StartJobInstanceAgent(AgentAction):
-    def __init__(self, name, instance_id, scenario_id, owner_id, date, interval, arguments, reschedule=False):
+    PRECISE_LEAD = 0.5  # seconds
+
+    def __init__(self, name, instance_id, scenario_id, owner_id, date, interval, arguments, reschedule=False, isolation=None, precise=False):
         super().__init__(
                 name=name, instance_id=instance_id, scenario_id=scenario_id,
                 owner_id=owner_id, date=date, interval=interval,
-                arguments=arguments, reschedule=reschedule)
+                arguments=arguments, reschedule=reschedule,
+                isolation=isolation, precise=precise)
 
     def _check_instance(self):
-        with JobManager() as manager:
-            if self.instance_id < 0:
-                self.instance_id = manager.new_instance_id
+        manager = JobManager()
+        if self.instance_id < 0:
+            self.instance_id = manager.new_instance_id
 
-            if manager.has_instance(self.name, self.instance_id):
-                raise BadRequest(
-                        'Instance {} with id {} is already '
-                        'started'.format(self.name, self.instance_id))
+        if manager.has_instance(self.name, self.instance_id):
+            raise BadRequest(
+                    'Instance {} with id {} is already '
+                    'started'.format(self.name, self.instance_id))
 
     def check_arguments(self):
         self._check_instance()
@@ -366,6 +1555,13 @@ class StartJobInstanceAgent(AgentAction):
         if self.reschedule and self.interval is None and self._normalized_date() is None:
             raise BadRequest('Cannot reschedule a past job')
 
+        self.isolation = parse_isolation(self.isolation)
+
+        if self.precise and self.interval is not None:
+            raise BadRequest(
+                    'A precise start can not be used '
+                    'with the "interval" option')
+
         infos = JobManager().get_job(self.name)
         nb_args = infos['required']
         optional = infos['optional']
@@ -379,7 +1575,7 @@ class StartJobInstanceAgent(AgentAction):
                     'arguments'.format(self.name, nb_args))
 
     def _action(self):
-        with JobManager() as manager:
+        with JobManager().locked(self.name) as manager:
             infos = manager.get_job(self.name)
             command = infos['command']
             arguments = (
@@ -391,9 +1587,18 @@ class StartJobInstanceAgent(AgentAction):
                 # Schedule the Job Instance
                 if self.interval is None:
                     date = self._normalized_date()
-                    manager.scheduler.add_job(
-                            launch_job, 'date', run_date=date,
-                            args=arguments, id=scheduler_id)
+                    if self.precise and date is not None:
+                        # Wake up ahead of time to prepare the launch
+                        # and release the process right on time
+                        manager.scheduler.add_job(
+                                launch_job, 'date',
+                                run_date=self._precise_wakeup(date),
+                                args=arguments, kwargs={'deadline': date},
+                                id=scheduler_id)
+                    else:
+                        manager.scheduler.add_job(
+                                launch_job, 'date', run_date=date,
+                                args=arguments, id=scheduler_id)
                 else:
                     #if infos['persistent']:    This conditions is removed: the user 
                     #                           must take care when playing with intervals
@@ -413,7 +1618,8 @@ class StartJobInstanceAgent(AgentAction):
 
             manager.add_instance(
                     self.name, self.instance_id,
-                    self.arguments, self.date, self.interval)
+                    self.arguments, self.date, self.interval,
+                    self.isolation)
 
         if date is not None or self.interval:
             recover_file(
@@ -424,10 +1630,18 @@ class StartJobInstanceAgent(AgentAction):
                     owner_id=self.owner_id,
                     date=None if date is None else date.timestamp() * 1000,
                     interval=self.interval,
-                    arguments=self.arguments)
+                    arguments=self.arguments,
+                    isolation=self.isolation,
+                    precise=self.precise)
 
         return self.instance_id
 
+    def _precise_wakeup(self, date):
+        wakeup = date.timestamp() - self.PRECISE_LEAD
+        if wakeup <= time.time():
+            return None
+        return datetime.fromtimestamp(wakeup)
+
 
 class RestartJobInstanceAgent(StartJobInstanceAgent):
     def _check_instance(self):
@@ -465,7 +1679,7 @@ class StopJobInstanceAgent(AgentAction):
         date = self._normalized_date()
 
         # Schedule the stop of the Job Instance
-        with JobManager() as manager:
+        with JobManager().locked(self.name) as manager:
             scheduler_job_id = '{}_{}_stop'.format(self.name, self.instance_id)
             try:
                 manager.scheduler.add_job(
@@ -485,6 +1699,48 @@ class StopJobInstanceAgent(AgentAction):
                     date=date.timestamp() * 1000)
 
 
+class StopJobInstancesAgent(AgentAction):
+    def __init__(self, instances, date):
+        super().__init__(instances=instances, date=date)
+
+    def check_arguments(self):
+        try:
+            self.instances = [
+                    (name, int(instance_id))
+                    for name, instance_id in self.instances
+            ]
+        except (TypeError, ValueError):
+            raise BadRequest(
+                    'The instances to stop should be given as '
+                    'a list of (job name, instance id) pairs')
+
+        manager = JobManager()
+        for name, _ in self.instances:
+            manager.get_job(name)
+
+        if self.date == 'now':
+            self.date = None
+
+        try:
+            if self.date is not None:
+                self.date = datetime.fromtimestamp(self.date / 1000)
+        except (TypeError, ValueError):
+            raise BadRequest(
+                    'The date to stop should be '
+                    'given as a timestamp in milliseconds')
+
+    def _action(self):
+        date = self._normalized_date()
+        if date is not None:
+            # Keep individual stop orders so they can be
+            # rescheduled or recovered independently
+            for name, instance_id in self.instances:
+                StopJobInstanceAgent(name, instance_id, date.timestamp() * 1000).action()
+            return
+
+        JobManager().scheduler.add_job(stop_jobs, 'date', args=(self.instances,))
+
+
 class StatusJobsAgent(AgentAction):
     def __init__(self):
         super().__init__()
@@ -498,13 +1754,14 @@ class RestartAgent(AgentAction):
         super().__init__(reload=reload)
 
     def _action(self):
-        with JobManager() as manager:
-            for job_name in manager.job_names:
-                for job_instance_id, _ in manager.get_instances(job_name):
-                    manager.scheduler.add_job(
-                            stop_job, 'date',
-                            args=(job_name, job_instance_id, False),
-                            id='{}_{}_stop'.format(job_name, job_instance_id))
+        manager = JobManager()
+        instances = [
+                (job_name, job_instance_id)
+                for job_name in manager.job_names
+                for job_instance_id, _ in manager.get_instances(job_name)
+        ]
+        if instances:
+            manager.scheduler.add_job(stop_jobs, 'date', args=(instances, False))
 
         if self.reload:
             recover_old_state()
@@ -518,6 +1775,145 @@ class CheckConnection(AgentAction):
         pass
 
 
+class Batch(AgentAction):
+    BATCHABLE_ACTIONS = (
+            'StartJobInstanceAgent',
+            'StopJobInstanceAgent',
+            'StatusJobInstanceAgent',
+            'RestartJobInstanceAgent',
+    )
+
+    def __init__(self, commands):
+        super().__init__(commands=commands)
+
+    def check_arguments(self):
+        if not isinstance(self.commands, list):
+            raise BadRequest('The commands of a batch should be given as a list')
+
+    def _action(self):
+        return [self._execute(command) for command in self.commands]
+
+    def _execute(self, command):
+        """Run a single command of the batch and build its
+        response the same way the RequestHandler would.
+        """
+        try:
+            action_name = command['command_name']
+            arguments = command['command_arguments']
+        except (KeyError, TypeError) as e:
+            return format_response(
+                    'Missing mandatory argument: {}'.format(e),
+                    syslog.LOG_ERR)
+
+        action = ''.join(map(str.title, action_name.split('_')))
+        if action not in self.BATCHABLE_ACTIONS:
+            return format_response(
+                    'Action {} can not be part of a batch'.format(action_name),
+                    syslog.LOG_ERR)
+
+        try:
+            result = getattr(sys.modules[__name__], action)(**arguments).action()
+        except BadRequest as e:
+            return format_response(e.reason, syslog.LOG_ERR)
+        except RequestWarning as e:
+            return format_response(e.reason, syslog.LOG_WARNING)
+        except TypeError as e:
+            return format_response('Bad parameters: {}'.format(e), syslog.LOG_CRIT)
+        except Exception:
+            return format_response(traceback.format_exc(), syslog.LOG_ERR)
+        else:
+            return format_response(result)
+
+
+class SubscribeJobEventsAgent(AgentAction):
+    def __init__(self, epoch=None, last_sequence=None, heartbeat=5):
+        super().__init__(epoch=epoch, last_sequence=last_sequence, heartbeat=heartbeat)
+
+    def check_arguments(self):
+        try:
+            self.heartbeat = float(self.heartbeat)
+            if self.last_sequence is not None:
+                self.last_sequence = int(self.last_sequence)
+        except (TypeError, ValueError):
+            raise BadRequest(
+                    'The heartbeat and the last sequence '
+                    'number should be numbers')
+
+    def _action(self):
+        self.subscriber, result = JobEvents().subscribe(self.epoch, self.last_sequence)
+        return result
+
+    def stream(self, connection):
+        events = JobEvents()
+        try:
+            while events.is_subscribed(self.subscriber):
+                try:
+                    message = self.subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    message = {'event': 'heartbeat'}
+                if message is None:
+                    break
+                send_message(connection, message)
+        except OSError:
+            pass  # Subscriber went away
+        finally:
+            events.unsubscribe(self.subscriber)
+
+
+class QueryStatisticsAgent(AgentAction):
+    def __init__(self, name, instance_id, scenario_id=None, start=None, end=None, cursor=None, limit=1000):
+        super().__init__(
+                name=name, instance_id=instance_id, scenario_id=scenario_id,
+                start=start, end=end, cursor=cursor, limit=limit)
+
+    def check_arguments(self):
+        if not self.name or os.sep in self.name or self.name.startswith('.'):
+            raise BadRequest('Invalid job name: {}'.format(self.name))
+
+        try:
+            self.instance_id = int(self.instance_id)
+            if self.scenario_id is not None:
+                self.scenario_id = int(self.scenario_id)
+        except (TypeError, ValueError):
+            raise BadRequest('Instance and scenario ids should be integers')
+
+        try:
+            if self.start is not None:
+                self.start = int(self.start)
+            if self.end is not None:
+                self.end = int(self.end)
+        except (TypeError, ValueError):
+            raise BadRequest(
+                    'The time range should be given as '
+                    'timestamps in milliseconds')
+
+        try:
+            self.limit = int(self.limit)
+        except (TypeError, ValueError):
+            raise BadRequest('The page size should be an integer')
+        if self.limit <= 0:
+            raise BadRequest('The page size should be positive')
+
+        if self.cursor is not None:
+            _, separator, offset = str(self.cursor).rpartition(':')
+            if not separator or not offset.isdigit():
+                raise BadRequest('Invalid cursor: {}'.format(self.cursor))
+
+    def _action(self):
+        statistics, cursor = StatisticsIndex().query(
+                self.name, self.instance_id, self.scenario_id,
+                self.start, self.end, self.cursor, self.limit)
+        return {'statistics': statistics, 'cursor': cursor}
+
+
+class MetricsAgent(AgentAction):
+    def __init__(self):
+        super().__init__()
+
+    def _action(self):
+        return AgentMetrics().snapshot()
+
+
 class ChangeCollector(AgentAction):
     def __init__(self, address, logs, stats):
         config = {
@@ -545,10 +1941,184 @@ def write_yaml(content, filename):
 
 
 def recover_file(job_name, job_instance_id, extension, **content):
-    """Save informations about a job in a specific file in case the Agent restarts"""
-    filename = '{}{}.{}'.format(job_name, job_instance_id, extension)
-    write_yaml(content, INSTANCES_FOLDER / filename)
-    return filename
+    """Save informations about a job in the instances journal in case the Agent restarts"""
+    InstancesJournal().record(job_name, job_instance_id, extension, content)
+
+
+def forget_recover_file(job_name, job_instance_id, extension):
+    """Forget informations about a job saved in the instances journal"""
+    InstancesJournal().remove(job_name, job_instance_id, extension)
+
+
+def instance_status(instance_infos, scheduled_job):
+    """Compute the status of a job instance from the informations
+    stored in the JobManager and its associated scheduler job.
+    """
+    try:
+        pid = instance_infos['pid']
+        return_code = instance_infos['return_code']
+    except KeyError:
+        return 'Stopped' if scheduled_job is None else 'Scheduled'
+
+    if return_code:
+        return 'Error'
+
+    if return_code is None:
+        assert psutil.pid_exists(pid)
+        return 'Running'
+
+    assert return_code == 0
+    if scheduled_job:
+        assert isinstance(scheduled_job.trigger, IntervalTrigger)
+        return 'Running'
+
+    return 'Not Running'
+
+
+def parse_isolation(isolation):
+    """Validate the placement controls requested for a job
+    instance and return them in a normalized form.
+
+    Supported controls are a set of `cpus` (list of CPU numbers or
+    a string like "0-3,6"), a `nice` level, a `realtime` SCHED_FIFO
+    priority and `cgroup` limits given as a mapping of cgroup v2
+    interface files (e.g. "cpu.max", "memory.max") to their values.
+    """
+    if not isolation:
+        return None
+    if not isinstance(isolation, dict):
+        raise BadRequest('The isolation options should be given as a mapping')
+
+    unknown = set(isolation) - {'cpus', 'nice', 'realtime', 'cgroup'}
+    if unknown:
+        raise BadRequest(
+                'Unknown isolation options: {}'
+                .format(', '.join(sorted(unknown))))
+
+    if OS_TYPE != 'linux':
+        raise BadRequest('Isolation options are not supported on this platform')
+
+    normalized = {}
+    cpus = isolation.get('cpus')
+    if cpus is not None:
+        try:
+            if isinstance(cpus, str):
+                cpus = [
+                        cpu
+                        for chunk in cpus.split(',')
+                        for start, _, end in [chunk.partition('-')]
+                        for cpu in range(int(start), int(end or start) + 1)
+                ]
+            cpus = sorted({int(cpu) for cpu in cpus})
+        except (TypeError, ValueError):
+            raise BadRequest('The cpus to use should be a list of CPU numbers or a string like "0-3,6"')
+        available = os.sched_getaffinity(0)
+        if not cpus or not available.issuperset(cpus):
+            raise BadRequest(
+                    'The cpus to use should be a non-empty '
+                    'subset of {}'.format(sorted(available)))
+        normalized['cpus'] = cpus
+
+    nice = isolation.get('nice')
+    if nice is not None:
+        try:
+            nice = int(nice)
+        except (TypeError, ValueError):
+            raise BadRequest('The nice level should be an integer')
+        if not -20 <= nice <= 19:
+            raise BadRequest('The nice level should be between -20 and 19')
+        normalized['nice'] = nice
+
+    realtime = isolation.get('realtime')
+    if realtime is not None:
+        try:
+            realtime = int(realtime)
+        except (TypeError, ValueError):
+            raise BadRequest('The realtime priority should be an integer')
+        low = os.sched_get_priority_min(os.SCHED_FIFO)
+        high = os.sched_get_priority_max(os.SCHED_FIFO)
+        if not low <= realtime <= high:
+            raise BadRequest(
+                    'The realtime priority should be between '
+                    '{} and {}'.format(low, high))
+        normalized['realtime'] = realtime
+
+    cgroup = isolation.get('cgroup')
+    if cgroup is not None:
+        if not isinstance(cgroup, dict):
+            raise BadRequest('The cgroup limits should be given as a mapping')
+        allowed = {
+                'cpu.max', 'cpu.weight', 'cpuset.cpus', 'cpuset.mems',
+                'memory.max', 'memory.high', 'memory.swap.max',
+                'io.max', 'io.weight', 'pids.max',
+        }
+        unknown = set(cgroup) - allowed
+        if unknown:
+            raise BadRequest(
+                    'Unsupported cgroup limits: {}'
+                    .format(', '.join(sorted(unknown))))
+        if not (CGROUP_ROOT / 'cgroup.controllers').exists():
+            raise BadRequest('cgroup v2 is not available on this agent')
+        delegated = (CGROUP_ROOT / 'cgroup.subtree_control').read_text().split()
+        missing = {name.split('.')[0] for name in cgroup}.difference(delegated)
+        if missing:
+            raise BadRequest(
+                    'The cgroup controllers {} are not enabled '
+                    'for the children of the root cgroup'
+                    .format(', '.join(sorted(missing))))
+        normalized['cgroup'] = {name: str(value) for name, value in cgroup.items()}
+
+    return normalized or None
+
+
+def instance_cgroup(job_name, instance_id):
+    """Path of the cgroup dedicated to a job instance"""
+    return CGROUP_ROOT / 'openbach.slice' / '{}-{}.scope'.format(job_name, instance_id)
+
+
+def create_cgroup(job_name, instance_id, limits):
+    """Create the cgroup of a job instance and apply its limits.
+
+    The required controllers are enabled in the openbach slice
+    only; the root cgroup must already delegate them.
+    """
+    controllers = {name.split('.')[0] for name in limits}
+    cgroup = instance_cgroup(job_name, instance_id)
+    enable = ' '.join('+' + controller for controller in sorted(controllers))
+    cgroup.parent.mkdir(exist_ok=True)
+    if enable:
+        (cgroup.parent / 'cgroup.subtree_control').write_text(enable)
+    cgroup.mkdir(exist_ok=True)
+    for name, value in limits.items():
+        (cgroup / name).write_text(value)
+    return cgroup
+
+
+def remove_cgroup(job_name, instance_id):
+    cgroup = instance_cgroup(job_name, instance_id)
+    try:
+        cgroup.rmdir()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        syslog.syslog(
+                syslog.LOG_WARNING,
+                'Failed to remove the cgroup {}: {}'.format(cgroup, e))
+
+
+def isolate(pid, isolation, cgroup=None):
+    """Apply the placement controls of a job instance to the
+    process `pid`, or to the calling process if it is 0, before
+    it executes the job.
+    """
+    if cgroup is not None:
+        (cgroup / 'cgroup.procs').write_text(str(pid))
+    if 'cpus' in isolation:
+        os.sched_setaffinity(pid, isolation['cpus'])
+    if 'nice' in isolation:
+        os.setpriority(os.PRIO_PROCESS, pid, isolation['nice'])
+    if 'realtime' in isolation:
+        os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(isolation['realtime']))
 
 
 def popen(command, args, **kwargs):
@@ -567,10 +2137,217 @@ def popen(command, args, **kwargs):
             **kwargs)
 
 
+def popen_isolated(command, args, isolation, cgroup=None, **kwargs):
+    """Start a command through `popen` and apply the placement
+    controls of a job instance to it before it is executed.
+
+    The command is started behind a shell that waits on its
+    standard input for the agent to isolate it, then executes the
+    command in its place with /dev/null as standard input. This
+    way nothing runs outside of the requested isolation and no
+    Python code runs in the child forked by this threaded process.
+    """
+    ready, release = os.pipe()
+    try:
+        try:
+            process = popen(ISOLATION_WRAPPER, command + args, stdin=ready, **kwargs)
+        finally:
+            os.close(ready)
+        try:
+            isolate(process.pid, isolation, cgroup)
+        except OSError:
+            # The shell exits without running the command
+            # once its standard input is closed
+            with suppress(psutil.Error):
+                process.kill()
+            process.wait()
+            raise
+        os.write(release, b'\n')
+    finally:
+        os.close(release)
+    return process
+
+
+def run_zygote(connection, preload):
+    """Entry point of the Python zygote process"""
+    for module in preload:
+        try:
+            __import__(module)
+        except Exception as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Python zygote failed to preload {}: {}'
+                    .format(module, e))
+
+    job = serve_zygote(connection)
+    if job is not None:
+        # Forked child of the zygote
+        run_python_job(*job)
+
+
+def serve_zygote(connection):
+    """Fork a process for each job received on the connection and
+    report their termination, until the agent closes it.
+
+    Return the job to run in the forked processes and None in
+    the zygote once it should exit.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    wakeup, notifier = socket.socketpair()
+    wakeup.setblocking(False)
+    notifier.setblocking(False)
+    signal.set_wakeup_fd(notifier.fileno())
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    try:
+        while True:
+            ready = multiprocessing.connection.wait([connection, wakeup])
+            if wakeup in ready:
+                with suppress(OSError):
+                    wakeup.recv(4096)
+                for pid, status in iter(reap_child, None):
+                    connection.send(('exited', pid, status))
+
+            if connection in ready:
+                job = connection.recv()
+                if job is None:
+                    return None
+                token, *job, isolation, cgroup = job
+                ready, report = os.pipe()
+                try:
+                    pid = os.fork()
+                except OSError as e:
+                    os.close(ready)
+                    os.close(report)
+                    connection.send(('started', token, None, str(e)))
+                    continue
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+                    connection.close()
+                    wakeup.close()
+                    notifier.close()
+                    os.close(ready)
+                    # The zygote is single-threaded: the forked process
+                    # can safely isolate itself before running the job
+                    try:
+                        if isolation:
+                            isolate(0, isolation, cgroup and Path(cgroup))
+                    except OSError as e:
+                        os.write(report, str(e).encode())
+                        os._exit(1)
+                    os.close(report)
+                    return job
+
+                os.close(report)
+                with open(ready, 'rb') as failure:
+                    error = failure.read().decode()
+                if error:
+                    os.waitpid(pid, 0)
+                    connection.send(('started', token, None, error))
+                else:
+                    connection.send(('started', token, pid, None))
+    except (EOFError, OSError):
+        # The agent is gone
+        return None
+
+
+def reap_child():
+    """Collect a terminated child of the current process and return
+    its pid and return code, or None if none terminated.
+    """
+    try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+    except ChildProcessError:
+        return None
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        return pid, -os.WTERMSIG(status)
+    return pid, os.WEXITSTATUS(status)
+
+
+def run_python_job(script, args, environ, working_directory):
+    """Run a Python job script in a process forked from the zygote,
+    mimicking what `popen` would have done for it.
+    """
+    os.setsid()
+
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    os.close(devnull)
+    sys.stdout = open(1, 'w', closefd=False)
+    sys.stderr = open(2, 'w', closefd=False)
+
+    os.chdir(working_directory)
+    os.environ.clear()
+    os.environ.update(environ)
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name='__main__')
+
+
+def spawn(command, args, env, isolation=None, cgroup=None, **kwargs):
+    """Start a job process, forking it from the Python zygote
+    when possible or through `popen` otherwise, and isolate
+    it before the job is executed.
+    """
+    zygote = PythonZygote()
+    script = zygote.script(command)
+    if script is not None:
+        try:
+            return zygote.spawn(script, args, env, isolation, cgroup)
+        except Exception as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Failed to start {} from the Python zygote, '
+                    'falling back to a new interpreter: {}'
+                    .format(script, e))
+    if OS_TYPE == 'linux':
+        # Let job instances be signaled as a whole
+        kwargs['start_new_session'] = True
+    if isolation:
+        return popen_isolated(command, args, isolation, cgroup, env=env, **kwargs)
+    return popen(command, args, env=env, **kwargs)
+
+
+def wait_until(deadline, spin=0.002):
+    """Block until the given datetime using the monotonic clock:
+    sleep most of the time and busy-wait the last `spin` seconds.
+    """
+    target = time.monotonic() + deadline.timestamp() - time.time()
+    remaining = target - time.monotonic()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while time.monotonic() < target:
+        pass
+
+
 def launch_job(
         job_name, instance_id, scenario_instance_id,
-        owner_scenario_instance_id, command, args):
-    """Launch the Job Instance and wait for its termination"""
+        owner_scenario_instance_id, command, args, deadline=None):
+    """Launch the Job Instance and let the ProcessSupervisor
+    take care of its termination.
+
+    When a deadline is given, everything is prepared beforehand
+    and the process is started as close to it as possible; the
+    achieved offset is then recorded alongside the instance.
+    """
+    try:
+        instance = JobManager().get_instance(job_name, instance_id)
+    except KeyError:
+        # Instance removed in the meantime
+        return
+
+    if 'pid' in instance and instance['return_code'] is None:
+        syslog.syslog(
+                syslog.LOG_WARNING,
+                'Instance {} of job {} is still running, skipping '
+                'this execution'.format(instance_id, job_name))
+        return
+
     # Add some environement variable for the Job Instance
     environ = os.environ.copy()
     environ.update({
@@ -581,76 +2358,161 @@ def launch_job(
     })
 
     # Launch the Job Instance
-    job_config = JobManager().get_job(job_name)
-    proc = popen(command, args, env=environ, shell=job_config['sudo'])
+    isolation = instance.get('isolation')
+    try:
+        cgroup = None
+        if isolation and 'cgroup' in isolation:
+            cgroup = create_cgroup(job_name, instance_id, isolation['cgroup'])
+        if deadline is not None:
+            wait_until(deadline)
+        proc = spawn(command, args, environ, isolation, cgroup, shell=instance['sudo'])
+    except (OSError, subprocess.SubprocessError) as e:
+        error = 'Failed to start instance {} of job {}: {}'.format(instance_id, job_name, e)
+        syslog.syslog(syslog.LOG_ERR, error)
+        JobManager().set_instance_failed(job_name, instance_id, error)
+        JobEvents().publish('finished', job_name, instance_id, pid=None, return_code=1, error=error)
+        remove_cgroup(job_name, instance_id)
+        return
+    start_offset = None
+    if deadline is not None:
+        # Time elapsed between the deadline and the process being
+        # executed, in milliseconds
+        start_offset = round((time.time() - deadline.timestamp()) * 1000, 3)
+
     pid = proc.pid
-    JobManager().set_instance_started(job_name, instance_id, pid)
-    return_code = proc.wait()
-    JobManager().set_instance_status(job_name, instance_id, pid, return_code)
+    JobManager().set_instance_started(job_name, instance_id, pid, start_offset)
+    JobEvents().publish('started', job_name, instance_id, pid=pid, start_offset=start_offset)
+    ResourcesMonitor().watch(job_name, instance_id, pid, scenario_instance_id, owner_scenario_instance_id)
+    ProcessSupervisor().watch(proc, functools.partial(job_terminated, job_name, instance_id, pid))
+
+
+def job_terminated(job_name, instance_id, pid, return_code):
+    """Record the termination of a Job Instance"""
+    ResourcesMonitor().forget(job_name, instance_id)
+    remove_cgroup(job_name, instance_id)
+    if JobManager().set_instance_status(job_name, instance_id, pid, return_code):
+        JobEvents().publish('finished', job_name, instance_id, pid=pid, return_code=return_code)
 
 
 def stop_job(job_name, job_instance_id, remove_recover_file=True):
     """Cancels the execution of a job or stop the instance if
     it was already scheduled.
     """
-    with JobManager() as manager:
-        try:
-            infos = manager.pop_instance(job_name, job_instance_id)
-            args = infos['args']
-            command = infos['command_stop']
-        except KeyError:
-            pass  # Job is already stopped
-        else:
-            stop_job_already_running(job_name, job_instance_id, infos)
-            if command:
-                job_config = manager.get_job(job_name)
-                popen(command, args, shell=job_config['sudo']).wait()
-        finally:
-            with suppress(JobLookupError):
-                manager.scheduler.remove_job('{}_{}'.format(job_name, job_instance_id))
-            if remove_recover_file:
-                with suppress(OSError):
-                    os.remove(recover_file(job_name, job_instance_id, 'start'))
+    stop_jobs([(job_name, job_instance_id)], remove_recover_file)
+
 
+def stop_jobs(instances, remove_recover_file=True):
+    """Cancels the execution of several jobs or stop the instances
+    if they were already scheduled. Running instances are terminated
+    all together rather than one after the other.
+    """
+    manager = JobManager()
+    stopped = []
+    for job_name, job_instance_id in instances:
+        try:
+            with manager.locked(job_name):
+                with suppress(JobLookupError):
+                    manager.scheduler.remove_job('{}_{}'.format(job_name, job_instance_id))
+                infos = manager.pop_instance(job_name, job_instance_id)
+        except (KeyError, BadRequest):
+            continue  # Job is already stopped
+        stopped.append((job_name, job_instance_id, infos))
+
+    terminate_instances(
+            (job_name, job_instance_id, infos['pid'])
+            for job_name, job_instance_id, infos in stopped)
+
+    stop_commands = []
+    for job_name, job_instance_id, infos in stopped:
+        JobEvents().publish('killed', job_name, job_instance_id, pid=infos['pid'])
+        command = infos['command_stop']
+        if command:
+            stop_commands.append(popen(command, infos['args'], shell=infos['sudo']))
+    for process in stop_commands:
+        process.wait()
+
+    if remove_recover_file:
+        for job_name, job_instance_id in instances:
+            with suppress(OSError):
+                forget_recover_file(job_name, job_instance_id, 'start')
+                forget_recover_file(job_name, job_instance_id, 'stop')
 
-def stop_job_already_running(job_name, job_instance_id, instance_infos):
-    """Stop a running process that should be a child of the Agent"""
 
-    # Get the process
-    try:
-        pid = instance_infos['pid']
-    except KeyError:
+def signal_instance(pid, cgroup, processes, signal_number):
+    """Send a signal to the whole process group of a job instance, as
+    well as to its processes that left the group. SIGKILL is delivered
+    through the instance cgroup when it exists.
+    """
+    if signal_number == signal.SIGKILL and cgroup is not None:
+        with suppress(OSError):
+            (cgroup / 'cgroup.kill').write_text('1')
+
+    group = None
+    if hasattr(os, 'killpg'):
+        with suppress(OSError):
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, signal_number)
+                group = pid
+
+    for process in processes:
+        with suppress(psutil.AccessDenied, psutil.NoSuchProcess, OSError):
+            if group is None or os.getpgid(process.pid) != group:
+                process.send_signal(signal_number)
+
+
+def terminate_instances(instances, timeout=2):
+    """Stop the running processes of several job instances, given as
+    (job name, instance id, pid) triplets. Their process trees are
+    terminated at once and share a single deadline before being killed.
+    """
+    targets = []
+    for job_name, job_instance_id, pid in instances:
+        if pid is None:
+            # Never started or failed to start
+            continue
+        try:
+            process = psutil.Process(pid)
+            tree = [process, *process.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            continue
+        cgroup = None
+        if CGROUP_ROOT is not None:
+            cgroup = instance_cgroup(job_name, job_instance_id)
+            if not cgroup.exists():
+                cgroup = None
+        targets.append((pid, cgroup, tree))
+
+    if not targets:
         return
-    try:
-        proc = psutil.Process(pid)
-    except psutil.NoSuchProcess:
+
+    processes = [process for _, _, tree in targets for process in tree]
+    for pid, cgroup, tree in targets:
+        signal_instance(pid, cgroup, tree, signal.SIGTERM)
+    _, still_alive = psutil.wait_procs(processes, timeout=timeout)
+    if not still_alive:
         return
 
-    # Kill all its children
-    children = proc.children(recursive=True)
-    for child in children:
-        with suppress(psutil.AccessDenied, psutil.NoSuchProcess):
-            child.terminate()
-    _, still_alive = psutil.wait_procs(children, timeout=1)
-    for child in still_alive:
-        with suppress(psutil.AccessDenied, psutil.NoSuchProcess):
-            child.kill()
-
-    # Kill the process
-    with suppress(psutil.AccessDenied, psutil.NoSuchProcess):
-        proc.terminate()
-        try:
-            proc.wait(timeout=2)
-        except psutil.TimeoutExpired:
-            proc.kill()
+    kill = getattr(signal, 'SIGKILL', signal.SIGTERM)
+    for pid, cgroup, tree in targets:
+        signal_instance(pid, cgroup, [p for p in tree if p in still_alive], kill)
+    psutil.wait_procs(still_alive, timeout=timeout)
 
 
 class AgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     """Choose the underlying technology for our sockets servers"""
     allow_reuse_address = True
+    # Kept-alive connections may stay idle for KEEP_ALIVE_TIMEOUT
+    # seconds, do not wait for them when stopping the agent
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        AgentMetrics().request_accepted(request)
+        super().process_request(request, client_address)
 
 
 class RequestHandler(socketserver.BaseRequestHandler):
+    KEEP_ALIVE_TIMEOUT = 60  # seconds
+
     def _read_all(self, amount):
         expected = amount
         buffer = bytearray(amount)
@@ -662,23 +2524,57 @@ class RequestHandler(socketserver.BaseRequestHandler):
             amount -= received
         return buffer
 
+    def setup(self):
+        AgentMetrics().request_started(self.request)
+
     def finish(self):
+        AgentMetrics().request_finished()
         self.request.close()
 
     def handle(self):
-        """Handle message comming from the conductor"""
+        """Handle messages comming from the conductor.
+
+        A request asking for it keeps the connection open so the
+        conductor can send further requests on it, until it stays
+        idle for KEEP_ALIVE_TIMEOUT seconds.
+        """
+        if not self.handle_request():
+            return
+
+        self.request.settimeout(self.KEEP_ALIVE_TIMEOUT)
+        while True:
+            try:
+                header = self.request.recv(1, socket.MSG_PEEK)
+            except OSError:
+                return  # Idle for too long or connection reset
+            if not header:
+                return  # Conductor closed the connection
+            if not self.handle_request():
+                return
+
+    def handle_request(self):
+        """Handle a single message and return whether the
+        connection should be kept open for the next one.
+        """
+        self.request_id = None
+        keep_alive = False
         try:
             message_length = self._read_all(4)
             message_length, = struct.unpack('>I', message_length)
             message = self._read_all(message_length).decode()
             syslog.syslog(syslog.LOG_INFO, message)
-            message = yaml.safe_load(message)
+            message = parse_message(message)
             action_name = message['command_name']
+            self.request_id = message.get('request_id')
+            keep_alive = bool(message.get('keep_alive'))
             arguments = message['command_arguments']
             action = ''.join(map(str.title, action_name.split('_')))
             handler = getattr(sys.modules[__name__], action)(**arguments)
         except TruncatedMessageException as e:
             self.send_response(str(e), syslog.LOG_WARNING)
+            return False
+        except BadRequest as e:
+            self.send_response(e.reason, syslog.LOG_CRIT)
         except yaml.error.YAMLError as e:
             self.send_response(
                     'Error parsing the message as a JSON '
@@ -702,36 +2598,80 @@ class RequestHandler(socketserver.BaseRequestHandler):
         except Exception:
             self.send_response(traceback.format_exc(), syslog.LOG_ALERT)
         else:
+            started = time.monotonic()
             try:
                 result = handler.action()
             except BadRequest as e:
+                self._action_handled(handler, started, error=True)
                 self.send_response(e.reason, syslog.LOG_ERR)
             except RequestWarning as e:
+                self._action_handled(handler, started, warning=True)
                 self.send_response(e.reason, syslog.LOG_WARNING)
             except Exception as e:
+                self._action_handled(handler, started, error=True)
                 self.send_response(traceback.format_exc(), syslog.LOG_ERR)
             else:
+                self._action_handled(handler, started)
                 self.send_response(result)
+                handler.stream(self.request)
+        return keep_alive
+
+    def _action_handled(self, handler, started, error=False, warning=False):
+        name = handler.__class__.__name__
+        AgentMetrics().action_handled(name, time.monotonic() - started, error, warning)
 
     def send_response(self, message, severity=None):
-        if severity is None:
-            status = 'OK'
-            key = 'result'
-        elif severity == syslog.LOG_WARNING:
-            status = 'OK'
-            key = 'warning'
-            syslog.syslog(severity, message)
-        else:
-            status = 'KO'
-            key = 'error'
-            syslog.syslog(severity, message)
+        response = format_response(message, severity)
+        if self.request_id is not None:
+            response['request_id'] = self.request_id
+        send_message(self.request, response)
 
-        result = json.dumps({
-            'status': status,
-            key: message,
-        }).encode()
-        length = struct.pack('>I', len(result))
-        self.request.sendall(length + result)
+
+def parse_message(message):
+    """Decode a message coming from the conductor.
+
+    The conductor sends JSON so use the (much faster) JSON parser
+    for anything that looks like it and keep YAML as a fallback
+    for older or hand-crafted messages.
+    """
+    decoded = None
+    if message.lstrip().startswith('{'):
+        with suppress(ValueError):
+            decoded = json.loads(message)
+    if decoded is None:
+        decoded = yaml.safe_load(message)
+    if not isinstance(decoded, dict):
+        raise BadRequest('The message should be a mapping, got {!r}'.format(decoded))
+    return decoded
+
+
+def send_message(connection, content):
+    """Send a JSON message prefixed by its length"""
+    message = json.dumps(content).encode()
+    length = struct.pack('>I', len(message))
+    connection.sendall(length + message)
+
+
+def format_response(message, severity=None):
+    """Build the response to a command and log it if it
+    is a warning or an error.
+    """
+    if severity is None:
+        status = 'OK'
+        key = 'result'
+    elif severity == syslog.LOG_WARNING:
+        status = 'OK'
+        key = 'warning'
+        syslog.syslog(severity, message)
+    else:
+        status = 'KO'
+        key = 'error'
+        syslog.syslog(severity, message)
+
+    return {
+        'status': status,
+        key: message,
+    }
 
 
 def list_jobs_in_dir(dirname):
@@ -744,6 +2684,39 @@ def list_jobs_in_dir(dirname):
 
 
 def read_job_configuration(job_name):
+    """Retrieve the configuration of a job from its compiled
+    version, or parse its YAML file if it changed since the
+    last compilation.
+    """
+    filepath = JOBS_FOLDER / '{}.yml'.format(job_name)
+    try:
+        stat = filepath.stat()
+    except FileNotFoundError:
+        raise BadRequest('Conf file {} does not exist'.format(filepath.name))
+
+    source = {
+            'path': str(filepath),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+    }
+    compiled_path = JOBS_CACHE_FOLDER / '{}.json'.format(job_name)
+    with suppress(OSError, ValueError, KeyError, TypeError):
+        with compiled_path.open(encoding='utf-8') as stream:
+            compiled = json.load(stream)
+        if compiled['source'] == source:
+            return compiled['configuration']
+
+    configuration = parse_job_configuration(job_name)
+    with suppress(OSError):
+        JOBS_CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+        temporary = compiled_path.with_suffix('.{}.tmp'.format(threading.get_ident()))
+        with temporary.open('w', encoding='utf-8') as stream:
+            json.dump({'source': source, 'configuration': configuration}, stream)
+        os.replace(str(temporary), str(compiled_path))
+    return configuration
+
+
+def parse_job_configuration(job_name):
     # Load the configuration
     filename = '{}.yml'.format(job_name)
     try:
@@ -821,12 +2794,12 @@ def populate_installed_jobs():
     """Read configuration files of Installed Jobs and
     store them into the JobManager.
     """
-    with JobManager() as manager:
-        for job in list_jobs_in_dir(JOBS_FOLDER):
-            try:
-                manager.add_job(job)
-            except RequestWarning as e:
-                syslog.syslog(syslog.LOG_ERR, e.reason)
+    manager = JobManager()
+    for job in list_jobs_in_dir(JOBS_FOLDER):
+        try:
+            manager.add_job(job)
+        except RequestWarning as e:
+            syslog.syslog(syslog.LOG_ERR, e.reason)
 
 
 def recover_old_state():
@@ -834,36 +2807,111 @@ def recover_old_state():
     recover from a failure, depending of the current date.
     """
     loaders = {
-            '.start': StartJobInstanceAgent,
-            '.stop': StopJobInstanceAgent,
+            'start': StartJobInstanceAgent,
+            'stop': StopJobInstanceAgent,
     }
 
-    for filepath in INSTANCES_FOLDER.glob('**/*'):
+    journal = InstancesJournal()
+    for (job_name, instance_id, kind), content in journal.orders():
         try:
-            content = load_yaml(filepath)
             content['reschedule'] = True
-            handler = loaders[filepath.suffix](**content)
+            handler = loaders[kind](**content)
             handler.action()
         except Exception:
             with suppress(OSError):
-                os.remove(filepath)
+                journal.remove(job_name, instance_id, kind)
 
+    with suppress(OSError):
+        journal.compact()
 
-def read_listening_port(default=1112):
+
+def read_agent_configuration():
+    """Return the configuration of the agent found in the rstats
+    configuration file, or an empty one if it can't be read.
+    """
     try:
         content = load_yaml(RSTATS_CONFIG_FILE)
-        port = content['openbach_agent']['port']
-        return int(port)
-    except (KeyError, ValueError, FileNotFoundError, yaml.YAMLError):
+        configuration = content['openbach_agent']
+    except (KeyError, TypeError, FileNotFoundError, yaml.YAMLError):
+        return {}
+    return configuration if isinstance(configuration, dict) else {}
+
+
+def read_listening_port(default=1112):
+    try:
+        return int(read_agent_configuration()['port'])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def read_agent_name():
+    """Return the name of this agent the same way collect_agent does"""
+    for filename in AGENT_NAME_FILES:
+        with suppress(OSError):
+            with filename.open() as f:
+                return f.readline().strip()
+    return 'agent_name_not_found'
+
+
+def start_resources_monitor(default_interval=5):
+    """Start sampling the resources used by job instances,
+    unless disabled in the configuration.
+    """
+    configuration = read_agent_configuration().get('resources') or {}
+    try:
+        interval = float(configuration.get('interval', default_interval))
+    except (TypeError, ValueError):
+        interval = default_interval
+    if interval <= 0:
+        return
+
+    ResourcesMonitor().configure(interval, read_rstats_port())
+
+
+def read_rstats_port(default=1111):
+    try:
+        return int(load_yaml(RSTATS_CONFIG_FILE)['rstats']['port'])
+    except (KeyError, TypeError, ValueError, OSError, yaml.YAMLError):
         return default
 
 
+def start_metrics_emission():
+    """Periodically send the agent metrics as statistics
+    if enabled in the configuration.
+    """
+    configuration = read_agent_configuration().get('metrics') or {}
+    try:
+        interval = float(configuration.get('interval', 0))
+    except (TypeError, ValueError):
+        interval = 0
+    if interval > 0:
+        AgentMetrics().emit_periodically(interval, read_rstats_port())
+
+
+def start_zygote():
+    """Start the Python zygote if enabled in the configuration"""
+    configuration = read_agent_configuration().get('zygote') or {}
+    if not configuration.get('enabled', False):
+        return
+
+    preload = configuration.get('preload') or []
+    try:
+        PythonZygote().configure(preload)
+    except Exception as e:
+        syslog.syslog(
+                syslog.LOG_ERR,
+                'Failed to start the Python zygote: {}'.format(e))
+
+
 if __name__ == '__main__':
     syslog.openlog('openbach_agent', syslog.LOG_PID, syslog.LOG_USER)
     signal.signal(signal.SIGTERM, signal_term_handler)
     signal.signal(signal.SIGINT, signal_term_handler)
 
     populate_installed_jobs()
+    start_zygote()
+    start_resources_monitor()
+    start_metrics_emission()
     recover_old_state()
     port = read_listening_port()
     address = ('', port)
@@ -0,0 +1,325 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Unit tests of the self-contained parts of the Control-Agent.
+
+Run them from this folder with: python3 -m unittest tests
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import openbach_agent
+from openbach_agent import BadRequest, Histogram
+
+
+class TemporaryFolderMixin:
+    def setUp(self):
+        super().setUp()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+
+
+class HistogramTest(unittest.TestCase):
+    # Same cases for the copies in the agent and the conductor
+    def test_buckets_count_values_per_range(self):
+        histogram = Histogram()
+        for value in (0.0005, 0.001, 0.002, 0.7, 3600):
+            histogram.observe(value)
+
+        summary = histogram.to_dict()
+        self.assertEqual(summary['buckets']['0.001'], 2)
+        self.assertEqual(summary['buckets']['0.005'], 1)
+        self.assertEqual(summary['buckets']['1'], 1)
+        self.assertEqual(summary['buckets']['+Inf'], 1)
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['max'], 3600)
+
+    def test_summary(self):
+        histogram = Histogram()
+        for value in (-1, 1, 2):
+            histogram.observe(value)
+
+        summary = histogram.to_dict()
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['sum'], 3)
+        self.assertEqual(summary['mean'], 1)
+        self.assertEqual(summary['max'], 2)
+        # Negative durations are clamped to 0
+        self.assertEqual(summary['buckets']['0.001'], 1)
+
+    def test_empty(self):
+        summary = Histogram().to_dict()
+        self.assertEqual(summary['count'], 0)
+        self.assertEqual(summary['mean'], 0.0)
+        self.assertEqual(sum(summary['buckets'].values()), 0)
+
+
+class ParseMessageTest(unittest.TestCase):
+    def test_json(self):
+        message = {'command': 'status_jobs_agent', 'arguments': [1, 2]}
+        self.assertEqual(openbach_agent.parse_message(json.dumps(message)), message)
+
+    def test_yaml(self):
+        message = 'command: status_jobs_agent\narguments: [1, 2]'
+        self.assertEqual(
+                openbach_agent.parse_message(message),
+                {'command': 'status_jobs_agent', 'arguments': [1, 2]})
+
+    def test_yaml_flow_mapping(self):
+        # Looks like JSON but is only valid YAML
+        self.assertEqual(openbach_agent.parse_message('{command: stop}'), {'command': 'stop'})
+
+    def test_not_a_mapping(self):
+        for message in ('status_jobs_agent', '[1, 2]', '42', ''):
+            with self.assertRaises(BadRequest):
+                openbach_agent.parse_message(message)
+
+
+@unittest.skipUnless(openbach_agent.OS_TYPE == 'linux', 'Isolation is only supported on Linux')
+class ParseIsolationTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertIsNone(openbach_agent.parse_isolation(None))
+        self.assertIsNone(openbach_agent.parse_isolation({}))
+
+    def test_cpus(self):
+        cpu = min(os.sched_getaffinity(0))
+        self.assertEqual(openbach_agent.parse_isolation({'cpus': [cpu, cpu]}), {'cpus': [cpu]})
+        self.assertEqual(openbach_agent.parse_isolation({'cpus': '{0}-{0}'.format(cpu)}), {'cpus': [cpu]})
+
+    def test_unavailable_cpus(self):
+        cpu = max(os.sched_getaffinity(0)) + 1
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'cpus': [cpu]})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'cpus': 'first'})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'cpus': []})
+
+    def test_nice(self):
+        self.assertEqual(openbach_agent.parse_isolation({'nice': '5'}), {'nice': 5})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'nice': 20})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'nice': 'low'})
+
+    def test_realtime(self):
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'realtime': 1000})
+
+    def test_unknown_options(self):
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'memory': '1G'})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation(['cpus'])
+
+    def test_unsupported_cgroup_limits(self):
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'cgroup': {'cpu.stat': '1'}})
+        with self.assertRaises(BadRequest):
+            openbach_agent.parse_isolation({'cgroup': 'cpu.max'})
+
+    def test_cgroup_controllers_must_be_delegated(self):
+        with tempfile.TemporaryDirectory() as folder:
+            root = Path(folder)
+            (root / 'cgroup.controllers').write_text('cpu memory pids\n')
+            (root / 'cgroup.subtree_control').write_text('memory\n')
+            with mock.patch.object(openbach_agent, 'CGROUP_ROOT', root):
+                self.assertEqual(
+                        openbach_agent.parse_isolation({'cgroup': {'memory.max': 1024}}),
+                        {'cgroup': {'memory.max': '1024'}})
+                with self.assertRaises(BadRequest):
+                    openbach_agent.parse_isolation({'cgroup': {'cpu.max': '50000 100000'}})
+
+
+class InstancesJournalTest(TemporaryFolderMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        for name, path in (
+                ('INSTANCES_FOLDER', self.folder),
+                ('INSTANCES_JOURNAL', self.folder / 'journal'),
+                ('INSTANCES_SNAPSHOT', self.folder / 'snapshot')):
+            patcher = mock.patch.object(openbach_agent, name, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.restart)
+        self.restart()
+
+    def restart(self):
+        """Forget the shared state, as if the agent restarted"""
+        journal = openbach_agent.InstancesJournal()
+        with journal._mutex:
+            if journal._stream is not None:
+                journal._stream.close()
+            journal.__dict__.update(_orders=None, _stream=None, _records=0, _dirty=False)
+        return journal
+
+    def test_replay(self):
+        journal = openbach_agent.InstancesJournal()
+        journal.record('fping', 1, 'start', {'arguments': ['-c', '3']})
+        journal.record('fping', 1, 'stop', {'date': 42})
+        journal.record('iperf3', 2, 'start', {'arguments': []})
+        journal.remove('iperf3', 2, 'start')
+        journal.record('fping', 1, 'start', {'arguments': ['-c', '4']})
+        journal.sync()
+
+        orders = self.restart().orders()
+        self.assertEqual(orders, [
+            (('fping', 1, 'start'), {'arguments': ['-c', '4']}),
+            (('fping', 1, 'stop'), {'date': 42}),
+        ])
+
+    def test_partially_written_record(self):
+        journal = openbach_agent.InstancesJournal()
+        journal.record('fping', 1, 'start', {'arguments': []})
+        journal.sync()
+        with (self.folder / 'journal').open('a') as stream:
+            stream.write('["fping", 2, "sta')
+
+        orders = self.restart().orders()
+        self.assertEqual(orders, [(('fping', 1, 'start'), {'arguments': []})])
+
+    def test_compaction(self):
+        journal = openbach_agent.InstancesJournal()
+        with mock.patch.object(openbach_agent.InstancesJournal, 'COMPACTION_THRESHOLD', 10):
+            for instance_id in range(25):
+                journal.record('fping', instance_id, 'start', {'id': instance_id})
+                if instance_id % 2:
+                    journal.remove('fping', instance_id, 'start')
+        journal.sync()
+
+        self.assertTrue((self.folder / 'snapshot').exists())
+        with (self.folder / 'journal').open() as stream:
+            self.assertLess(len(stream.readlines()), 10)
+
+        orders = self.restart().orders()
+        self.assertEqual(
+                [content['id'] for _, content in orders],
+                [instance_id for instance_id in range(25) if not instance_id % 2])
+
+    def test_legacy_files(self):
+        (self.folder / 'fping1.start').write_text(
+                'name: fping\ninstance_id: 1\narguments: []\n')
+
+        orders = openbach_agent.InstancesJournal().orders()
+        self.assertEqual(orders, [(('fping', 1, 'start'), {'name': 'fping', 'instance_id': 1, 'arguments': []})])
+        self.assertFalse((self.folder / 'fping1.start').exists())
+        self.assertEqual(self.restart().orders(), orders)
+
+
+class StatisticsIndexTest(TemporaryFolderMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(openbach_agent, 'STATS_FOLDER', self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(openbach_agent.StatisticsIndex, 'CHUNK_SIZE', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.index = openbach_agent.StatisticsIndex()
+        self.index._files.clear()
+        self.addCleanup(self.index._files.clear)
+        (self.folder / 'fping').mkdir()
+
+    def write_statistics(self, filename, *statistics):
+        with (self.folder / 'fping' / filename).open('a') as stream:
+            for timestamp, job_instance_id, scenario_instance_id in statistics:
+                stream.write(json.dumps({
+                    'rtt': timestamp % 100,
+                    '_metadata': {
+                        'time': timestamp,
+                        'job_instance_id': job_instance_id,
+                        'scenario_instance_id': scenario_instance_id,
+                    },
+                }) + '\n')
+
+    def times(self, statistics):
+        return [statistic['_metadata']['time'] for statistic in statistics]
+
+    def test_query(self):
+        self.write_statistics('fping_1.stats', *((1000 + i, 1 + i % 2, 7) for i in range(20)))
+
+        statistics, cursor = self.index.query('fping', 1)
+        self.assertIsNone(cursor)
+        self.assertEqual(self.times(statistics), list(range(1000, 1020, 2)))
+
+        statistics, _ = self.index.query('fping', 2, scenario_instance_id=7, start=1005, end=1011)
+        self.assertEqual(self.times(statistics), [1005, 1007, 1009, 1011])
+
+        statistics, _ = self.index.query('fping', 2, scenario_instance_id=8)
+        self.assertEqual(statistics, [])
+
+    def test_pagination_across_files(self):
+        self.write_statistics('fping_1.stats', *((1000 + i, 1, 7) for i in range(5)))
+        self.write_statistics('fping_2.stats', *((2000 + i, 1, 7) for i in range(5)))
+
+        times, cursor = [], None
+        while True:
+            statistics, cursor = self.index.query('fping', 1, cursor=cursor, limit=3)
+            times.extend(self.times(statistics))
+            if cursor is None:
+                break
+        self.assertEqual(times, [*range(1000, 1005), *range(2000, 2005)])
+
+    def test_appended_statistics(self):
+        self.write_statistics('fping_1.stats', (1000, 1, 7))
+        self.assertEqual(len(self.index.query('fping', 1)[0]), 1)
+
+        self.write_statistics('fping_1.stats', (1001, 1, 7), (1002, 1, 7))
+        with (self.folder / 'fping' / 'fping_1.stats').open('a') as stream:
+            stream.write('{"rtt": 1, "_metadata": {"ti')
+        self.assertEqual(self.times(self.index.query('fping', 1)[0]), [1000, 1001, 1002])
+
+    def test_removed_files(self):
+        self.write_statistics('fping_1.stats', (1000, 1, 7))
+        self.write_statistics('fping_2.stats', (2000, 1, 7))
+        self.assertEqual(len(self.index.refresh('fping')), 2)
+
+        os.remove(str(self.folder / 'fping' / 'fping_1.stats'))
+        self.assertEqual([path.name for path in self.index.refresh('fping')], ['fping_2.stats'])
+        self.assertEqual(list(self.index._files), [self.folder / 'fping' / 'fping_2.stats'])
+        self.assertEqual(self.times(self.index.query('fping', 1)[0]), [2000])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.index.refresh('iperf3'), [])
+        self.assertEqual(self.index.query('iperf3', 1), ([], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
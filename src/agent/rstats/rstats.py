@@ -301,8 +301,8 @@ class StatsManager:
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.mutex.release()
 
-    def statistic_lookup(self, instance_id, scenario_id):
-        key = (instance_id, scenario_id)
+    def statistic_lookup(self, instance_id, scenario_id, origin=None):
+        key = (instance_id, scenario_id, origin)
         with self.mutex:
             try:
                 return self.cache[key]
@@ -334,6 +334,16 @@ class StatsManager:
         with self.mutex:
             yield from self.stats.items()
 
+    def instance_statistics(self, instance_id, scenario_id):
+        """Connections opened for a job instance, whatever their origin"""
+        with self.mutex:
+            return [
+                    self.stats[id_]
+                    for (instance, scenario, _), id_ in self.cache.items()
+                    if instance == instance_id and scenario == scenario_id
+                    and id_ in self.stats
+            ]
+
     def reset(self):
         with self.mutex:
             self.stats.clear()
@@ -355,7 +365,7 @@ def _handle_parse_errors(name, expected_type):
 
 
 def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
-                owner_scenario_instance_id, agent_name, override=False):
+                owner_scenario_instance_id, agent_name, override=False, origin=None):
     # Type conversion
     with _handle_parse_errors('job_instance_id', 'integer'):
         job_instance_id = int(job_instance_id)
@@ -367,7 +377,7 @@ def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
         override = bool(int(override))
 
     with StatsManager() as manager:
-        statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
+        statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id, origin)
 
         if override or statistic_id not in manager:
             manager[statistic_id] = Rstats(
@@ -434,9 +444,10 @@ def change_config(scenario_instance_id, job_instance_id, enable_broadcast, enabl
 
     with StatsManager() as manager:
         id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
-        client_connection = manager[id]
+        manager[id]  # Fail if the job instance did not open its connection
         default_rule = RstatsRule('default', RstatsRule.ACCEPT, enable_storage, enable_broadcast)
-        client_connection._rules['default'] = default_rule
+        for client_connection in manager.instance_statistics(job_instance_id, scenario_instance_id):
+            client_connection._rules['default'] = default_rule
 
 
 def restart():
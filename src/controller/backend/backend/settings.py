@@ -123,6 +123,23 @@ STATICFILES_DIRS = []
 STATIC_ROOT = os.path.join(BASE_DIR, 'static_root')
 
 
+# Requests from the backend are handled by a fixed amount of
+# conductor workers; requests that can not be queued are refused
+
+CONDUCTOR_WORKERS = 16
+CONDUCTOR_QUEUE_SIZE = 64
+
+# Long running conductor actions are executed by a limited amount of
+# threads, some of them being reserved for interactive actions
+
+CONDUCTOR_ACTION_WORKERS = 32
+CONDUCTOR_BULK_ACTION_WORKERS = 24
+
+# Facts gathered on the agents are reused for this amount of seconds
+
+CONDUCTOR_FACTS_TTL = 300
+
+
 try:
     from .local_settings import *
 except ImportError:
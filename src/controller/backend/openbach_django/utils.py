@@ -34,14 +34,15 @@ __credits__ = '''Contributors:
 '''
 
 
-import os
 import enum
+import time
 import json
 import shlex
 import socket
+import struct
 import syslog
 import pathlib
-import tempfile
+import threading
 import ipaddress
 
 
@@ -59,31 +60,109 @@ class BadRequest(Exception):
         syslog.syslog(severity, self.reason)
 
 
-def send_fifo(message, local_port=1113):
+_CONDUCTOR_CONNECTIONS = threading.local()
+# Shorter than the conductor keep-alive timeout so it never
+# closes a connection while a message is being sent on it
+_CONDUCTOR_IDLE_TIMEOUT = 30  # seconds
+
+
+def _receive_all(conductor, amount):
+    buffer = bytearray(amount)
+    view = memoryview(buffer)
+    received = 0
+    while received < amount:
+        size = conductor.recv_into(view[received:])
+        if not size:
+            break
+        received += size
+    return bytes(buffer[:received])
+
+
+def _conductor_connection(local_port):
+    """Return the connection to the conductor kept alive by
+    the current thread, if any, if it was used recently enough
+    and if the conductor did not close it in the meantime.
+    """
+    connection = getattr(_CONDUCTOR_CONNECTIONS, 'socket', None)
+    if connection is None or _CONDUCTOR_CONNECTIONS.port != local_port:
+        _close_conductor_connection()
+        return None
+
+    if time.monotonic() - _CONDUCTOR_CONNECTIONS.last_used > _CONDUCTOR_IDLE_TIMEOUT:
+        _close_conductor_connection()
+        return None
+
+    try:
+        connection.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        # Nothing to read, the connection is still opened
+        return connection
+    except OSError:
+        pass
+    # Either closed by the conductor or holding unexpected data
+    _close_conductor_connection()
+    return None
+
+
+def _close_conductor_connection():
+    connection = getattr(_CONDUCTOR_CONNECTIONS, 'socket', None)
+    _CONDUCTOR_CONNECTIONS.socket = None
+    if connection is not None:
+        connection.close()
+
+
+def send_conductor(message, local_port=1113, keep_alive=True):
     """Communicate a message on the given port of the local
-    machine through a socket and a FIFO file.
+    machine through a socket and return the response.
+
+    Messages are JSON documents prefixed by their length. Unless
+    `keep_alive` is False, the connection is kept opened and reused
+    by the next messages sent from the same thread.
 
-    Opens a FIFO and write the message to it, then send to
-    the other end the path to that FIFO. Wait for the other
-    end to write back a result and return it to the caller.
+    A message is never sent twice: it is only sent again on a new
+    connection if the reused one failed before it was delivered.
     """
-    with socket.create_connection(('localhost', local_port)) as conductor:
-        with tempfile.NamedTemporaryFile('w') as f:
-            fifoname = f.name
+    payload = json.dumps(message).encode()
+    payload = struct.pack('>I', len(payload)) + payload
+
+    conductor = _conductor_connection(local_port)
+    if conductor is not None:
+        try:
+            conductor.sendall(payload)
+        except OSError:
+            # Closed by the conductor right before
+            # sending, the message was not delivered
+            _close_conductor_connection()
+            conductor = None
+
+    if conductor is None:
         try:
-            os.mkfifo(fifoname)
+            conductor = socket.create_connection(('localhost', local_port))
+            conductor.sendall(payload)
         except OSError as e:
-            raise BadRequest('Can not create FIFO file', 400, {'error': e})
-        os.chmod(fifoname, 0o666)
-        conductor.send(json.dumps({'fifoname': fifoname}).encode())
-        with open(fifoname, 'w') as fifo:
-            fifo.write(json.dumps(message))
-        conductor.recv(16)  # Any response indicates end of processing
-
-    with open(fifoname, 'r') as fifo:
-        msg = fifo.read()
-    os.remove(fifoname)
-    return msg
+            raise BadRequest('Can not connect to the conductor', 500, {'error': str(e)})
+
+    try:
+        header = _receive_all(conductor, 4)
+        if len(header) != 4:
+            raise OSError('connection closed by the conductor')
+        length, = struct.unpack('>I', header)
+        response = _receive_all(conductor, length)
+        if len(response) != length:
+            raise OSError('truncated response from the conductor')
+    except OSError as e:
+        conductor.close()
+        _CONDUCTOR_CONNECTIONS.socket = None
+        raise BadRequest('Can not communicate with the conductor', 500, {'error': str(e)})
+
+    if keep_alive:
+        _CONDUCTOR_CONNECTIONS.socket = conductor
+        _CONDUCTOR_CONNECTIONS.port = local_port
+        _CONDUCTOR_CONNECTIONS.last_used = time.monotonic()
+    else:
+        conductor.close()
+        _CONDUCTOR_CONNECTIONS.socket = None
+    return response.decode()
 
 
 def nullable_json(model):
@@ -55,7 +55,7 @@ from django.db.utils import IntegrityError
 
 import yaml
 
-from .utils import send_fifo, extract_integer, user_to_json, build_storage_path
+from .utils import send_conductor, extract_integer, user_to_json, build_storage_path
 
 class GenericView(base.View):
     """Base class for our own class-based views"""
@@ -119,7 +119,7 @@ class GenericView(base.View):
     def conductor_execute(self, **command):
         """Send a command to openbach_conductor"""
         command['_username'] = self.request.user.get_username()
-        response = send_fifo(command)
+        response = send_conductor(command)
         result = json.loads(response)
         returncode = result.pop('returncode')
         return result['response'], returncode
@@ -636,7 +636,9 @@ class JobInstancesView(BaseJobInstanceView):
                 name=job_name, address=agent_ip,
                 arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                isolation=self.request.JSON.get('isolation'),
+                precise=self.request.JSON.get('precise', False))
 
     def _action_kill(self):
         """stop all the scenario instances and job instances"""
@@ -686,7 +688,9 @@ class JobInstanceView(BaseJobInstanceView):
                 command='restart_job_instance',
                 instance_id=id, arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                isolation=self.request.JSON.get('isolation'),
+                precise=self.request.JSON.get('precise', False))
 
 
 class ScenariosView(GenericView):
@@ -1098,6 +1102,14 @@ class VersionView(GenericView):
         return {'openbach_version': openbach_infos['version']}, 200
 
 
+class ConductorView(GenericView):
+    """Manage actions relative to the conductor itself"""
+
+    def get(self, request):
+        """Return the load of the conductor"""
+        return self.conductor_execute(command='status_conductor')
+
+
 class Reboot(GenericView):
     """Manage actions to reboot an agent"""
 
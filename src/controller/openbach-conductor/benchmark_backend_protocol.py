@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Benchmark of the protocol between the backend and the conductor.
+
+A conductor server answering each request with its own content is
+started in this process. Threads then send it requests either through
+a FIFO file, as the backend used to, or as length-prefixed messages
+with a new connection per request or on kept-alive connections, as
+the backend now does; the achieved throughput is printed. Run it
+from this folder on a controller:
+
+    PYTHONPATH=../backend/ python3 benchmark_backend_protocol.py --threads 4
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import time
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+
+from openbach_conductor import ConductorServer, BackendHandler
+
+
+class EchoHandler(BackendHandler):
+    """Answer requests without executing them, to only
+    measure the cost of exchanging them.
+    """
+
+    def process(self, request):
+        return {'response': request, 'returncode': 200}
+
+
+def receive_all(connection, amount):
+    buffer = bytearray()
+    while len(buffer) < amount:
+        received = connection.recv(amount - len(buffer))
+        if not received:
+            raise ConnectionError('connection closed by the conductor')
+        buffer.extend(received)
+    return bytes(buffer)
+
+
+def exchange(connection, message):
+    """Send a length-prefixed message and return the response"""
+    payload = json.dumps(message).encode()
+    connection.sendall(struct.pack('>I', len(payload)) + payload)
+    length, = struct.unpack('>I', receive_all(connection, 4))
+    return json.loads(receive_all(connection, length).decode())
+
+
+def fifo_client(address, requests):
+    """Send the requests the way the backend used to"""
+    for index in range(requests):
+        with socket.create_connection(address) as conductor:
+            with tempfile.NamedTemporaryFile('w') as f:
+                fifoname = f.name
+            os.mkfifo(fifoname)
+            conductor.send(json.dumps({'fifoname': fifoname}).encode())
+            with open(fifoname, 'w') as fifo:
+                fifo.write(json.dumps({'command': 'echo', 'index': index}))
+            conductor.recv(16)
+        with open(fifoname) as fifo:
+            json.loads(fifo.read())
+        os.remove(fifoname)
+
+
+def connection_client(address, requests):
+    """Send each request on a connection of its own"""
+    for index in range(requests):
+        with socket.create_connection(address) as conductor:
+            exchange(conductor, {'command': 'echo', 'index': index})
+
+
+def keep_alive_client(address, requests):
+    """Send every request on the same connection"""
+    with socket.create_connection(address) as conductor:
+        for index in range(requests):
+            exchange(conductor, {'command': 'echo', 'index': index})
+
+
+CLIENTS = (
+        ('FIFO files', fifo_client),
+        ('new connections', connection_client),
+        ('kept-alive connection', keep_alive_client),
+)
+
+
+def benchmark(client, address, threads, requests):
+    """Have `threads` threads send `requests` requests each
+    through `client` and return the number of requests per second.
+    """
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        client(address, requests)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    return threads * requests / (time.perf_counter() - started)
+
+
+def main(threads, requests):
+    server = ConductorServer(('localhost', 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for name, client in CLIENTS:
+            throughput = benchmark(client, server.server_address, threads, requests)
+            print('{:<22} {:.0f} requests/s'.format(name + ':', throughput))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__.splitlines()[0],
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-t', '--threads', type=int, default=4,
+            help='number of threads sending requests at once')
+    parser.add_argument(
+            '-r', '--requests', type=int, default=500,
+            help='number of requests sent by each thread')
+    args = parser.parse_args()
+    main(args.threads, args.requests)
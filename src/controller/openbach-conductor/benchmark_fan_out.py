@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Benchmark of the fan out of requests to slow agents.
+
+Fake agents answering every request after a fixed delay listen on
+the local host. A check_connection order is sent to each of them,
+one after the other and then through `fan_out`, and the time taken
+by both is printed. Run it from this folder on a controller:
+
+    PYTHONPATH=../backend/ python3 benchmark_fan_out.py --agents 50 --delay 100
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import time
+import struct
+import argparse
+import threading
+import socketserver
+
+# fan_out closes the database connections of its threads
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from lib.utils import fan_out
+from lib.openbach_communicator import AGENT_CONNECTIONS, OpenBachBaton
+
+
+class SlowAgentHandler(socketserver.BaseRequestHandler):
+    """Answer requests like an agent would, after `server.delay` seconds"""
+
+    def _receive(self, amount):
+        buffer = b''
+        while len(buffer) < amount:
+            received = self.request.recv(amount - len(buffer))
+            if not received:
+                raise EOFError
+            buffer += received
+        return buffer
+
+    def handle(self):
+        while True:
+            try:
+                length, = struct.unpack('>I', self._receive(4))
+                request = json.loads(self._receive(length).decode())
+            except (EOFError, OSError):
+                return
+            time.sleep(self.server.delay)
+            answer = json.dumps({
+                'status': 'OK',
+                'result': None,
+                'request_id': request.get('request_id'),
+            }).encode()
+            self.request.sendall(struct.pack('>I', len(answer)) + answer)
+
+
+class SlowAgent(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay):
+        super().__init__(('localhost', 0), SlowAgentHandler)
+        self.delay = delay
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def check_connection(address):
+    return OpenBachBaton(*address).check_connection()
+
+
+def sequentially(addresses):
+    return [check_connection(address) for address in addresses]
+
+
+def concurrently(addresses):
+    results = fan_out(check_connection, addresses)
+    for _, _, error in results:
+        if error is not None:
+            raise error
+    return [result for _, result, _ in results]
+
+
+def measure(send, addresses):
+    """Return the seconds taken by `send` to reach every agent,
+    starting without any connection to them.
+    """
+    AGENT_CONNECTIONS.close()
+    started = time.perf_counter()
+    send(addresses)
+    return time.perf_counter() - started
+
+
+def main(agents, delay):
+    servers = [SlowAgent(delay) for _ in range(agents)]
+    addresses = [server.server_address for server in servers]
+    try:
+        print('{} agents answering in {:.0f} ms:'.format(agents, delay * 1000))
+        print('  sequential requests: {:.3f} s'.format(measure(sequentially, addresses)))
+        print('  fan_out:             {:.3f} s'.format(measure(concurrently, addresses)))
+    finally:
+        AGENT_CONNECTIONS.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__.splitlines()[0],
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-a', '--agents', type=int, default=50,
+            help='number of fake agents')
+    parser.add_argument(
+            '-d', '--delay', type=float, default=100,
+            help='time taken by the agents to answer, in milliseconds')
+    args = parser.parse_args()
+    main(args.agents, args.delay / 1000)
@@ -99,6 +99,11 @@ class UnprocessableError(ConductorError):
     ERROR_CODE = 422
 
 
+class ServiceUnavailableError(ConductorError):
+    """Error dedicated to requests refused because the conductor is overloaded"""
+    ERROR_CODE = 503
+
+
 class ConductorWarning(ConductorError):
     """Exception dedicated to control flow allowing to
     set custom message in commands results.
@@ -34,9 +34,16 @@ __credits__ = '''Contributors:
 '''
 
 
+import os
 import json
+import time
 import struct
 import socket
+import select
+import asyncio
+import weakref
+import itertools
+import threading
 
 from . import errors
 
@@ -55,6 +62,39 @@ def receive_all(socket, amount):
     return buffer
 
 
+def parse_agent_response(response):
+    """Decode the response of an agent and return its
+    result or raise an error if the command failed.
+    """
+    return check_agent_response(decode_agent_response(response))
+
+
+def decode_agent_response(response):
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        raise errors.UnprocessableError(
+                'The agent did not send a JSON response',
+                agent_message=response)
+
+
+def check_agent_response(message):
+    try:
+        status = message['status']
+    except KeyError:
+        raise errors.UnprocessableError(
+                'The agent did not send the status '
+                'of the command in its JSON response',
+                agent_message=message)
+
+    if status != 'OK':
+        raise errors.UnprocessableError(
+                'The agent did not send a success message',
+                agent_message=message)
+
+    return message.get('result')
+
+
 class _BaseSocketCommunicator:
     def __init__(self, address, family, kind=socket.SOCK_STREAM):
         self.socket = None
@@ -92,9 +132,10 @@ class _BaseSocketCommunicator:
         return receive_all(self.socket, length)
 
     def send_message(self, message):
+        # Single write so the body is not held back by Nagle's
+        # algorithm waiting for the ACK of the header
         length = struct.pack('>I', len(message))
-        self.socket.sendall(length)
-        self.socket.sendall(message)
+        self.socket.sendall(length + message)
 
     def communicate(self, message):
         message = message.encode()
@@ -115,37 +156,409 @@ class _BaseSocketCommunicator:
                 .format(self.socket, st))
 
 
-class OpenBachBaton(_BaseSocketCommunicator):
-    def __init__(self, agent_ip, agent_port=1112):
-        address = (agent_ip, agent_port)
+class _StaleConnection(Exception):
+    """Raised when a pooled connection turns out to be closed"""
+
+
+class _AgentConnection(_BaseSocketCommunicator):
+    """Keep-alive connection to an agent, part of an AgentConnectionPool"""
+
+    def __init__(self, address):
         super().__init__(address, socket.AF_INET)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.last_used = time.monotonic()
 
-    def communicate(self, json_message):
-        message = json.dumps(json_message)
-        response = super().communicate(message).decode()
+    def _delete(self):
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+            self.socket = None
+
+    close = _delete
 
+    def is_healthy(self):
+        """Check that the agent did not close the connection in
+        the meantime: an idle connection must not be readable.
+        """
+        if self.socket is None:
+            return False
         try:
-            message = json.loads(response)
-        except json.JSONDecodeError:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def request(self, json_message, request_id):
+        json_message = dict(json_message, keep_alive=True, request_id=request_id)
+        message = json.dumps(json_message).encode()
+        try:
+            self.send_message(message)
+        except socket.timeout as e:
             raise errors.UnprocessableError(
-                    'The agent did not send a JSON response',
-                    agent_message=response)
+                    'Sending message through the socket {} failed: {}'
+                    .format(self.socket, e))
+        except OSError as e:
+            raise _StaleConnection(e)
+
         try:
-            status = message['status']
-        except KeyError:
+            response = self.receive_message()
+        except socket.timeout as e:
             raise errors.UnprocessableError(
-                    'The agent did not send the status '
-                    'of the command in its JSON response',
+                    'Sending message through the socket {} failed: {}'
+                    .format(self.socket, e))
+        except OSError as e:
+            raise _StaleConnection(e)
+        if not response:
+            # Closed by the agent before it read our message
+            raise _StaleConnection('connection closed by the agent')
+
+        self.last_used = time.monotonic()
+        message = decode_agent_response(response.decode())
+        if isinstance(message, dict) and message.get('request_id', request_id) != request_id:
+            raise errors.UnprocessableError(
+                    'The agent {} answered another request'
+                    .format(self._address),
                     agent_message=message)
+        return message
+
+
+class AgentConnectionPool:
+    """Conductor-wide pool of keep-alive connections to the
+    agents, keyed by their address and port.
+
+    At most MAX_CONNECTIONS_PER_AGENT requests are in flight at once
+    for a given agent; idle connections are checked before being
+    reused and closed after IDLE_TIMEOUT seconds.
+    """
+    MAX_CONNECTIONS_PER_AGENT = 4
+    IDLE_TIMEOUT = 30  # seconds, shorter than the agents one
+    ACQUIRE_TIMEOUT = 60  # seconds
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._idle = {}
+        self._limits = {}
+        self._request_ids = itertools.count(1)
+
+    def clear(self):
+        """Forget every connection, without closing them
+        (e.g. in a forked process sharing the sockets).
+        """
+        self._mutex = threading.Lock()
+        self._idle = {}
+        self._limits = {}
+
+    def close(self):
+        with self._mutex:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def discard(self, address):
+        """Close the idle connections to the agent at `address`"""
+        with self._mutex:
+            connections = self._idle.pop(address, [])
+        for connection in connections:
+            connection.close()
+
+    def request(self, address, json_message):
+        """Send a message to the agent at `address` and return its
+        decoded response, reusing an idle connection if possible.
+        """
+        with self._mutex:
+            limit = self._limits.setdefault(
+                    address, threading.BoundedSemaphore(self.MAX_CONNECTIONS_PER_AGENT))
+
+        if not limit.acquire(timeout=self.ACQUIRE_TIMEOUT):
+            raise errors.UnprocessableError(
+                    'Too many concurrent requests to the agent {}'
+                    .format(address))
+        try:
+            return self._request(address, json_message)
+        finally:
+            limit.release()
+
+    def _request(self, address, json_message):
+        while True:
+            connection = self._checkout(address)
+            reused = connection is not None
+            if connection is None:
+                connection = _AgentConnection(address)
+
+            request_id = next(self._request_ids)
+            try:
+                response = connection.request(json_message, request_id)
+            except _StaleConnection as e:
+                connection.close()
+                if reused:
+                    # The agent dropped this idle connection,
+                    # retry on a fresh one
+                    continue
+                raise errors.UnprocessableError(
+                        'Sending message through the socket {} failed: {}'
+                        .format(address, e))
+            except errors.UnprocessableError:
+                connection.close()
+                raise
+            else:
+                self._checkin(address, connection)
+                return response
+
+    def _checkout(self, address):
+        now = time.monotonic()
+        expired = []
+        found = None
+        with self._mutex:
+            connections = self._idle.get(address, [])
+            while connections:
+                connection = connections.pop()
+                if now - connection.last_used > self.IDLE_TIMEOUT or not connection.is_healthy():
+                    expired.append(connection)
+                else:
+                    found = connection
+                    break
+        for connection in expired:
+            connection.close()
+        return found
+
+    def _checkin(self, address, connection):
+        now = time.monotonic()
+        expired = []
+        with self._mutex:
+            for key, connections in self._idle.items():
+                expired.extend(c for c in connections if now - c.last_used > self.IDLE_TIMEOUT)
+                connections[:] = [c for c in connections if now - c.last_used <= self.IDLE_TIMEOUT]
+            self._idle.setdefault(address, []).append(connection)
+        for connection in expired:
+            connection.close()
+
+
+AGENT_CONNECTIONS = AgentConnectionPool()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=AGENT_CONNECTIONS.clear)
+
+
+async def _receive_message(reader, timeout):
+    size = await asyncio.wait_for(reader.readexactly(4), timeout)
+    length, = struct.unpack('>I', size)
+    return await asyncio.wait_for(reader.readexactly(length), timeout)
+
+
+async def _send_message(writer, message, timeout):
+    writer.write(struct.pack('>I', len(message)) + message)
+    await asyncio.wait_for(writer.drain(), timeout)
+
 
-        if status != 'OK':
+class _AsyncSocketCommunicator:
+    """Asyncio counterpart of _BaseSocketCommunicator, the
+    connection is opened when the first message is sent.
+    """
+    TIMEOUT = 2  # seconds
+
+    def __init__(self, address):
+        self._address = address
+        self._reader = None
+        self._writer = None
+
+    def _open_connection(self):
+        raise NotImplementedError
+
+    async def _init(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                    self._open_connection(), self.TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise errors.UnprocessableError(
+                    'Cannot connect socket to its destination {}: {}'
+                    .format(self._address, e))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def communicate(self, message):
+        if self._writer is None:
+            await self._init()
+        message = message.encode()
+        try:
+            for _ in range(3):
+                try:
+                    await _send_message(self._writer, message, self.TIMEOUT)
+                except asyncio.TimeoutError as sock_timeout:
+                    st = sock_timeout
+                else:
+                    return await _receive_message(self._reader, self.TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            return bytes(e.partial)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise errors.UnprocessableError(
+                    'Sending message through the socket {} failed: {}'
+                    .format(self._address, e))
+        raise errors.UnprocessableError(
+                'Sending message through the socket {} failed: {}'
+                .format(self._address, st))
+
+
+class _AsyncAgentConnection:
+    """Keep-alive connection to an agent, part of an AsyncAgentConnectionPool"""
+    TIMEOUT = 2  # seconds
+
+    def __init__(self, address, reader, writer):
+        self._address = address
+        self._reader = reader
+        self._writer = writer
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def open(cls, address):
+        try:
+            reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*address), cls.TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise errors.UnprocessableError(
+                    'Cannot connect socket to its destination {}: {}'
+                    .format(address, e))
+        return cls(address, reader, writer)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    def is_healthy(self):
+        return (
+                self._writer is not None
+                and not self._writer.is_closing()
+                and not self._reader.at_eof()
+        )
+
+    async def request(self, json_message, request_id):
+        json_message = dict(json_message, keep_alive=True, request_id=request_id)
+        message = json.dumps(json_message).encode()
+        try:
+            await _send_message(self._writer, message, self.TIMEOUT)
+        except asyncio.TimeoutError as e:
+            raise errors.UnprocessableError(
+                    'Sending message through the socket {} failed: {}'
+                    .format(self._address, e))
+        except OSError as e:
+            raise _StaleConnection(e)
+
+        try:
+            response = await _receive_message(self._reader, self.TIMEOUT)
+        except asyncio.TimeoutError as e:
+            raise errors.UnprocessableError(
+                    'Sending message through the socket {} failed: {}'
+                    .format(self._address, e))
+        except asyncio.IncompleteReadError as e:
+            if not e.partial and e.expected == 4:
+                # Closed by the agent before it read our message
+                raise _StaleConnection('connection closed by the agent')
             raise errors.UnprocessableError(
-                    'The agent did not send a success message',
+                    'The agent {} sent a truncated response'
+                    .format(self._address))
+        except OSError as e:
+            raise _StaleConnection(e)
+
+        self.last_used = time.monotonic()
+        message = decode_agent_response(response.decode())
+        if isinstance(message, dict) and message.get('request_id', request_id) != request_id:
+            raise errors.UnprocessableError(
+                    'The agent {} answered another request'
+                    .format(self._address),
                     agent_message=message)
+        return message
+
+
+class AsyncAgentConnectionPool(AgentConnectionPool):
+    """Pool of keep-alive connections to the agents bound to an
+    event loop, with the same limits than AgentConnectionPool.
 
-        return message.get('result')
+    Requests are coroutines, so any number of them can be
+    outstanding at once without needing a thread each.
+    """
 
-    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    async def request(self, address, json_message):
+        """Send a message to the agent at `address` and return its
+        decoded response, reusing an idle connection if possible.
+        """
+        limit = self._limits.get(address)
+        if limit is None:
+            limit = asyncio.Semaphore(self.MAX_CONNECTIONS_PER_AGENT)
+            self._limits[address] = limit
+
+        try:
+            await asyncio.wait_for(limit.acquire(), self.ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise errors.UnprocessableError(
+                    'Too many concurrent requests to the agent {}'
+                    .format(address))
+        try:
+            return await self._request(address, json_message)
+        finally:
+            limit.release()
+
+    async def _request(self, address, json_message):
+        while True:
+            connection = self._checkout(address)
+            reused = connection is not None
+            if connection is None:
+                connection = await _AsyncAgentConnection.open(address)
+
+            request_id = next(self._request_ids)
+            try:
+                response = await connection.request(json_message, request_id)
+            except _StaleConnection as e:
+                connection.close()
+                if reused:
+                    # The agent dropped this idle connection,
+                    # retry on a fresh one
+                    continue
+                raise errors.UnprocessableError(
+                        'Sending message through the socket {} failed: {}'
+                        .format(address, e))
+            except BaseException:
+                # Also covers cancellation: the connection
+                # state is unknown and can not be reused
+                connection.close()
+                raise
+            else:
+                self._checkin(address, connection)
+                return response
+
+
+_ASYNC_AGENT_CONNECTIONS = weakref.WeakKeyDictionary()
+
+
+def async_agent_connections():
+    """Return the pool of keep-alive connections to
+    the agents associated to the running event loop.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        return _ASYNC_AGENT_CONNECTIONS[loop]
+    except KeyError:
+        pool = _ASYNC_AGENT_CONNECTIONS[loop] = AsyncAgentConnectionPool()
+        return pool
+
+
+class _BatonMessages:
+    """Orders understood by the agents; subclasses
+    define how they are sent through `communicate`.
+    """
+
+    def __init__(self, agent_ip, agent_port=1112):
+        self._address = (agent_ip, agent_port)
+
+    def communicate(self, json_message):
+        raise NotImplementedError
+
+    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, isolation=None, precise=False):
         message = {
                 'command_name': 'start_job_instance_agent',
                 'command_arguments': {
@@ -158,6 +571,10 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'arguments': arguments,
                 },
         }
+        if isolation:
+            message['command_arguments']['isolation'] = isolation
+        if precise:
+            message['command_arguments']['precise'] = True
         return self.communicate(message)
 
     def stop_job_instance(self, job_name, job_id, date='now'):
@@ -171,7 +588,20 @@ class OpenBachBaton(_BaseSocketCommunicator):
         }
         return self.communicate(message)
 
-    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    def stop_job_instances(self, instances, date='now'):
+        """Stop several job instances, given as (job name, job
+        instance id) pairs, at once.
+        """
+        message = {
+                'command_name': 'stop_job_instances_agent',
+                'command_arguments': {
+                    'instances': list(instances),
+                    'date': date,
+                },
+        }
+        return self.communicate(message)
+
+    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, isolation=None, precise=False):
         message = {
                 'command_name': 'restart_job_instance_agent',
                 'command_arguments': {
@@ -184,9 +614,13 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'arguments': arguments,
                 },
         }
+        if isolation:
+            message['command_arguments']['isolation'] = isolation
+        if precise:
+            message['command_arguments']['precise'] = True
         return self.communicate(message)
 
-    def status_job_instance(self, job_name, job_id):
+    def status_job_instance(self, job_name, job_id, resources=False):
         message = {
                 'command_name': 'status_job_instance_agent',
                 'command_arguments': {
@@ -194,6 +628,38 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'instance_id': job_id,
                 },
         }
+        if resources:
+            message['command_arguments']['resources'] = True
+        return self.communicate(message)
+
+    def status_job_instances(self, instances=None):
+        """Retrieve the status of several job instances at once.
+
+        Instances are given as (job name, job instance id) pairs;
+        omitting them retrieves the status of every instance known
+        to the agent.
+        """
+        message = {
+                'command_name': 'status_job_instances_agent',
+                'command_arguments': {
+                    'instances': None if instances is None else list(instances),
+                },
+        }
+        return self.communicate(message)
+
+    def batch(self, *commands):
+        """Send several start, stop, status or restart commands
+        at once and retrieve their individual responses in order.
+
+        Each command is a dictionary holding a 'command_name' and
+        its 'command_arguments', just like a regular message.
+        """
+        message = {
+                'command_name': 'batch',
+                'command_arguments': {
+                    'commands': list(commands),
+                },
+        }
         return self.communicate(message)
 
     def list_jobs(self):
@@ -235,6 +701,36 @@ class OpenBachBaton(_BaseSocketCommunicator):
         }
         return self.communicate(message)
 
+    def query_statistics(self, job_name, job_id, scenario_id=None, start=None, end=None, cursor=None, limit=1000):
+        """Retrieve a page of the statistics of a job instance stored
+        locally on the agent, optionally restricted to a time range
+        (timestamps in milliseconds).
+
+        The returned cursor should be given back to retrieve the next
+        page; it is None once every statistic has been retrieved.
+        """
+        message = {
+                'command_name': 'query_statistics_agent',
+                'command_arguments': {
+                    'name': job_name,
+                    'instance_id': job_id,
+                    'scenario_id': scenario_id,
+                    'start': start,
+                    'end': end,
+                    'cursor': cursor,
+                    'limit': limit,
+                },
+        }
+        return self.communicate(message)
+
+    def metrics(self):
+        """Retrieve the request and scheduling metrics of the agent"""
+        message = {
+                'command_name': 'metrics_agent',
+                'command_arguments': {},
+        }
+        return self.communicate(message)
+
     def change_collector(self, address, logs_port, logs_query, stats_port, stats_query, stats_database, stats_precision):
         message = {
                 'command_name': 'change_collector',
@@ -255,18 +751,97 @@ class OpenBachBaton(_BaseSocketCommunicator):
         return self.communicate(message)
 
 
-class OpenBachClapperBoard(_BaseSocketCommunicator):
-    def __init__(self, domain=DEFAULT_UNIX_DOMAIN):
-        super().__init__(domain, socket.AF_UNIX)
+class OpenBachBaton(_BatonMessages):
+    """Send orders to an agent through the conductor-wide
+    pool of keep-alive connections.
+    """
 
-    def communicate(self, **message):
+    def refresh(self):
+        """Drop the pooled connections to this agent so the
+        next order is sent through a fresh one.
+        """
+        AGENT_CONNECTIONS.discard(self._address)
+        return self
+
+    def communicate(self, json_message):
+        response = AGENT_CONNECTIONS.request(self._address, json_message)
+        return check_agent_response(response)
+
+
+class AsyncOpenBachBaton(_BatonMessages):
+    """Send orders to an agent through the pool of keep-alive
+    connections of the running event loop.
+
+    Each order returns a coroutine that should be awaited
+    to retrieve the response of the agent.
+    """
+
+    async def communicate(self, json_message):
+        response = await async_agent_connections().request(self._address, json_message)
+        return check_agent_response(response)
+
+
+class OpenBachSubscriber(_BaseSocketCommunicator):
+    """Long-lived connection to an agent receiving
+    the state transitions of its job instances.
+    """
+
+    def __init__(self, agent_ip, agent_port=1112):
+        address = (agent_ip, agent_port)
+        super().__init__(address, socket.AF_INET)
+
+    def subscribe_job_events(self, epoch=None, last_sequence=None, heartbeat=5):
+        """Ask the agent to publish its job events on this connection.
+
+        Providing the epoch and the sequence number of the last event
+        received on a previous subscription allows the agent to send
+        the missed events again. The agent reports whether some events
+        are lost and the job instances state should be resynchronized.
+        """
+        message = {
+                'command_name': 'subscribe_job_events_agent',
+                'command_arguments': {
+                    'epoch': epoch,
+                    'last_sequence': last_sequence,
+                    'heartbeat': heartbeat,
+                },
+        }
+        response = self.communicate(json.dumps(message)).decode()
+        self.socket.settimeout(3 * heartbeat)
+        return parse_agent_response(response)
+
+    def job_events(self):
+        """Generate the events published by the agent until
+        the connection is lost.
+        """
+        while True:
+            try:
+                message = self.receive_message()
+            except (OSError, socket.timeout) as e:
+                raise errors.UnprocessableError(
+                        'Lost connection to the agent {}: {}'
+                        .format(self._address, e))
+            if not message:
+                raise errors.UnprocessableError(
+                        'The agent {} closed the connection'
+                        .format(self._address))
+            yield json.loads(message.decode())
+
+
+class _ClapperBoardMessages:
+    """Orders understood by the director; subclasses
+    define how they are sent through `communicate`.
+    """
+
+    def _build_message(self, message):
         try:
             username = self.connected_user.get_username()
         except AttributeError:
             username = None
         message['user_name'] = username
+        return json.dumps(message)
 
-        payload = super().communicate(json.dumps(message))
+    def _parse_response(self, payload):
         if payload:
             response = json.loads(payload.decode())
             try:
@@ -276,12 +851,12 @@ class OpenBachClapperBoard(_BaseSocketCommunicator):
                 raise errors.UnprocessableError(
                         'Sending message through the socket {} '
                         'did not return a complete response'
-                        .format(self.socket))
+                        .format(self._address))
             return response, return_code
 
         raise errors.UnprocessableError(
                 'Sending message through the socket {} did '
-                'not return a response'.format(self.socket))
+                'not return a response'.format(self._address))
 
     def start_scenario_instance(self, scenario_instance_id):
         return self.communicate(action='start', scenario=scenario_instance_id)
@@ -294,3 +869,28 @@ class OpenBachClapperBoard(_BaseSocketCommunicator):
 
     def resume_scenario_instance(self, scenario_instance_id):
         return self.communicate(action='resume', scenario=scenario_instance_id)
+
+
+class OpenBachClapperBoard(_ClapperBoardMessages, _BaseSocketCommunicator):
+    def __init__(self, domain=DEFAULT_UNIX_DOMAIN):
+        super().__init__(domain, socket.AF_UNIX)
+
+    def communicate(self, **message):
+        payload = super().communicate(self._build_message(message))
+        return self._parse_response(payload)
+
+
+class AsyncOpenBachClapperBoard(_ClapperBoardMessages, _AsyncSocketCommunicator):
+    """Asyncio counterpart of OpenBachClapperBoard: each
+    order returns a coroutine that should be awaited.
+    """
+
+    def __init__(self, domain=DEFAULT_UNIX_DOMAIN):
+        super().__init__(domain)
+
+    def _open_connection(self):
+        return asyncio.open_unix_connection(self._address)
+
+    async def communicate(self, **message):
+        payload = await super().communicate(self._build_message(message))
+        return self._parse_response(payload)
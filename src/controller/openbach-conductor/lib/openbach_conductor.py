@@ -48,20 +48,20 @@ __credits__ = '''Contributors:
 import os
 import re
 import csv
+import time
 import shutil
 import syslog
 import tarfile
 import operator
 import tempfile
-import threading
 import itertools
+import threading
 import traceback
 import configparser
-from time import sleep
 from pathlib import Path
 from functools import wraps
 from datetime import datetime
-from contextlib import suppress
+from contextlib import suppress, contextmanager
 from ipaddress import IPv4Network
 from collections import defaultdict, Counter
 from distutils.version import StrictVersion
@@ -70,6 +70,7 @@ import yaml
 import numpy
 from fuzzywuzzy import fuzz
 from django import db
+from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User, AnonymousUser
@@ -95,11 +96,15 @@ from openbach_django.models import (
 )
 from openbach_django.utils import user_to_json
 from . import errors, external_jobs
-from .playbook_builder import start_playbook
+from .utils import fan_out, ServerMetrics, ActionExecutor
+from .playbook_builder import start_playbook, PlaybookMetrics
 from .openbach_communicator import OpenBachBaton, OpenBachClapperBoard
 
 
 TOPOLOGY_WORKERS = 10
+ACTIONS_EXECUTOR = ActionExecutor(
+        getattr(settings, 'CONDUCTOR_ACTION_WORKERS', 32),
+        getattr(settings, 'CONDUCTOR_BULK_ACTION_WORKERS', 24))
 _SEVERITY_MAPPING = {
     1: 3,   # Error
     2: 4,   # Warning
@@ -264,39 +269,86 @@ class ThreadedAction(ConductorAction):
     and set the state of the action in the backend database. Clients are
     responsible to check this state regularly to know when the action
     actually terminates.
+
+    Actions are run by a shared executor: interactive ones are run
+    before bulk ones and bulk actions targeting the same address are
+    run one after the other, in the order they were requested.
     """
 
+    PRIORITY = ActionExecutor.BULK
+
     def action(self):
         """Public entry point to execute the required action"""
         real_action = super().action
-        thread = threading.Thread(target=self._threaded_action, args=(real_action,))
-        thread.start()
+        command_result = self._create_command_result()
+        command_result.update({'state': 'Queued'}, 202)
+        ACTIONS_EXECUTOR.submit(
+                self._queued_action, real_action, command_result,
+                priority=self.PRIORITY, keys=self._serialization_keys())
         return {}, 202
 
     def _create_command_result(self):
         """Override this in subclasses to create the required CommandResult"""
         raise NotImplementedError
 
+    def _serialization_keys(self):
+        """Keys of the actions that must not run concurrently with
+        this one: bulk actions on the same address by default.
+        """
+        address = getattr(self, 'address', None)
+        if self.PRIORITY == ActionExecutor.INTERACTIVE or address is None:
+            return ()
+        return (address,)
+
+    def _queued_action(self, real_action, command_result):
+        command_result.update({'state': 'Running'}, 202)
+        with suppress(Exception):
+            # Errors are already logged and stored in the CommandResult
+            self._run_action(real_action, command_result)
+
     def _threaded_action(self, real_action):
         command_result = self._create_command_result()
+        self._run_action(real_action, command_result)
+
+    def _run_action(self, real_action, command_result):
         try:
             real_action()
-        except errors.ConductorError as e:
-            is_warning = isinstance(e, errors.ConductorWarning)
-            log_level = syslog.LOG_WARNING if is_warning else syslog.LOG_ERR
-            syslog.syslog(log_level, '{}'.format(e.json))
-            command_result.update(e.json, e.ERROR_CODE)
+        except Exception as e:
+            self.store_failure(command_result, e)
             raise
-        except Exception as err:
+        command_result.update(None, 204)
+
+    @staticmethod
+    def store_failure(command_result, error):
+        """Log an error and store it into the given CommandResult.
+
+        Must be called while handling `error` so unexpected
+        exceptions can be stored with their traceback.
+        """
+        if isinstance(error, errors.ConductorError):
+            is_warning = isinstance(error, errors.ConductorWarning)
+            log_level = syslog.LOG_WARNING if is_warning else syslog.LOG_ERR
+            syslog.syslog(log_level, '{}'.format(error.json))
+            command_result.update(error.json, error.ERROR_CODE)
+        else:
             infos = {
                     'message': 'An unexpected error occured',
-                    'error': str(err),
+                    'error': str(error),
                     'traceback': traceback.format_exc(),
             }
             syslog.syslog(syslog.LOG_ALERT, '{}'.format(infos))
             command_result.update(infos, 500)
-            raise
-        command_result.update(None, 204)
+
+    @staticmethod
+    @contextmanager
+    def storing_failure(command_result):
+        """Store any error raised in the managed block into the
+        given CommandResult instead of propagating it.
+        """
+        try:
+            yield
+        except Exception as e:
+            ThreadedAction.store_failure(command_result, e)
 
     @staticmethod
     def set_running(aggregator, field_name):
@@ -536,6 +588,112 @@ class ChangeCollectorAddress(CollectorAction):
 # Agent #
 #########
 
+class AgentFacts:
+    """Cache of the facts gathered on the Agents by Ansible.
+
+    Facts are kept for CONDUCTOR_FACTS_TTL seconds and shared by
+    every thread of the conductor. Missing facts are gathered for
+    all the requested Agents in a single playbook run; Agents whose
+    facts are already being gathered by another thread are waited
+    upon instead of being gathered twice, and share its failure if
+    they turn out to be unreachable.
+    """
+    __shared_state = {
+            'facts': {},
+            'failures': {},
+            'gathering': set(),
+            'generations': defaultdict(int),
+            '_condition': threading.Condition(),
+    }
+
+    TTL = getattr(settings, 'CONDUCTOR_FACTS_TTL', 300)  # seconds
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def gather(self, *addresses, cookie=None):
+        """Retrieve the facts of the given Agents.
+
+        Return the failures of the unreachable Agents as
+        well as the facts of the other ones.
+        """
+        facts, failures = {}, {}
+        pending = set(addresses)
+        started = time.monotonic()
+        while pending:
+            with self._condition:
+                now = time.monotonic()
+                for address in list(pending):
+                    with suppress(KeyError):
+                        gathered_at, agent_facts = self.facts[address]
+                        if now - gathered_at < self.TTL:
+                            facts[address] = agent_facts
+                            pending.remove(address)
+                            continue
+                    with suppress(KeyError):
+                        failed_at, failure = self.failures[address]
+                        if failed_at >= started:
+                            failures[address] = failure
+                            pending.remove(address)
+                missing = pending - self.gathering
+                if not missing:
+                    if pending:
+                        self._condition.wait()
+                    continue
+                self.gathering.update(missing)
+                generations = {address: self.generations[address] for address in missing}
+
+            unreachable, gathered = None, {}
+            try:
+                unreachable, gathered = start_playbook('gather_facts_of', *missing, cookie=cookie)
+            finally:
+                with self._condition:
+                    self.gathering.difference_update(missing)
+                    now = time.monotonic()
+                    for address in missing:
+                        # Do not store facts invalidated while gathering them
+                        if self.generations[address] != generations[address]:
+                            continue
+                        if address in gathered:
+                            self.facts[address] = (now, gathered[address])
+                            self.failures.pop(address, None)
+                        elif unreachable is not None:
+                            self.failures[address] = (now, unreachable.get(address))
+                    self._condition.notify_all()
+
+            facts.update(gathered)
+            failures.update(
+                    (address, unreachable.get(address))
+                    for address in missing if address not in gathered)
+            pending.difference_update(missing)
+
+        return failures, facts
+
+    def gather_one(self, address, cookie=None):
+        """Retrieve the facts of a single Agent or raise
+        an error if it could not be reached.
+        """
+        failures, facts = self.gather(address, cookie=cookie)
+        try:
+            return facts[address]
+        except KeyError:
+            raise errors.UnprocessableError(
+                    'Cannot retrieve the facts of the Agent',
+                    agent_address=address,
+                    failure=failures.get(address))
+
+    def invalidate(self, *addresses):
+        """Forget the facts of the given Agents so they are
+        gathered again on their next use.
+        """
+        with self._condition:
+            for address in addresses:
+                self.facts.pop(address, None)
+                self.failures.pop(address, None)
+                self.generations[address] += 1
+
+
 class AgentAction(ConductorAction):
     """Base class that defines helper methods to deal with Agents"""
 
@@ -616,6 +774,8 @@ class InstallAgent(ThreadedAction, AgentAction):
             except errors.ConductorError:
                 agent.delete()
                 raise
+            finally:
+                AgentFacts().invalidate(agent.address)
         agent.set_available(True)
         agent.set_status('Available')
         agent.save()
@@ -681,6 +841,7 @@ class UninstallAgent(ThreadedAction, AgentAction):
             agent.save()
             raise
         finally:
+            AgentFacts().invalidate(agent.address)
             agent.delete()
 
 
@@ -704,6 +865,8 @@ class AttachAgent(InstallAgent):
             except errors.ConductorError:
                 agent.delete()
                 raise
+            finally:
+                AgentFacts().invalidate(agent.address)
 
         jobs = set()
         try:
@@ -750,6 +913,7 @@ class DetachAgent(UninstallAgent):
             agent.save()
             raise
         finally:
+            AgentFacts().invalidate(agent.address)
             agent.delete()
 
 
@@ -789,6 +953,8 @@ class ListAgents(AgentAction):
             'ntp',
     )
 
+    UPDATE_TIMEOUT = 10  # seconds
+
     def __init__(self, update=False, services=False):
         super().__init__(update=update, services=services)
 
@@ -813,7 +979,16 @@ class ListAgents(AgentAction):
             errors, services = start_playbook('check_connections', *addresses)
             if self.services:
                 return [self._services_agent(agent, errors, services) for agent in agents], 200
-            return [self._infos_agent(agent, errors) for agent in agents], 200
+            # Workers update their own copy of the agent: a worker still
+            # running after the timeout must not alter the stored state
+            # reported in its stead.
+            results = fan_out(
+                    lambda agent: self._infos_agent(Agent.objects.get(pk=agent.pk), errors),
+                    agents, timeout=self.UPDATE_TIMEOUT)
+            return [
+                    result.item.json if result.error else result.result
+                    for result in results
+            ], 200
         return [agent.json for agent in agents], 200
 
     @staticmethod
@@ -1418,56 +1593,13 @@ class InstallJob(ThreadedAction, InstalledJobAction):
 
     @require_connected_user()
     def _action(self):
-        agent_infos = InfosAgent(self.address)
-        self.share_user(agent_infos)
-        agent_infos._check_user_can_use_agent()
-        agent = agent_infos.get_agent_or_not_found_error()
-        job = InfosJob(self.name).get_job_or_not_found_error()
-        self._check_user_can_manage_job(agent, job)
+        agent, job = self._get_agent_and_job()
 
         if not self.skip_playbook:
             # check os configuration arguments
-            ansible_fact = start_playbook('gather_facts',agent.address)
-            try:
-                job.os.get(
-                        family=ansible_fact['ansible_os_family'],
-                        distribution=ansible_fact['ansible_distribution'],
-                        version=ansible_fact['ansible_distribution_version'])
-            except OsCommand.DoesNotExist:
-                raise errors.UnprocessableError(
-                        'Cannot install a job on an '
-                        'agent: Unsupported Os',
-                        agent_address=self.address,
-                        job_name=self.name)
-
-            # Wait until all previous jobs installed on the same agents are done
-            start_date = InstalledJobCommandResult.objects.get(
-                    address=self.address,
-                    job_name=self.name).status_install.date
-            query = (
-                    (
-                        db.models.Q(status_install__date__lt=start_date)
-                        & db.models.Q(status_install__returncode=202)
-                    ) | (
-                        db.models.Q(status_uninstall__date__lt=start_date)
-                        & db.models.Q(status_uninstall__returncode=202)
-                    )
-            )
-            while InstalledJobCommandResult.objects.filter(query, address=self.address).exists():
-                sleep(1)
-
-            # If the job's major version is newer than installed, or older, reinstall
-            with suppress(InstalledJob.DoesNotExist):
-                installed_job = InstalledJob.objects.get(job=job, agent=agent)
-                installed_version = StrictVersion(installed_job.job_version)
-                current_version = StrictVersion(job.job_version)
-                if ((installed_version > current_version) or
-                        (installed_version.version[0] != current_version.version[0])):
-                    start_playbook(
-                            'uninstall_job',
-                            agent.address,
-                            agent.collector.address,
-                            job.name, job.path)
+            ansible_fact = AgentFacts().gather_one(agent.address, cookie=self.cookie)
+            self._check_os(job, ansible_fact)
+            self._uninstall_outdated(agent, job)
 
             # Physically install the job on the agent
             start_playbook(
@@ -1477,6 +1609,50 @@ class InstallJob(ThreadedAction, InstalledJobAction):
                     agent.collector.logs_port,
                     job.name, job.path,
                     cookie=self.cookie)
+
+        self._register_installed_job(agent, job)
+
+    def _get_agent_and_job(self):
+        agent_infos = InfosAgent(self.address)
+        self.share_user(agent_infos)
+        agent_infos._check_user_can_use_agent()
+        agent = agent_infos.get_agent_or_not_found_error()
+        job = InfosJob(self.name).get_job_or_not_found_error()
+        self._check_user_can_manage_job(agent, job)
+        return agent, job
+
+    def _check_os(self, job, ansible_fact):
+        try:
+            job.os.get(
+                    family=ansible_fact['ansible_os_family'],
+                    distribution=ansible_fact['ansible_distribution'],
+                    version=ansible_fact['ansible_distribution_version'])
+        except OsCommand.DoesNotExist:
+            raise errors.UnprocessableError(
+                    'Cannot install a job on an '
+                    'agent: Unsupported Os',
+                    agent_address=self.address,
+                    job_name=self.name)
+
+    def _uninstall_outdated(self, agent, job):
+        """If the job's major version is newer than installed, or older, uninstall it"""
+        with suppress(InstalledJob.DoesNotExist):
+            installed_job = InstalledJob.objects.get(job=job, agent=agent)
+            installed_version = StrictVersion(installed_job.job_version)
+            current_version = StrictVersion(job.job_version)
+            if ((installed_version > current_version) or
+                    (installed_version.version[0] != current_version.version[0])):
+                start_playbook(
+                        'uninstall_job',
+                        agent.address,
+                        agent.collector.address,
+                        job.name, job.path)
+
+    def _register_installed_job(self, agent, job, set_severity=True):
+        """Make the agent aware of the physically installed
+        job and store the installation in the database.
+        """
+        if not self.skip_playbook:
             OpenBachBaton(agent.address, agent.port).add_job(self.name)
 
         installed_job, created = InstalledJob.objects.get_or_create(
@@ -1487,7 +1663,7 @@ class InstallJob(ThreadedAction, InstalledJobAction):
         installed_job.update_status = timezone.now()
         installed_job.save()
 
-        if not self.skip_playbook:
+        if set_severity and not self.skip_playbook:
             with suppress(errors.ConductorError):
                 severity_setter = SetLogSeverityJob(
                         self.address, self.name,
@@ -1503,7 +1679,15 @@ class InstallJob(ThreadedAction, InstalledJobAction):
 
 
 class InstallJobs(InstalledJobAction):
-    """Action responsible for installing several Jobs on several Agents"""
+    """Action responsible for installing several Jobs on several Agents.
+
+    Unless playbooks are skipped, every Job is physically installed
+    on every Agent at once, by a single playbook run; the result of
+    each installation is still stored separately.
+    """
+
+    # Logs severity set by the installation playbook
+    DEFAULT_SYSLOG_SEVERITY = 4
 
     def __init__(self, addresses, names, severity=2, local_severity=2, skip_playbook=False, cookie=None):
         super().__init__(addresses=addresses, names=names,
@@ -1512,6 +1696,7 @@ class InstallJobs(InstalledJobAction):
 
     @require_connected_user()
     def _action(self):
+        installers = []
         for name, address in itertools.product(self.names, self.addresses):
             installer = InstallJob(
                     address, name,
@@ -1520,9 +1705,105 @@ class InstallJobs(InstalledJobAction):
                     self.skip_playbook,
                     self.cookie)
             self.share_user(installer)
-            installer.action()
+            installers.append(installer)
+
+        if self.skip_playbook or len(installers) < 2:
+            for installer in installers:
+                installer.action()
+        else:
+            self._queue_installations(installers)
         return {}, 202
 
+    def _queue_installations(self, installers):
+        installations = []
+        for installer in installers:
+            command_result, _ = InstalledJobCommandResult.objects.get_or_create(
+                    address=installer.address,
+                    job_name=installer.name)
+            command_result = installer.set_running(command_result, 'status_install')
+            command_result.update({'state': 'Queued'}, 202)
+            installations.append((installer, command_result))
+
+        # Run after, and before, the other actions on any of the agents
+        ACTIONS_EXECUTOR.submit(
+                self._install_all, installations,
+                priority=ActionExecutor.BULK, keys=self.addresses)
+
+    def _install_all(self, installations):
+        for _, command_result in installations:
+            command_result.update({'state': 'Running'}, 202)
+        self._physical_install_all(installations)
+
+    def _physical_install_all(self, installations):
+        # Check that everything is properly configured
+        checked = []
+        for installer, command_result in installations:
+            with ThreadedAction.storing_failure(command_result):
+                agent, job = installer._get_agent_and_job()
+                checked.append((installer, command_result, agent, job))
+
+        if not checked:
+            return
+
+        # Check os configuration arguments
+        addresses = {agent.address for _, _, agent, _ in checked}
+        try:
+            unreachable, facts = AgentFacts().gather(*addresses, cookie=self.cookie)
+        except errors.ConductorError as e:
+            self._fail_all(checked, e)
+            return
+        supported = []
+        for installer, command_result, agent, job in checked:
+            with ThreadedAction.storing_failure(command_result):
+                if agent.address not in facts:
+                    raise errors.UnprocessableError(
+                            'Cannot retrieve the Os of the agent',
+                            agent_address=agent.address,
+                            job_name=job.name,
+                            failure=unreachable.get(agent.address))
+                installer._check_os(job, facts[agent.address])
+                supported.append((installer, command_result, agent, job))
+
+        installable = []
+        for installation in supported:
+            installer, command_result, agent, job = installation
+            with ThreadedAction.storing_failure(command_result):
+                installer._uninstall_outdated(agent, job)
+                installable.append(installation)
+        if not installable:
+            return
+
+        # Physically install the jobs on the agents
+        agents = {}
+        for _, _, agent, job in installable:
+            agents.setdefault(agent.address, {
+                'collector': agent.collector.address,
+                'logs_port': agent.collector.logs_port,
+                'jobs': [],
+            })['jobs'].append({'name': job.name, 'path': job.path})
+        try:
+            failures = start_playbook('install_jobs', agents, cookie=self.cookie)
+        except errors.ConductorError as e:
+            self._fail_all(installable, e)
+            return
+
+        set_severity = (
+                convert_severity(int(self.severity)) != self.DEFAULT_SYSLOG_SEVERITY
+                or convert_severity(int(self.local_severity)) != self.DEFAULT_SYSLOG_SEVERITY
+        )
+        for installer, command_result, agent, job in installable:
+            with ThreadedAction.storing_failure(command_result):
+                if agent.address in failures:
+                    raise errors.UnprocessableError(
+                            'Ansible playbook execution failed',
+                            **{agent.address: failures[agent.address]})
+                installer._register_installed_job(agent, job, set_severity)
+                command_result.update(None, 204)
+
+    def _fail_all(self, installations, error):
+        for _, command_result, _, _ in installations:
+            command_result.update(error.json, error.ERROR_CODE)
+
 
 class UninstallJob(ThreadedAction, InstalledJobAction):
     """Action responsible for uninstalling a Job on an Agent"""
@@ -1543,22 +1824,6 @@ class UninstallJob(ThreadedAction, InstalledJobAction):
         job = installed_job.job
         self._check_user_can_manage_job(agent, job)
 
-        # Wait until all previous jobs installed on the same agents are done
-        start_date = InstalledJobCommandResult.objects.get(
-                address=self.address,
-                job_name=self.name).status_install.date
-        query = (
-                (
-                    db.models.Q(status_install__date__lt=start_date)
-                    & db.models.Q(status_install__returncode=202)
-                ) | (
-                    db.models.Q(status_uninstall__date__lt=start_date)
-                    & db.models.Q(status_uninstall__returncode=202)
-                )
-        )
-        while InstalledJobCommandResult.objects.filter(query, address=self.address).exists():
-            sleep(1)
-
         OpenBachBaton(agent.address, agent.port).remove_job(job.name)
         start_playbook(
                 'uninstall_job',
@@ -1856,7 +2121,9 @@ class JobInstanceAction(ConductorAction):
                     scenario_id, owner_id,
                     job_instance.arguments,
                     job_instance.start_timestamp,
-                    self.interval)
+                    self.interval,
+                    self.isolation,
+                    self.precise)
         except (AttributeError, errors.ConductorError):
             job_instance.delete()
             raise
@@ -1867,9 +2134,12 @@ class JobInstanceAction(ConductorAction):
 class StartJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for launching a Job on an Agent"""
 
-    def __init__(self, address, name, arguments, date=None, interval=None, offset=0):
+    PRIORITY = ActionExecutor.INTERACTIVE
+
+    def __init__(self, address, name, arguments, date=None, interval=None, offset=0, isolation=None, precise=False):
         super().__init__(address=address, name=name, arguments=arguments,
-                         date=date, interval=interval, offset=offset)
+                         date=date, interval=interval, offset=offset,
+                         isolation=isolation, precise=precise)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -1932,6 +2202,8 @@ class StartJobInstance(ThreadedAction, JobInstanceAction):
 class StopJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for stopping a launched Job"""
 
+    PRIORITY = ActionExecutor.INTERACTIVE
+
     def __init__(self, instance_id=None, date=None, openbach_function_id=None):
         super().__init__(instance_id=instance_id, date=date,
                          openbach_function_id=openbach_function_id)
@@ -1946,45 +2218,23 @@ class StopJobInstance(ThreadedAction, JobInstanceAction):
         return super().action()
 
     def _action(self):
+        error, = StopJobInstances.stop_instances([self], self.date)
+        if error is not None:
+            raise error
+
+    def _get_job_instance_to_stop(self):
         job_instance = self.get_job_instance_or_not_found_error()
         owner = job_instance.started_by
         self._assert_user_in([owner])
-
-        was_stopped = job_instance.is_stopped
-        instance_id = self.instance_id
-        job_name = job_instance.job_name
-
-        if self.date is None:
-            date = 'now'
-            stop_date = timezone.now()
-        else:
-            date = self.date
-            tz = timezone.get_current_timezone()
-            stop_date = datetime.fromtimestamp(date / 1000, tz=tz)
-
-        agent = job_instance.agent
-        try:
-            baton = OpenBachBaton(agent.address, agent.port)
-        except AttributeError:
-            raise errors.ConductorWarning(
-                    'The Agent associated to this JobInstance was '
-                    'uninstalled. Marking the JobInstance stopped anyway.',
-                    job_instance_id=instance_id, job_name=job_name)
-        else:
-            baton.stop_job_instance(job_name, instance_id, date)
-        finally:
-            job_instance.stop_date = stop_date
-            job_instance.save()
-
-        if was_stopped:
-            raise errors.ConductorWarning(
-                    'The requested JobInstance was already stopped. '
-                    'Sent a new stop order to the Agent anyway.',
-                    job_instance_id=instance_id, job_name=job_name)
+        return job_instance
 
 
 class StopJobInstances(ConductorAction):
-    """Action responsible for stopping several launched Job"""
+    """Action responsible for stopping several launched Job.
+
+    Instances running on the same Agent are stopped by a single
+    request, the Agents being contacted concurrently.
+    """
 
     def __init__(self, instance_ids=None, date=None, openbach_function_ids=None):
         super().__init__(instance_ids=instance_ids, date=date,
@@ -1992,19 +2242,140 @@ class StopJobInstances(ConductorAction):
 
     @require_connected_user()
     def _action(self):
+        stoppers = []
         for instance_id in self.instance_ids:
             stop_job = StopJobInstance(instance_id, self.date)
             self.share_user(stop_job)
-            stop_job.action()
+            stoppers.append(stop_job)
+
+        if len(stoppers) < 2:
+            for stop_job in stoppers:
+                stop_job.action()
+        else:
+            self._queue_stops(stoppers)
         return {}, 202
 
+    def _queue_stops(self, stoppers):
+        stops = []
+        for stop_job in stoppers:
+            command_result = stop_job._create_command_result()
+            command_result.update({'state': 'Queued'}, 202)
+            stops.append((stop_job, command_result))
+
+        ACTIONS_EXECUTOR.submit(
+                self._queued_stops, stops,
+                priority=ActionExecutor.INTERACTIVE)
+
+    def _queued_stops(self, stops):
+        for _, command_result in stops:
+            command_result.update({'state': 'Running'}, 202)
+        self.stop_all(stops)
+
+    def stop_all(self, stops):
+        """Stop the JobInstances of the given (StopJobInstance,
+        CommandResult) pairs and store the outcome of each stop
+        into its CommandResult. Return the errors of each stop.
+        """
+        outcomes = self.stop_instances([stop_job for stop_job, _ in stops], self.date)
+        for (_, command_result), error in zip(stops, outcomes):
+            with ThreadedAction.storing_failure(command_result):
+                if error is not None:
+                    raise error
+                command_result.update(None, 204)
+        return outcomes
+
+    @staticmethod
+    def stop_instances(stoppers, date=None):
+        """Stop the JobInstances of the given StopJobInstance
+        actions, sending a single order to each Agent.
+
+        Return, for each action, the error that prevented to
+        stop its JobInstance or None if it was stopped.
+        """
+        if date is None:
+            agent_date = 'now'
+            stop_date = timezone.now()
+        else:
+            agent_date = date
+            tz = timezone.get_current_timezone()
+            stop_date = datetime.fromtimestamp(date / 1000, tz=tz)
+
+        outcomes = [None] * len(stoppers)
+        job_instances = {}
+        agents = defaultdict(list)
+        for index, stop_job in enumerate(stoppers):
+            try:
+                job_instance = stop_job._get_job_instance_to_stop()
+            except Exception as e:
+                outcomes[index] = e
+                continue
+            job_instances[index] = (job_instance, job_instance.is_stopped)
+            agent = job_instance.agent
+            if agent is not None:
+                agents[agent.address, agent.port].append(index)
+
+        def stop_on_agent(agent):
+            instances = [
+                    (job_instances[index][0].job_name, job_instances[index][0].id)
+                    for index in agents[agent]
+            ]
+            baton = OpenBachBaton(*agent)
+            if len(instances) == 1:
+                baton.stop_job_instance(*instances[0], agent_date)
+                return [None]
+            try:
+                baton.stop_job_instances(instances, agent_date)
+            except errors.UnprocessableError:
+                # Agent not knowing every job or not supporting
+                # grouped stops, fallback on individual orders
+                pass
+            else:
+                return [None] * len(instances)
+
+            stopped = []
+            for instance in instances:
+                try:
+                    baton.stop_job_instance(*instance, agent_date)
+                except errors.ConductorError as e:
+                    stopped.append(e)
+                else:
+                    stopped.append(None)
+            return stopped
+
+        for agent, stopped, error in fan_out(stop_on_agent, agents):
+            for index, outcome in zip(agents[agent], stopped or itertools.repeat(error)):
+                outcomes[index] = outcome
+
+        for index, (job_instance, was_stopped) in job_instances.items():
+            job_instance.stop_date = stop_date
+            job_instance.save()
+            if outcomes[index] is not None:
+                continue
+            if job_instance.agent is None:
+                outcomes[index] = errors.ConductorWarning(
+                        'The Agent associated to this JobInstance was '
+                        'uninstalled. Marking the JobInstance stopped anyway.',
+                        job_instance_id=job_instance.id,
+                        job_name=job_instance.job_name)
+            elif was_stopped:
+                outcomes[index] = errors.ConductorWarning(
+                        'The requested JobInstance was already stopped. '
+                        'Sent a new stop order to the Agent anyway.',
+                        job_instance_id=job_instance.id,
+                        job_name=job_instance.job_name)
+
+        return outcomes
+
 
 class RestartJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for restarting a launched Job"""
 
-    def __init__(self, instance_id, arguments, date=None, interval=None):
+    PRIORITY = ActionExecutor.INTERACTIVE
+
+    def __init__(self, instance_id, arguments, date=None, interval=None, isolation=None, precise=False):
         super().__init__(instance_id=instance_id, arguments=arguments,
-                         date=date, interval=interval)
+                         date=date, interval=interval, isolation=isolation,
+                         precise=precise)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -2084,8 +2455,9 @@ class ListJobInstance(JobInstanceAction):
         agent_infos._check_user_can_use_agent()
         agent = agent_infos.get_agent_or_not_found_error()
 
+        updated = self._update_instances(agent) if self.update else set()
         jobs = [
-                self._status_instances(installed_job)
+                self._status_instances(installed_job, updated)
                 for installed_job in agent.installed_jobs.all()
         ]
         return {
@@ -2093,19 +2465,52 @@ class ListJobInstance(JobInstanceAction):
                 'installed_jobs': jobs,
         }, 200
 
-    def _status_instances(self, installed_job):
+    def _update_instances(self, agent):
+        """Update the status of every running JobInstance of the
+        Agent using a single request.
+
+        Return the IDs of the JobInstances successfully updated.
+        """
+        job_instances = {}
+        for job_instance in JobInstance.objects.filter(agent=agent, is_stopped=False):
+            with suppress(errors.ForbiddenError):
+                self._assert_user_in([job_instance.started_by])
+                job_instances[job_instance.id] = job_instance
+
+        if not job_instances:
+            return set()
+
+        try:
+            statuses = OpenBachBaton(agent.address, agent.port).status_job_instances(
+                    (job_instance.job_name, job_instance.id)
+                    for job_instance in job_instances.values())
+        except errors.UnprocessableError:
+            # Let each instance be updated on its own, as older agents
+            # may not understand bulk requests
+            return set()
+
+        updated = set()
+        for status in statuses:
+            with suppress(KeyError):
+                job_instance = job_instances[status['instance_id']]
+                job_instance.set_status(status['status'])
+                updated.add(job_instance.id)
+        return updated
+
+    def _status_instances(self, installed_job, updated):
         return {
                 'job_name': installed_job.job.name,
-                'instances': list(self._status_instances_helper(installed_job)),
+                'instances': list(self._status_instances_helper(installed_job, updated)),
         }
 
-    def _status_instances_helper(self, installed_job):
+    def _status_instances_helper(self, installed_job, updated):
         for job_instance in JobInstance.objects.filter(
                 job_name=installed_job.job.name,
                 agent_name=installed_job.agent.name,
                 is_stopped=False):
             with suppress(errors.ConductorError):
-                status = StatusJobInstance(job_instance.id, self.update)
+                update = self.update and job_instance.id not in updated
+                status = StatusJobInstance(job_instance.id, update)
                 self.share_user(status)
                 yield status.action()[0]
 
@@ -2117,13 +2522,20 @@ class ListJobInstances(ConductorAction):
         super().__init__(addresses=addresses, update=update)
 
     def _action(self):
-        return {'instances': list(self._status_instances())}, 202
+        return {'instances': self._status_instances()}, 202
 
     def _status_instances(self):
-        for address in self.addresses:
-            list_job = ListJobInstance(address, self.update)
-            self.share_user(list_job)
-            yield list_job.action()[0]
+        instances = []
+        for result in fan_out(self._status_instances_of, self.addresses):
+            if result.error is not None:
+                raise result.error
+            instances.append(result.result)
+        return instances
+
+    def _status_instances_of(self, address):
+        list_job = ListJobInstance(address, self.update)
+        self.share_user(list_job)
+        return list_job.action()[0]
 
 
 ############
@@ -2746,10 +3158,12 @@ class ProjectAction(ConductorAction):
                 entity.agent.address for entity in
                 project.entities.exclude(agent__isnull=True)
         ]
-        all_facts = {
-                address: start_playbook('gather_facts', address)
-                for address in addresses
-        }
+        failures, all_facts = AgentFacts().gather(*addresses)
+        if failures:
+            raise errors.UnprocessableError(
+                    'Cannot retrieve the facts of some Agents',
+                    project_name=self.name,
+                    failures=failures)
 
         # Iterate over all interfaces for every agent
         topology = {}
@@ -3024,6 +3438,8 @@ class RefreshTopologyProject(ProjectAction):
     def _action(self):
         project = self.get_project_or_not_found_error()
         self._assert_user_in(project.owners.all())
+        AgentFacts().invalidate(*project.entities.exclude(
+                agent__isnull=True).values_list('agent__address', flat=True))
         if project.networks.filter(address__startswith='imported'):
             self._enforce_topology()
         else:
@@ -3633,10 +4049,10 @@ class KillAll(ConductorAction):
             self.share_user(stop_scenario)
             stop_scenario.action()
 
-        for job in JobInstance.objects.filter(is_stopped=False):
-            stop_job = StopJobInstance(job.id)
-            self.share_user(stop_job)
-            stop_job.action()
+        running = JobInstance.objects.filter(is_stopped=False)
+        stop_jobs = StopJobInstances(list(running.values_list('id', flat=True)))
+        self.share_user(stop_jobs)
+        stop_jobs.action()
 
         return None, 204
 
@@ -3760,6 +4176,17 @@ class DeleteDatabases(CollectorAction):
         return deleted, 200
 
 
+class StatusConductor(ConductorAction):
+    """Action that retrieve the load of the conductor server"""
+
+    @require_connected_user(admin=True)
+    def _action(self):
+        status = ServerMetrics().to_dict()
+        status['actions'] = ACTIONS_EXECUTOR.to_dict()
+        status['playbooks'] = PlaybookMetrics().to_dict()
+        return status, 200
+
+
 class Reboot(ConductorAction):
     """Reboot on a different kernel"""
 
@@ -3769,6 +4196,9 @@ class Reboot(ConductorAction):
     def _action(self):
         agent_infos = InfosAgent(self.address)
         agent = agent_infos.get_agent_or_not_found_error()
-        start_playbook('reboot', agent.address, self.kernel)
+        try:
+            start_playbook('reboot', agent.address, self.kernel)
+        finally:
+            AgentFacts().invalidate(agent.address)
 
         return None, 204
@@ -37,8 +37,11 @@ __credits__ = '''Contributors:
 
 
 import os
+import json
+import time
 import atexit
 import tempfile
+import threading
 import multiprocessing
 from contextlib import suppress
 from collections import defaultdict
@@ -111,18 +114,22 @@ class PlayResult(CallbackBase):
         self._store_failure(result)
 
 
-class SetupResult(PlayResult):
-    def v2_runner_on_ok(self, result):
-        if result._task_fields['action'] in ('setup', 'gather_facts'):
-            self.ansible_facts = result._result['ansible_facts']
-
-
 class SilentResult(PlayResult):
     def raise_for_error(self):
         with suppress(errors.UnprocessableError):
             super().raise_for_error()
 
 
+class FactsResult(SilentResult):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ansible_facts = {}
+
+    def v2_runner_on_ok(self, result):
+        if result._task_fields['action'] in ('setup', 'gather_facts'):
+            self.ansible_facts[result._host.get_name()] = result._result['ansible_facts']
+
+
 class ServicesResult(SilentResult):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -138,13 +145,23 @@ class ServicesResult(SilentResult):
 
 
 class PlaybookBuilder():
-    """Easy Playbook configuration and launching"""
+    """Easy Playbook configuration and launching.
+
+    Playbooks are run against `agent_address` or, if `hosts_variables`
+    is given, against each address it contains using the associated
+    variables for that host only.
+    """
+    MAX_FORKS = 50
 
-    def __init__(self, agent_address, group_name='agent', username=None, password=None):
+    def __init__(self, agent_address, group_name='agent', username=None, password=None, forks=5, hosts_variables=None):
         self.inventory_filename = None
-        with tempfile.NamedTemporaryFile('w', delete=False) as inventory:
-            print('[{}]'.format(group_name), file=inventory)
-            print(agent_address, file=inventory)
+        suffix = '' if hosts_variables is None else '.json'
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as inventory:
+            if hosts_variables is None:
+                print('[{}]'.format(group_name), file=inventory)
+                print(agent_address, file=inventory)
+            else:
+                json.dump({group_name: {'hosts': hosts_variables}}, inventory)
             self.inventory_filename = inventory.name
 
         self.passwords = {
@@ -167,7 +184,7 @@ class PlaybookBuilder():
                 extra_vars=[],
                 flush_cache=None,
                 force_handlers=False,
-                forks=5,
+                forks=forks,
                 inventory=[self.inventory_filename],
                 listhosts=None,
                 listtags=None,
@@ -339,8 +356,7 @@ class PlaybookBuilder():
 
     @classmethod
     def check_connections(cls, *addresses, cookie=None):
-        self = cls('\n'.join(addresses))
-        self.options.forks = len(addresses)
+        self = cls('\n'.join(addresses), forks=len(addresses))
         self.add_variables(collect_metrics=True)
         playbook_results = ServicesResult()
         self.launch_playbook('check_connection', playbook_results, session_cookie=cookie)
@@ -370,6 +386,29 @@ class PlaybookBuilder():
                 jobs=[{'name': job_name, 'path': job_path}])
         self.launch_playbook('install_a_job', session_cookie=cookie)
 
+    @classmethod
+    def install_jobs(cls, agents, cookie=None):
+        """Install several jobs on several agents in a single run.
+
+        `agents` maps the address of each agent to a dictionary holding
+        its 'collector' address and 'logs_port' as well as the 'jobs' to
+        install on it (dictionaries with a 'name' and a 'path' each).
+        Return the failures of the agents for which the installation
+        did not succeed.
+        """
+        hosts_variables = {
+                address: {
+                    'openbach_collector': agent['collector'],
+                    'logstash_logs_port': agent['logs_port'],
+                    'jobs': agent['jobs'],
+                } for address, agent in agents.items()
+        }
+        forks = min(len(agents), cls.MAX_FORKS)
+        self = cls(None, forks=forks, hosts_variables=hosts_variables)
+        playbook_results = SilentResult()
+        self.launch_playbook('install_a_job', playbook_results, session_cookie=cookie)
+        return dict(playbook_results.failure)
+
     @classmethod
     def uninstall_job(cls, address, collector_ip, job_name, job_path, cookie=None):
         self = cls(address)
@@ -417,11 +456,17 @@ class PlaybookBuilder():
         self.launch_playbook('fetch_files', session_cookie=cookie)
 
     @classmethod
-    def gather_facts(cls, address, cookie=None):
-        self = cls(address)
-        playbook_results = SetupResult()
+    def gather_facts_of(cls, *addresses, cookie=None):
+        """Retrieve the facts of several hosts in a single run.
+
+        Return the failures of the unreachable hosts as well as
+        the facts of the other ones.
+        """
+        forks = min(len(addresses), cls.MAX_FORKS)
+        self = cls('\n'.join(addresses), forks=forks)
+        playbook_results = FactsResult()
         self.launch_playbook('check_connection', playbook_results, session_cookie=cookie)
-        return playbook_results.ansible_facts
+        return dict(playbook_results.failure), playbook_results.ansible_facts
 
     @classmethod
     def enable_controller_access(cls, address, username=None, password=None, cookie=None):
@@ -449,19 +494,80 @@ class PlaybookBuilder():
         self.add_variables(influxdb_port=influxdb_port)
         self.launch_playbook('manage_retention_policies', session_cookie=cookie)
 
-def _run_playbook(queue):
-    running_playbooks = set()
+
+PLAYBOOK_WORKERS = 8
+# Ansible keeps global state between runs (plugin loader, inventory
+# and variable caches, display and context singletons), so a worker
+# is only trusted with a single playbook; the fork of its replacement
+# still happens ahead of the next order.
+PLAYBOOKS_PER_WORKER = 1
+_WORKER_RETIRED = 'retired'
+
+
+class PlaybookMetrics:
+    """Collect the time spent by each kind of playbook
+    waiting for a worker and running.
+    """
+    __shared_state = {
+            'playbooks': {},
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+
+    def playbook_done(self, name, queue_wait, run_time):
+        with self._mutex:
+            metrics = self.playbooks.setdefault(name, {
+                'count': 0,
+                'queue_wait': {'sum': 0.0, 'max': 0.0},
+                'run_time': {'sum': 0.0, 'max': 0.0},
+            })
+            metrics['count'] += 1
+            for key, value in (('queue_wait', queue_wait), ('run_time', run_time)):
+                metrics[key]['sum'] += value
+                metrics[key]['max'] = max(metrics[key]['max'], value)
+
+    def to_dict(self):
+        with self._mutex:
+            return {
+                    name: {
+                        'count': metrics['count'],
+                        'queue_wait': dict(metrics['queue_wait'], mean=metrics['queue_wait']['sum'] / metrics['count']),
+                        'run_time': dict(metrics['run_time'], mean=metrics['run_time']['sum'] / metrics['count']),
+                    } for name, metrics in self.playbooks.items()
+            }
+
+
+def _run_playbook(queue, workers=PLAYBOOK_WORKERS):
+    """Dispatch the playbooks to run to a fixed amount of pre-forked
+    workers, replacing the ones that exited after running
+    PLAYBOOKS_PER_WORKER playbooks.
+    """
+    pending = multiprocessing.Queue()
+    pool = {}
 
     while True:
-        check_error = None
+        _fill_pool(pool, queue, pending, workers)
         action = queue.get()
+
         if action is None:
-            for playbook in running_playbooks:
-                playbook.join()
+            for _ in pool:
+                pending.put(None)
+            for worker in pool.values():
+                worker.join()
             return
 
+        if action[0] == _WORKER_RETIRED:
+            _, pid = action
+            with suppress(KeyError):
+                pool.pop(pid).join()
+            continue
+
+        check_error = None
         try:
-            pipe, order, args, kwargs = action
+            pipe, order, args, kwargs, queued = action
         except ValueError as e:
             check_error = errors.ConductorError(
                     'Playbook manager received the wrong '
@@ -485,54 +591,66 @@ def _run_playbook(queue):
         if check_error is not None:
             _terminate_playbook(pipe, check_error.json)
         else:
-            play_book = multiprocessing.Process(
-                    target=_execute_playbook,
-                    args=(play, pipe, args, kwargs))
-            play_book.start()
-            running_playbooks.add(play_book)
+            pending.put(action)
 
-        _clean_finished_playbooks(running_playbooks)
 
+def _fill_pool(pool, queue, pending, workers):
+    for pid, worker in list(pool.items()):
+        if not worker.is_alive():
+            # Killed before retiring by itself
+            worker.join()
+            del pool[pid]
+    while len(pool) < workers:
+        worker = multiprocessing.Process(target=_playbook_worker, args=(queue, pending))
+        worker.start()
+        pool[worker.pid] = worker
+
+
+def _playbook_worker(queue, pending):
+    for _ in range(PLAYBOOKS_PER_WORKER):
+        action = pending.get()
+        if action is None:
+            return
+        pipe, order, args, kwargs, queued = action
+        _execute_playbook(getattr(PlaybookBuilder, order), pipe, args, kwargs, queued)
 
-def _clean_finished_playbooks(playbooks):
-    for playbook in playbooks:
-        playbook.join(0.05)
-    terminated = [playbook for playbook in playbooks if not playbook.is_alive()]
-    for playbook in terminated:
-        playbooks.remove(playbook)
+    # Let the manager fork a fresh worker
+    queue.put((_WORKER_RETIRED, os.getpid()))
 
 
-def _execute_playbook(method, pipe, args, kwargs):
+def _execute_playbook(method, pipe, args, kwargs, queued):
+    started = time.time()
     try:
         result = method(*args, **kwargs)
     except errors.ConductorError as e:
-        _terminate_playbook(pipe, e.json)
+        result = e.json
     except Exception as e:
         error = errors.ConductorError(str(e))
         import traceback
         error.error['traceback'] = traceback.format_exc()
-        _terminate_playbook(pipe, error.json)
-    else:
-        _terminate_playbook(pipe, result)
+        result = error.json
+    _terminate_playbook(pipe, result, (started - queued, time.time() - started))
 
 
-def _terminate_playbook(pipe, error=None):
-    pipe.send(error)
+def _terminate_playbook(pipe, error=None, timings=None):
+    pipe.send((error, timings))
     pipe.close()
 
 
 def start_playbook(name, *args, **kwargs):
     parent_conn, child_conn = multiprocessing.Pipe()
-    _COMMUNICATOR.put((child_conn, name, args, kwargs))
-    result = parent_conn.recv()
+    _COMMUNICATOR.put((child_conn, name, args, kwargs, time.time()))
+    result, timings = parent_conn.recv()
+    if timings is not None:
+        PlaybookMetrics().playbook_done(name, *timings)
     if result is not None and 'response' in result and 'returncode' in result:
         raise errors.ConductorError.copy_from(result)
     return result
 
 
-def setup_playbook_manager():
+def setup_playbook_manager(workers=PLAYBOOK_WORKERS):
     playbook_manager = multiprocessing.Process(
-            target=_run_playbook, args=(_COMMUNICATOR,))
+            target=_run_playbook, args=(_COMMUNICATOR, workers))
     playbook_manager.start()
     atexit.register(playbook_manager.join)
     atexit.register(_COMMUNICATOR.put, None)
@@ -23,13 +23,306 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see http://www.gnu.org/licenses/.
 
+import time
+import syslog
 import ipaddress
+import threading
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+from django import db
 from django.core.serializers.json import DjangoJSONEncoder
 
 
+FanOutResult = namedtuple('FanOutResult', 'item result error')
+
+
 class OpenbachJSONEncoder(DjangoJSONEncoder):
     def default(self, o):
         if isinstance(o, ipaddress._BaseAddress):
             return str(o)
         return super().default(o)
+
+
+def fan_out(function, items, max_workers=16, timeout=None):
+    """Call `function` on each item concurrently, using at most
+    `max_workers` threads, and return a FanOutResult for each item
+    in the order they were given.
+
+    A call still running `timeout` seconds after it started is
+    reported as a TimeoutError; it is not interrupted but its
+    result is ignored. Database connections opened by the workers
+    are closed once they are done.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    started = {}
+
+    def worker(index):
+        started[index] = time.monotonic()
+        try:
+            return function(items[index])
+        finally:
+            db.connections.close_all()
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    futures = {executor.submit(worker, index): index for index in range(len(items))}
+    results = [None] * len(items)
+    pending = set(futures)
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.monotonic()
+                deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+                wait_for = max(min(deadlines) - now, 0) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                try:
+                    results[index] = FanOutResult(items[index], future.result(), None)
+                except Exception as e:
+                    results[index] = FanOutResult(items[index], None, e)
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future in list(pending):
+                    index = futures[future]
+                    if index in started and now - started[index] >= timeout:
+                        pending.discard(future)
+                        error = TimeoutError('No answer after {} seconds'.format(timeout))
+                        results[index] = FanOutResult(items[index], None, error)
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+class Histogram:
+    """Distribution of durations, in seconds, as per-range counts:
+    each bucket counts the values above the previous bound and up
+    to its own, the last one counts the values above every bound.
+
+    The agent keeps an identical copy in openbach_agent.py:
+    agents are installed without the controller code, so both
+    copies are kept on purpose and must be changed together.
+    """
+    BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        value = max(value, 0.0)
+        index = next((i for i, bound in enumerate(self.BOUNDS) if value <= bound), len(self.BOUNDS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        bounds = [str(bound) for bound in self.BOUNDS] + ['+Inf']
+        return {
+                'buckets': dict(zip(bounds, self.buckets)),
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'max': self.max,
+        }
+
+
+class ServerMetrics:
+    """Collect counters and latencies about the
+    requests handled by the conductor server.
+    """
+    __shared_state = {
+            'workers': 0,
+            'busy_workers': 0,
+            'queue_size': 0,
+            'queue_depth': 0,
+            'idle_connections': 0,
+            'accepted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'queue_wait': None,
+            'execution': None,
+            'started': time.time(),
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.queue_wait is None:
+                self.queue_wait = Histogram()
+                self.execution = Histogram()
+
+    def configure(self, workers, queue_size):
+        with self._mutex:
+            self.workers = workers
+            self.queue_size = queue_size
+
+    def request_queued(self, queue_depth):
+        with self._mutex:
+            self.accepted += 1
+            self.queue_depth = queue_depth
+
+    def request_rejected(self):
+        with self._mutex:
+            self.rejected += 1
+
+    def request_started(self, waited, queue_depth):
+        with self._mutex:
+            self.queue_wait.observe(waited)
+            self.queue_depth = queue_depth
+            self.busy_workers += 1
+
+    def request_finished(self, duration):
+        with self._mutex:
+            self.execution.observe(duration)
+            self.busy_workers -= 1
+            self.completed += 1
+
+    def connections_idle(self, amount):
+        with self._mutex:
+            self.idle_connections = amount
+
+    def to_dict(self):
+        with self._mutex:
+            return {
+                    'uptime': time.time() - self.started,
+                    'workers': self.workers,
+                    'busy_workers': self.busy_workers,
+                    'queue_size': self.queue_size,
+                    'queue_depth': self.queue_depth,
+                    'idle_connections': self.idle_connections,
+                    'accepted': self.accepted,
+                    'rejected': self.rejected,
+                    'completed': self.completed,
+                    'queue_wait': self.queue_wait.to_dict(),
+                    'execution': self.execution.to_dict(),
+            }
+
+
+class _Task:
+    def __init__(self, function, args, priority, keys):
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.keys = keys
+        self.waiting = 0  # amount of keys held by earlier tasks
+        self.submitted = time.monotonic()
+
+
+class ActionExecutor:
+    """Run long actions in a bounded amount of threads.
+
+    Interactive actions are always picked before bulk ones, and bulk
+    actions can not use more than `max_bulk_workers` threads so some
+    are left for interactive actions. Actions sharing a key are run
+    one after the other, in submission order; an action submitted
+    with several keys waits for the earlier actions on any of them.
+    """
+    INTERACTIVE = 0
+    BULK = 1
+
+    def __init__(self, max_workers=32, max_bulk_workers=24):
+        self.max_workers = max_workers
+        self.max_bulk_workers = min(max_bulk_workers, max_workers)
+        self._condition = threading.Condition()
+        self._ready = {self.INTERACTIVE: deque(), self.BULK: deque()}
+        self._blocked = {}
+        self._serialized = 0
+        self._running = {self.INTERACTIVE: 0, self.BULK: 0}
+        self._workers = 0
+        self._idle_workers = 0
+        self._queue_wait = Histogram()
+
+    def submit(self, function, *args, priority=BULK, keys=()):
+        """Schedule `function(*args)` for execution"""
+        task = _Task(function, args, priority, tuple(set(keys)))
+        with self._condition:
+            for key in task.keys:
+                if key in self._blocked:
+                    self._blocked[key].append(task)
+                    task.waiting += 1
+                else:
+                    self._blocked[key] = deque()
+            if task.waiting:
+                self._serialized += 1
+            else:
+                self._ready[priority].append(task)
+            self._condition.notify()
+            # Idle workers only account for themselves once awoken, so
+            # compare them to every task they could pick up right now
+            if self._runnable_tasks() > self._idle_workers and self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+
+    def _runnable_tasks(self):
+        bulk_slots = max(self.max_bulk_workers - self._running[self.BULK], 0)
+        return len(self._ready[self.INTERACTIVE]) + min(len(self._ready[self.BULK]), bulk_slots)
+
+    def _next_task(self):
+        if self._ready[self.INTERACTIVE]:
+            return self._ready[self.INTERACTIVE].popleft()
+        if self._ready[self.BULK] and self._running[self.BULK] < self.max_bulk_workers:
+            return self._ready[self.BULK].popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    self._idle_workers += 1
+                    self._condition.wait()
+                    self._idle_workers -= 1
+                    task = self._next_task()
+                self._running[task.priority] += 1
+                self._queue_wait.observe(time.monotonic() - task.submitted)
+
+            try:
+                task.function(*task.args)
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, 'Action {} failed: {}'.format(task.function, e))
+            finally:
+                db.connections.close_all()
+
+            with self._condition:
+                self._running[task.priority] -= 1
+                for key in task.keys:
+                    blocked = self._blocked[key]
+                    if not blocked:
+                        del self._blocked[key]
+                        continue
+                    # Hand the key over to the next task
+                    following = blocked.popleft()
+                    following.waiting -= 1
+                    if not following.waiting:
+                        self._serialized -= 1
+                        self._ready[following.priority].append(following)
+                self._condition.notify_all()
+
+    def to_dict(self):
+        with self._condition:
+            return {
+                    'workers': self._workers,
+                    'max_workers': self.max_workers,
+                    'max_bulk_workers': self.max_bulk_workers,
+                    'queued': {
+                        'interactive': len(self._ready[self.INTERACTIVE]),
+                        'bulk': len(self._ready[self.BULK]),
+                        'serialized': self._serialized,
+                    },
+                    'running': {
+                        'interactive': self._running[self.INTERACTIVE],
+                        'bulk': self._running[self.BULK],
+                    },
+                    'queue_wait': self._queue_wait.to_dict(),
+            }
@@ -33,8 +33,10 @@ backend are complete and well formed. If they do, appropriate actions
 are then performed to fulfill them and return meaningful result to
 the backend.
 
-Messages are received from and send to the backend by the means of
-a FIFO file so any amount of data can easily be transfered.
+Messages are received from and send to the backend as JSON documents
+prefixed by their length (4 bytes, big endian) on a socket that can be
+kept alive for several requests. Backends sending the path to a FIFO
+file instead are still understood.
 """
 
 
@@ -49,7 +51,13 @@ __credits__ = '''Contributors:
 
 import os
 import json
+import time
+import queue
+import struct
+import socket
 import syslog
+import selectors
+import threading
 import traceback
 import socketserver
 from contextlib import suppress
@@ -67,12 +75,13 @@ setup_playbook_manager()
 # We need to create a WSGI application before we
 # can benefit from Django's access to databases
 from django.core.wsgi import get_wsgi_application
-from django.core import signals
+from django import db
+from django.conf import settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 application = get_wsgi_application()
 
 from lib import openbach_conductor
-from lib.utils import OpenbachJSONEncoder
+from lib.utils import OpenbachJSONEncoder, ServerMetrics
 from openbach_django.models import ScenarioInstance, CommandResult, InstalledJobCommandResult
 
 
@@ -88,24 +97,262 @@ def class_from_name(name):
     raise AttributeError
 
 
-class ConductorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+class BoundedThreadPoolMixIn:
+    """Mix-in class to handle requests in a fixed amount of worker
+    threads fed by a bounded queue.
+
+    Requests arriving while the queue is full are refused through
+    `reject_request`, which is called from the thread accepting
+    connections or watching kept alive ones and must not block.
+    Connections kept alive by the request handler (by setting its
+    `keep_alive` attribute) are watched for their next request
+    without holding a worker.
+    """
+    pool_size = 16
+    queue_size = 64
+    keep_alive_timeout = 60  # seconds
+
+    def server_activate(self):
+        super().server_activate()
+        self._queue = queue.Queue(self.queue_size)
+        self._idle = {}
+        self._idle_mutex = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._workers = [
+                threading.Thread(target=self._process_requests, daemon=True)
+                for _ in range(self.pool_size)
+        ]
+        self._watcher = threading.Thread(target=self._watch_idle_connections, daemon=True)
+        self._running = True
+        for worker in self._workers:
+            worker.start()
+        self._watcher.start()
+        ServerMetrics().configure(self.pool_size, self.queue_size)
+
+    def process_request(self, request, client_address):
+        """Queue the request for a worker instead of handling it"""
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            ServerMetrics().request_rejected()
+            self.reject_request(request, client_address)
+        else:
+            ServerMetrics().request_queued(self._queue.qsize())
+
+    def reject_request(self, request, client_address):
+        """Override this to answer requests that can not be queued"""
+        self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def release_resources(self):
+        """Override this to clean up after each request in the worker thread"""
+
+    def _process_requests(self):
+        metrics = ServerMetrics()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address, queued = item
+            started = time.monotonic()
+            metrics.request_started(started - queued, self._queue.qsize())
+            keep_alive = False
+            try:
+                handler = self.finish_request(request, client_address)
+                keep_alive = getattr(handler, 'keep_alive', False)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.release_resources()
+                metrics.request_finished(time.monotonic() - started)
+            if keep_alive and self._running:
+                self._keep_alive(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+    def _keep_alive(self, request, client_address):
+        with self._idle_mutex:
+            self._idle[request] = (client_address, time.monotonic())
+        self._wakeup_writer.send(b'\0')
+
+    def _watch_idle_connections(self):
+        metrics = ServerMetrics()
+        registered = set()
+        while self._running:
+            now = time.monotonic()
+            expired = []
+            with self._idle_mutex:
+                for request, (_, last_used) in list(self._idle.items()):
+                    if now - last_used > self.keep_alive_timeout:
+                        expired.append(request)
+                        del self._idle[request]
+                    elif request not in registered:
+                        self._selector.register(request, selectors.EVENT_READ)
+                        registered.add(request)
+                metrics.connections_idle(len(self._idle))
+
+            for request in expired:
+                if request in registered:
+                    self._selector.unregister(request)
+                    registered.discard(request)
+                self.shutdown_request(request)
+
+            for key, _ in self._selector.select(timeout=1):
+                if key.fileobj is self._wakeup:
+                    with suppress(BlockingIOError):
+                        self._wakeup.recv(4096)
+                    continue
+                request = key.fileobj
+                self._selector.unregister(request)
+                registered.discard(request)
+                with self._idle_mutex:
+                    client_address, _ = self._idle.pop(request)
+                self.process_request(request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._running = False
+        self._wakeup_writer.send(b'\0')
+        for _ in self._workers:
+            with suppress(queue.Full):
+                self._queue.put_nowait(None)
+
+
+class ConductorServer(BoundedThreadPoolMixIn, socketserver.TCPServer):
     """Choose the underlying technology for our sockets servers"""
     allow_reuse_address = True
+    pool_size = getattr(settings, 'CONDUCTOR_WORKERS', 16)
+    queue_size = getattr(settings, 'CONDUCTOR_QUEUE_SIZE', 64)
+
+    def reject_request(self, request, client_address):
+        """Answer with a 503 without reading the request so
+        slow clients do not delay the accepting thread.
+        """
+        error = errors.ServiceUnavailableError(
+                'The conductor is handling too many requests, '
+                'try again later',
+                workers=self.pool_size,
+                queue_size=self.queue_size)
+        answer = json.dumps(error.json).encode()
+        with suppress(OSError):
+            request.setblocking(False)
+            request.send(struct.pack('>I', len(answer)) + answer)
+        self.shutdown_request(request)
+
+    def release_resources(self):
+        """Keep the database connections of the worker opened
+        unless they became unusable.
+        """
+        for connection in db.connections.all():
+            if connection.connection is None or not connection.errors_occurred:
+                continue
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
 
 
 class BackendHandler(socketserver.BaseRequestHandler):
+    REQUEST_TIMEOUT = 10  # seconds to receive a whole request
+
+    def setup(self):
+        self.keep_alive = False
+        self._deadline = time.monotonic() + self.REQUEST_TIMEOUT
+
     def finish(self):
-        """Close the connection after handling a request"""
-        self.request.close()
+        """Close the connection after handling a request unless it should be kept alive"""
+        if not self.keep_alive:
+            self.request.close()
 
     def handle(self):
-        """Handle message comming from the backend"""
+        """Handle a message comming from the backend"""
+
+        try:
+            first_byte = self._receive(1, socket.MSG_PEEK)
+        except OSError:
+            return
 
-        fifo_infos = self.request.recv(4096).decode()
+        if first_byte == b'{':
+            self.handle_fifo()
+        elif first_byte:
+            self.keep_alive = self.handle_message()
+
+    def handle_message(self):
+        """Handle a length-prefixed message and answer the same way.
+
+        Return whether the connection is still usable afterwards.
+        """
+        try:
+            request = self._read_message()
+        except socket.timeout:
+            syslog.syslog(syslog.LOG_ERR, 'Timed out reading a message from the backend')
+            return False
+        except OSError:
+            return False
+        except ValueError as e:
+            syslog.syslog(syslog.LOG_ERR, 'Malformed message from the backend: {}'.format(e))
+            error = errors.BadRequestError('Malformed message', error_message=str(e))
+            self._send_message(error.json)
+            return False
+
+        return self._send_message(self.process(request))
+
+    def _read_message(self):
+        header = self._read_all(4)
+        length, = struct.unpack('>I', header)
+        return json.loads(self._read_all(length).decode())
+
+    def _read_all(self, amount):
+        """Read exactly `amount` bytes from the backend or
+        raise ValueError if the message is truncated.
+        """
+        buffer = bytearray()
+        while len(buffer) < amount:
+            received = self._receive(min(amount - len(buffer), 65536))
+            if not received:
+                raise ValueError(
+                        'truncated message, expected {} bytes '
+                        'but got {}'.format(amount, len(buffer)))
+            buffer.extend(received)
+        return bytes(buffer)
+
+    def _receive(self, size, flags=0):
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('request not received in time')
+        self.request.settimeout(remaining)
+        return self.request.recv(size, flags)
+
+    def _send_message(self, result):
+        answer = json.dumps(result, cls=OpenbachJSONEncoder).encode()
+        try:
+            self.request.settimeout(self.REQUEST_TIMEOUT)
+            self.request.sendall(struct.pack('>I', len(answer)) + answer)
+        except OSError:
+            return False
+        return True
+
+    def handle_fifo(self):
+        """Handle a message sent by the means of a FIFO file"""
+
+        fifo_infos = self._receive(4096).decode()
         fifoname = json.loads(fifo_infos)['fifoname']
         with open(fifoname) as fifo:
             request = json.loads(fifo.read())
 
+        result = self.process(request)
+        self.request.sendall(b'Done')
+        with open(fifoname, 'w') as fifo:
+            json.dump(result, fifo, cls=OpenbachJSONEncoder)
+
+    def process(self, request):
+        """Execute a request and build the result to send to the backend"""
+
         try:
             response, returncode = self.execute_request(request)
         except errors.ConductorError as e:
@@ -126,11 +373,7 @@ class BackendHandler(socketserver.BaseRequestHandler):
         else:
             result = {'response': response, 'returncode': returncode}
             syslog.syslog(syslog.LOG_INFO, '{}'.format(result))
-        finally:
-            self.request.sendall(b'Done')
-            with open(fifoname, 'w') as fifo:
-                json.dump(result, fifo, cls=OpenbachJSONEncoder)
-            signals.request_finished.send(sender=self.__class__)
+        return result
 
     def execute_request(self, request):
         """Analyze the data received to execute the right action"""
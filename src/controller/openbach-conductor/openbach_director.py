@@ -88,7 +88,7 @@ from openbach_django.models import (
 )
 
 from lib.utils import OpenbachJSONEncoder
-from lib.openbach_communicator import receive_all, DEFAULT_UNIX_DOMAIN
+from lib.openbach_communicator import receive_all, OpenBachSubscriber, DEFAULT_UNIX_DOMAIN
 from lib.openbach_conductor import (
         StatusJobInstance as StatusJobInstanceConductor,
         StartScenarioInstance as StartScenarioInstanceConductor,
@@ -106,6 +106,10 @@ from lib.openbach_conductor import (
 
 syslog.openlog('openbach_director', syslog.LOG_PID, syslog.LOG_USER)
 
+STATUS_POLLING_INTERVAL = 2
+STATUS_SAFETY_INTERVAL = 60
+EVENTS_HEARTBEAT_INTERVAL = 5
+
 
 ######################
 # Threads management #
@@ -114,11 +118,17 @@ syslog.openlog('openbach_director', syslog.LOG_PID, syslog.LOG_USER)
 class StatusManager:
     """Manage watches on the director to regularly check in
     agents for JobInstances statuses.
+
+    Agents publishing job events let the director refresh
+    statuses as soon as something happens: watches on their
+    JobInstances are then only kept as a safety net.
     """
 
     __state = {
             'job_instances': defaultdict(set),
+            'watches': {},
             'scenarios': {},
+            'listeners': {},
             '_mutex': threading.Lock(),
             'scheduler': None,
     }
@@ -135,22 +145,95 @@ class StatusManager:
         with suppress(JobLookupError):
             self.scheduler.remove_job('watch_{}'.format(job_id))
 
+    @staticmethod
+    def _agent_of(job_id):
+        try:
+            return JobInstance.objects.get(id=job_id).agent
+        except JobInstance.DoesNotExist:
+            return None
+
+    def _listen_to(self, agent):
+        """Make sure job events of the given Agent are
+        followed and return their listener.
+        """
+        if agent is None:
+            return None
+
+        key = (agent.address, agent.port)
+        try:
+            return self.listeners[key]
+        except KeyError:
+            listener = self.listeners[key] = AgentEventsListener(*key)
+            listener.start()
+            return listener
+
+    def _forget_listener(self, listener):
+        """Stop a listener once none of the watched
+        JobInstances runs on its Agent anymore.
+        """
+        if listener is None:
+            return
+        if any(job_listener is listener for _, _, job_listener in self.watches.values()):
+            return
+        key = (listener.address, listener.port)
+        if self.listeners.get(key) is listener:
+            del self.listeners[key]
+        listener.stop()
+
     def add_job(self, scenario_id, job_id, username):
+        agent = self._agent_of(job_id)
         with self._mutex:
+            listener = self._listen_to(agent)
+            connected = listener is not None and listener.connected.is_set()
             self.job_instances[scenario_id].add(job_id)
+            self.watches[job_id] = (scenario_id, username, listener)
             self.scheduler.add_job(
-                    status_manager, 'interval', seconds=2,
+                    status_manager, 'interval',
+                    seconds=STATUS_SAFETY_INTERVAL if connected else STATUS_POLLING_INTERVAL,
                     args=(job_id, scenario_id, username),
                     id='watch_{}'.format(job_id))
 
     def remove_job(self, scenario_id, job_id):
         with self._mutex:
             jobs = self.job_instances[scenario_id]
-            jobs.remove(job_id)
+            jobs.discard(job_id)
+            _, _, listener = self.watches.pop(job_id, (None, None, None))
             self._stop_watch(job_id)
+            self._forget_listener(listener)
             if not jobs:
                 del self.job_instances[scenario_id]
 
+    def notify(self, job_id):
+        """Refresh the status of a watched JobInstance right away"""
+        with self._mutex:
+            try:
+                scenario_id, username, _ = self.watches[job_id]
+            except KeyError:
+                return
+            self.scheduler.add_job(status_manager, args=(job_id, scenario_id, username))
+
+    def listener_changed(self, listener, resync=False):
+        """Adapt the polling of the JobInstances of an Agent to
+        the state of the connection to its job events.
+        """
+        connected = listener.connected.is_set()
+        interval = STATUS_SAFETY_INTERVAL if connected else STATUS_POLLING_INTERVAL
+        with self._mutex:
+            watched = [
+                    job_id for job_id, (_, _, job_listener)
+                    in self.watches.items()
+                    if job_listener is listener
+            ]
+            for job_id in watched:
+                with suppress(JobLookupError):
+                    self.scheduler.reschedule_job(
+                            'watch_{}'.format(job_id),
+                            trigger='interval', seconds=interval)
+
+        if resync:
+            for job_id in watched:
+                self.notify(job_id)
+
     def add_scenario(self, thread, scenario_id):
         thread.start()
         with self._mutex:
@@ -163,6 +246,72 @@ class StatusManager:
             thread.stop()
 
 
+class AgentEventsListener(threading.Thread):
+    """Follow the job events published by an Agent and
+    refresh the status of the associated JobInstances.
+    """
+
+    def __init__(self, address, port):
+        super().__init__(daemon=True)
+        self.address = address
+        self.port = port
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+        self._epoch = None
+        self._sequence = None
+
+    def stop(self):
+        """Stop following the events of the Agent; effective
+        at the latest on the next heartbeat.
+        """
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._follow_events()
+            except errors.ConductorError as error:
+                agent_message = error.error.get('agent_message')
+                if isinstance(agent_message, dict) and str(agent_message.get('error')).startswith('Unknown action'):
+                    syslog.syslog(
+                            syslog.LOG_INFO,
+                            'Agent {} does not publish job events, '
+                            'polling its JobInstances instead'
+                            .format(self.address))
+                    break
+                syslog.syslog(syslog.LOG_DEBUG, str(error.json))
+            except Exception as error:
+                log_message = {
+                        'message': 'Unexpected exception appeared',
+                        'error': str(error),
+                        'traceback': traceback.format_exc(),
+                }
+                syslog.syslog(syslog.LOG_ERR, str(log_message))
+
+            if self.connected.is_set():
+                self.connected.clear()
+                StatusManager().listener_changed(self)
+            self._stopped.wait(STATUS_POLLING_INTERVAL)
+
+    def _follow_events(self):
+        subscriber = OpenBachSubscriber(self.address, self.port)
+        infos = subscriber.subscribe_job_events(
+                self._epoch, self._sequence,
+                EVENTS_HEARTBEAT_INTERVAL)
+        self._epoch = infos['epoch']
+        self._sequence = infos['sequence']
+        self.connected.set()
+        StatusManager().listener_changed(self, infos['resync'])
+
+        status_manager = StatusManager()
+        for event in subscriber.job_events():
+            if self._stopped.is_set():
+                break
+            with suppress(KeyError):
+                self._sequence = event['sequence']
+                status_manager.notify(event['instance_id'])
+
+
 def status_manager(job_instance_id, scenario_instance_id, username):
     """Check and update the status of a job instance based
     on the informations returned by its agent.
@@ -238,6 +387,10 @@ class StopJobInstance(OpenbachFunctionMixin, StopJobInstanceConductor):
         openbach function id and store it in the instance for the
         _action to take effect.
         """
+        self._retrieve_instance_id(openbach_function_instance)
+        return super().openbach_function(openbach_function_instance)
+
+    def _retrieve_instance_id(self, openbach_function_instance):
         scenario = openbach_function_instance.scenario_instance
         actual_id = (
                 scenario
@@ -262,23 +415,35 @@ class StopJobInstance(OpenbachFunctionMixin, StopJobInstanceConductor):
                     'not associated to a launched job',
                     openbach_function_id=actual_id,
                     openbach_function_name=openbach_function_to_stop.name)
-        return super().openbach_function(openbach_function_instance)
 
 
 class StopJobInstances(OpenbachFunctionMixin, StopJobInstancesConductor):
     def openbach_function(self, openbach_function_instance):
+        self.openbach_function_instance = openbach_function_instance
         issues = []
         has_error = False
+        stops = []
         for stop_id in self.openbach_function_ids:
+            stop_job = StopJobInstance(date=self.date, openbach_function_id=stop_id)
+            self.share_user(stop_job)
+            stop_job.openbach_function_instance = openbach_function_instance
             try:
-                stop_job = StopJobInstance(date=self.date, openbach_function_id=stop_id)
-                self.share_user(stop_job)
-                stop_job.openbach_function(openbach_function_instance)
-            except errors.ConductorWarning as e:
-                issues.append(e.json)
+                stop_job._retrieve_instance_id(openbach_function_instance)
             except errors.ConductorError as e:
                 issues.append(e.json)
                 has_error = True
+            else:
+                stops.append((stop_job, stop_job._create_command_result()))
+
+        for error in self.stop_all(stops):
+            if isinstance(error, errors.ConductorWarning):
+                issues.append(error.json)
+            elif isinstance(error, errors.ConductorError):
+                issues.append(error.json)
+                has_error = True
+            elif error is not None:
+                issues.append({'message': str(error)})
+                has_error = True
         if has_error:
             raise errors.ConductorError(
                     'Stopping one or more JobInstance produced an error',
@@ -363,13 +528,12 @@ class StopScenarioInstance(OpenbachFunctionMixin, StopScenarioInstanceConductor)
         scenario_instance = self.get_scenario_instance_or_not_found_error()
         if not scenario_instance.is_stopped:
             scenario_instance.stop()
+            running_jobs = []
             for openbach_function in scenario_instance.openbach_functions_instances.all():
                 with suppress(JobInstance.DoesNotExist):
                     job_instance = openbach_function.started_job
                     if not job_instance.is_stopped:
-                        stopper = StopJobInstance(job_instance.id)
-                        self.share_user(stopper)
-                        stopper.action()
+                        running_jobs.append(job_instance.id)
                 with suppress(ScenarioInstance.DoesNotExist):
                     subscenario_instance = openbach_function.started_scenario
                     if not subscenario_instance.is_stopped:
@@ -378,6 +542,10 @@ class StopScenarioInstance(OpenbachFunctionMixin, StopScenarioInstanceConductor)
                         stopper.action()
                 if openbach_function.status == 'Running':
                     openbach_function.set_status('Stopped')
+            # Stop the jobs of each agent at once
+            stopper = StopJobInstances(running_jobs)
+            self.share_user(stopper)
+            stopper.action()
             StatusManager().remove_scenario(self.instance_id)
         return None, 204
 
@@ -0,0 +1,399 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2020 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Unit tests of the building blocks of the conductor.
+
+Run them from this folder, with the backend in the Python path:
+PYTHONPATH=../backend/ python3 -m unittest tests
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import time
+import struct
+import socket
+import unittest
+import threading
+from unittest import mock
+
+# Some helpers close the database connections of their threads
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from lib import errors, openbach_communicator, openbach_conductor
+from lib.utils import fan_out, Histogram, ActionExecutor
+from lib.openbach_communicator import AgentConnectionPool
+from lib.openbach_conductor import AgentFacts
+
+
+class WaitMixin:
+    def wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail('Condition not met after {} seconds'.format(timeout))
+            time.sleep(0.01)
+
+
+class HistogramTest(unittest.TestCase):
+    # Same cases for the copies in the agent and the conductor
+    def test_buckets_count_values_per_range(self):
+        histogram = Histogram()
+        for value in (0.0005, 0.001, 0.002, 0.7, 3600):
+            histogram.observe(value)
+
+        summary = histogram.to_dict()
+        self.assertEqual(summary['buckets']['0.001'], 2)
+        self.assertEqual(summary['buckets']['0.005'], 1)
+        self.assertEqual(summary['buckets']['1'], 1)
+        self.assertEqual(summary['buckets']['+Inf'], 1)
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['max'], 3600)
+
+    def test_summary(self):
+        histogram = Histogram()
+        for value in (-1, 1, 2):
+            histogram.observe(value)
+
+        summary = histogram.to_dict()
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['sum'], 3)
+        self.assertEqual(summary['mean'], 1)
+        self.assertEqual(summary['max'], 2)
+        # Negative durations are clamped to 0
+        self.assertEqual(summary['buckets']['0.001'], 1)
+
+    def test_empty(self):
+        summary = Histogram().to_dict()
+        self.assertEqual(summary['count'], 0)
+        self.assertEqual(summary['mean'], 0.0)
+        self.assertEqual(sum(summary['buckets'].values()), 0)
+
+
+class FanOutTest(unittest.TestCase):
+    def test_results_in_order(self):
+        results = fan_out(lambda value: 10 // value, [1, 0, 5])
+        self.assertEqual([result.item for result in results], [1, 0, 5])
+        self.assertEqual(results[0].result, 10)
+        self.assertIsInstance(results[1].error, ZeroDivisionError)
+        self.assertIsNone(results[2].error)
+        self.assertEqual(results[2].result, 2)
+
+    def test_no_items(self):
+        self.assertEqual(fan_out(str, []), [])
+
+    def test_timeout_counted_from_start(self):
+        # Two sequential calls take longer than the timeout
+        # but each of them completes in time
+        results = fan_out(time.sleep, [0.2, 0.2], max_workers=1, timeout=0.3)
+        self.assertEqual([result.error for result in results], [None, None])
+
+    def test_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = time.monotonic()
+        results = fan_out(lambda wait: wait and release.wait(5), [False, True], timeout=0.2)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, TimeoutError)
+
+
+class ActionExecutorTest(WaitMixin, unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def blocker(self, name):
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self.release.wait(5)
+            self.order.append(name)
+        return block, started
+
+    def test_interactive_first(self):
+        executor = ActionExecutor(max_workers=1)
+        block, started = self.blocker('blocker')
+        executor.submit(block)
+        self.assertTrue(started.wait(5))
+
+        executor.submit(self.order.append, 'bulk')
+        executor.submit(self.order.append, 'interactive', priority=ActionExecutor.INTERACTIVE)
+        self.release.set()
+        self.wait_for(lambda: len(self.order) == 3)
+        self.assertEqual(self.order, ['blocker', 'interactive', 'bulk'])
+
+    def test_bulk_workers_limit(self):
+        executor = ActionExecutor(max_workers=3, max_bulk_workers=1)
+        block, started = self.blocker('blocker')
+        executor.submit(block)
+        self.assertTrue(started.wait(5))
+
+        executor.submit(self.order.append, 'bulk')
+        executor.submit(self.order.append, 'interactive', priority=ActionExecutor.INTERACTIVE)
+        self.wait_for(lambda: self.order == ['interactive'])
+        state = executor.to_dict()
+        self.assertEqual(state['running']['bulk'], 1)
+        self.assertEqual(state['queued']['bulk'], 1)
+
+        self.release.set()
+        self.wait_for(lambda: len(self.order) == 3)
+        self.assertEqual(self.order, ['interactive', 'blocker', 'bulk'])
+
+    def test_keys_serialize_actions(self):
+        executor = ActionExecutor(max_workers=4)
+        block, started = self.blocker('first')
+        executor.submit(block, keys=['agent1'])
+        self.assertTrue(started.wait(5))
+
+        executor.submit(self.order.append, 'second', keys=['agent1', 'agent2'])
+        executor.submit(self.order.append, 'third', keys=['agent2'])
+        executor.submit(self.order.append, 'unrelated', keys=['agent3'])
+        self.wait_for(lambda: self.order == ['unrelated'])
+        self.assertEqual(executor.to_dict()['queued']['serialized'], 2)
+
+        self.release.set()
+        self.wait_for(lambda: len(self.order) == 4)
+        self.assertEqual(self.order, ['unrelated', 'first', 'second', 'third'])
+        self.assertEqual(executor.to_dict()['queued']['serialized'], 0)
+
+    def test_every_action_runs(self):
+        executor = ActionExecutor(max_workers=4)
+        for index in range(100):
+            executor.submit(self.order.append, index)
+        self.wait_for(lambda: len(self.order) == 100)
+        self.assertCountEqual(self.order, range(100))
+        self.assertLessEqual(executor.to_dict()['workers'], 4)
+
+    def test_failing_action(self):
+        executor = ActionExecutor(max_workers=1)
+        executor.submit(lambda: 1 / 0)
+        executor.submit(self.order.append, 'after')
+        self.wait_for(lambda: self.order == ['after'])
+
+
+class FakeAgent(threading.Thread):
+    """Answer the requests received on one end of a socketpair
+    like an agent would, echoing their command.
+    """
+
+    def __init__(self, connection, requests=None, request_id_offset=0):
+        super().__init__(daemon=True)
+        self.connection = connection
+        self.requests = requests
+        self.request_id_offset = request_id_offset
+        self.start()
+
+    def _receive(self, amount):
+        buffer = b''
+        while len(buffer) < amount:
+            received = self.connection.recv(amount - len(buffer))
+            if not received:
+                raise EOFError
+            buffer += received
+        return buffer
+
+    def run(self):
+        served = 0
+        with self.connection:
+            while self.requests is None or served < self.requests:
+                try:
+                    length, = struct.unpack('>I', self._receive(4))
+                    request = json.loads(self._receive(length).decode())
+                except (EOFError, OSError):
+                    return
+                answer = json.dumps({
+                    'status': 'OK',
+                    'result': request['command'],
+                    'request_id': request['request_id'] + self.request_id_offset,
+                }).encode()
+                self.connection.sendall(struct.pack('>I', len(answer)) + answer)
+                served += 1
+
+
+class SocketPairConnection(openbach_communicator._AgentConnection):
+    """Pooled connection talking to a FakeAgent"""
+
+    def __init__(self, address, **agent_options):
+        self._address = address
+        self.socket, agent_socket = socket.socketpair()
+        self.socket.settimeout(2)
+        self.last_used = time.monotonic()
+        self.agent = FakeAgent(agent_socket, **agent_options)
+
+
+class AgentConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = AgentConnectionPool()
+        self.addCleanup(self.pool.close)
+        self.connections = []
+        self.agent_options = {}
+        patcher = mock.patch.object(openbach_communicator, '_AgentConnection', self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, address):
+        connection = SocketPairConnection(address, **self.agent_options)
+        self.connections.append(connection)
+        return connection
+
+    def test_connection_reused(self):
+        for command in ('status', 'list'):
+            response = self.pool.request(('agent', 1112), {'command': command})
+            self.assertEqual(response['result'], command)
+        self.assertEqual(len(self.connections), 1)
+
+        self.pool.request(('other_agent', 1112), {'command': 'status'})
+        self.assertEqual(len(self.connections), 2)
+
+    def test_closed_connection_replaced(self):
+        self.agent_options['requests'] = 1
+        self.pool.request(('agent', 1112), {'command': 'status'})
+        self.connections[0].agent.join(5)
+
+        response = self.pool.request(('agent', 1112), {'command': 'list'})
+        self.assertEqual(response['result'], 'list')
+        self.assertEqual(len(self.connections), 2)
+        self.assertIsNone(self.connections[0].socket)
+
+    def test_expired_connection_replaced(self):
+        self.pool.request(('agent', 1112), {'command': 'status'})
+        with mock.patch.object(self.pool, 'IDLE_TIMEOUT', -1):
+            self.pool.request(('agent', 1112), {'command': 'status'})
+        self.assertEqual(len(self.connections), 2)
+        self.assertIsNone(self.connections[0].socket)
+
+    def test_mismatched_answer(self):
+        self.agent_options['request_id_offset'] = 1
+        with self.assertRaises(errors.UnprocessableError):
+            self.pool.request(('agent', 1112), {'command': 'status'})
+        # The connection is not reused for the next request
+        self.assertIsNone(self.connections[0].socket)
+
+
+class AgentFactsTest(WaitMixin, unittest.TestCase):
+    def setUp(self):
+        cache = AgentFacts()
+        for name in ('facts', 'failures', 'gathering', 'generations'):
+            getattr(cache, name).clear()
+            self.addCleanup(getattr(cache, name).clear)
+
+        self.runs = []
+        self.unreachable = {}
+        patcher = mock.patch.object(openbach_conductor, 'start_playbook', self.gather_facts_of)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def gather_facts_of(self, name, *addresses, cookie=None):
+        self.assertEqual(name, 'gather_facts_of')
+        self.runs.append(addresses)
+        failures = {
+                address: failure
+                for address, failure in self.unreachable.items()
+                if address in addresses
+        }
+        facts = {
+                address: {'ansible_hostname': address}
+                for address in addresses
+                if address not in failures
+        }
+        return failures, facts
+
+    def test_single_run_then_cached(self):
+        failures, facts = AgentFacts().gather('10.0.0.1', '10.0.0.2')
+        self.assertEqual(failures, {})
+        self.assertEqual(set(facts), {'10.0.0.1', '10.0.0.2'})
+        self.assertEqual(len(self.runs), 1)
+
+        _, facts = AgentFacts().gather('10.0.0.2', '10.0.0.3')
+        self.assertEqual(set(facts), {'10.0.0.2', '10.0.0.3'})
+        self.assertEqual(self.runs[1], ('10.0.0.3',))
+        self.assertEqual(AgentFacts().gather_one('10.0.0.1'), {'ansible_hostname': '10.0.0.1'})
+        self.assertEqual(len(self.runs), 2)
+
+    def test_expiration(self):
+        AgentFacts().gather('10.0.0.1')
+        with mock.patch.object(AgentFacts, 'TTL', 0):
+            AgentFacts().gather('10.0.0.1')
+        self.assertEqual(len(self.runs), 2)
+
+    def test_invalidate(self):
+        AgentFacts().gather('10.0.0.1', '10.0.0.2')
+        AgentFacts().invalidate('10.0.0.1')
+        AgentFacts().gather('10.0.0.1', '10.0.0.2')
+        self.assertEqual([set(run) for run in self.runs], [{'10.0.0.1', '10.0.0.2'}, {'10.0.0.1'}])
+
+    def test_unreachable(self):
+        self.unreachable['10.0.0.2'] = 'Host unreachable'
+        failures, facts = AgentFacts().gather('10.0.0.1', '10.0.0.2')
+        self.assertEqual(failures, {'10.0.0.2': 'Host unreachable'})
+        self.assertEqual(set(facts), {'10.0.0.1'})
+
+        # Failures are not cached
+        with self.assertRaises(errors.UnprocessableError):
+            AgentFacts().gather_one('10.0.0.2')
+        self.assertEqual(self.runs[-1], ('10.0.0.2',))
+
+    def test_concurrent_gathering(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        gather_facts_of = self.gather_facts_of
+
+        def slow_gather_facts_of(*args, **kwargs):
+            release.wait(5)
+            return gather_facts_of(*args, **kwargs)
+
+        results = []
+        with mock.patch.object(openbach_conductor, 'start_playbook', slow_gather_facts_of):
+            threads = [
+                    threading.Thread(target=lambda: results.append(AgentFacts().gather('10.0.0.1')))
+                    for _ in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+            self.wait_for(lambda: AgentFacts().gathering == {'10.0.0.1'})
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual(len(results), 2)
+        for failures, facts in results:
+            self.assertEqual(set(facts), {'10.0.0.1'})
+
+
+if __name__ == '__main__':
+    unittest.main()